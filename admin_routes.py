@@ -0,0 +1,150 @@
+"""
+Admin routes for the 0xC Chat API.
+
+Only the users listed in ADMIN_USERNAMES can use these routes.
+"""
+
+import os
+from flask import Blueprint, request, jsonify, send_file
+import memory
+import profiler
+from routes import int_arg
+from auth import token_required, admin_required
+from api_key import api_key_required
+
+# Create a Blueprint for the admin routes
+admin = Blueprint('admin', __name__)
+
+def profile_not_found(profile_id):
+    """Build the error response for a profile that does not exist."""
+    return jsonify({
+        'status': 'error',
+        'message': f'Profile {profile_id} not found'
+    }), 404
+
+@admin.route('/profiles', methods=['GET'])
+@api_key_required
+@token_required
+@admin_required
+def list_profiles(current_user):
+    """List the request profiles, newest first (requires admin)."""
+    return jsonify({
+        'status': 'success',
+        'data': profiler.list_profiles()
+    })
+
+@admin.route('/profiles/<profile_id>', methods=['GET'])
+@api_key_required
+@token_required
+@admin_required
+def get_profile(current_user, profile_id):
+    """Get the metadata of a request profile (requires admin)."""
+    profile = profiler.get_profile(profile_id)
+    if profile is None:
+        return profile_not_found(profile_id)
+
+    return jsonify({
+        'status': 'success',
+        'data': profile
+    })
+
+@admin.route('/profiles/<profile_id>/download', methods=['GET'])
+@api_key_required
+@token_required
+@admin_required
+def download_profile(current_user, profile_id):
+    """Download the data file of a request profile (requires admin).
+
+    cProfile profiles are in the pstats format, sampled profiles in the
+    collapsed stack format.
+    """
+    profile = profiler.get_profile(profile_id)
+    path = profiler.get_profile_file(profile) if profile is not None else None
+    if path is None or not os.path.exists(path):
+        return profile_not_found(profile_id)
+
+    mimetype = 'application/octet-stream' if profile['kind'] == 'cprofile' else 'text/plain'
+    return send_file(os.path.abspath(path), mimetype=mimetype, as_attachment=True,
+                     download_name=os.path.basename(path))
+
+@admin.route('/memory', methods=['GET'])
+@api_key_required
+@token_required
+@admin_required
+def get_memory_report(current_user):
+    """Report the memory held by the caches, indexes and model objects of this worker (requires admin)."""
+    return jsonify({
+        'status': 'success',
+        'data': memory.memory_report()
+    })
+
+@admin.route('/memory/snapshots', methods=['POST'])
+@api_key_required
+@token_required
+@admin_required
+def take_memory_snapshot(current_user):
+    """Take a tracemalloc snapshot of this worker (requires admin).
+
+    The first snapshot starts tracing, so it only covers the allocations
+    made from then on; compare later snapshots to it.
+    """
+    return jsonify({
+        'status': 'success',
+        'message': 'Snapshot taken',
+        'data': memory.take_snapshot()
+    }), 201
+
+@admin.route('/memory/snapshots', methods=['GET'])
+@api_key_required
+@token_required
+@admin_required
+def list_memory_snapshots(current_user):
+    """List the tracemalloc snapshots, newest first (requires admin)."""
+    return jsonify({
+        'status': 'success',
+        'data': memory.list_snapshots()
+    })
+
+@admin.route('/memory/snapshots', methods=['DELETE'])
+@api_key_required
+@token_required
+@admin_required
+def stop_memory_tracing(current_user):
+    """Stop tracing this worker's allocations and delete its snapshots (requires admin)."""
+    return jsonify({
+        'status': 'success',
+        'message': 'Tracing stopped',
+        'data': memory.stop_tracing()
+    })
+
+@admin.route('/memory/snapshots/<snapshot_id>', methods=['GET'])
+@api_key_required
+@token_required
+@admin_required
+def get_memory_snapshot(current_user, snapshot_id):
+    """Get the largest allocation sites of a snapshot (requires admin).
+
+    With compare=<snapshot_id>, get the sites that grew most since that
+    earlier snapshot instead. Sites are grouped by group_by: lineno
+    (default), filename or traceback.
+    """
+    try:
+        limit = int_arg('limit', 20, minimum=1, maximum=1000)
+        statistics = memory.snapshot_statistics(snapshot_id, request.args.get('compare'),
+                                                request.args.get('group_by', 'lineno'), limit)
+    except ValueError as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
+
+    if statistics is None:
+        return jsonify({
+            'status': 'error',
+            'message': 'Snapshot not found'
+        }), 404
+
+    return jsonify({
+        'status': 'success',
+        'data': statistics
+    })
@@ -5,6 +5,7 @@ API Key middleware for the 0xC Chat API.
 from functools import wraps
 from flask import request, jsonify
 from env import SECRET_KEY, SECRET_KEY_ENABLED
+from timing import span
 
 def api_key_required(f):
     """
@@ -19,20 +20,21 @@ def api_key_required(f):
         if not SECRET_KEY_ENABLED:
             return f(*args, **kwargs)
         
-        # Check if X-API-Key header is present
-        api_key = request.headers.get('X-API-Key')
-        if not api_key:
-            return jsonify({
-                'status': 'error',
-                'message': 'API key is missing'
-            }), 401
-        
-        # Check if the API key is valid
-        if api_key != SECRET_KEY:
-            return jsonify({
-                'status': 'error',
-                'message': 'Invalid API key'
-            }), 401
+        with span('auth.api_key'):
+            # Check if X-API-Key header is present
+            api_key = request.headers.get('X-API-Key')
+            if not api_key:
+                return jsonify({
+                    'status': 'error',
+                    'message': 'API key is missing'
+                }), 401
+
+            # Check if the API key is valid
+            if api_key != SECRET_KEY:
+                return jsonify({
+                    'status': 'error',
+                    'message': 'Invalid API key'
+                }), 401
         
         # API key is valid, proceed
         return f(*args, **kwargs)
@@ -2,9 +2,16 @@ from flask import Flask, jsonify
 from flask_cors import CORS
 from routes import api
 from auth_routes import auth
+from room_routes import rooms
+from attachment_routes import attachments
+from admin_routes import admin
 from config import config
 import json_storage
-from env import FLASK_ENV, API_PREFIX
+import metrics
+import profiler
+import retention
+import timing
+from env import FLASK_ENV, API_PREFIX, METRICS_ENABLED, PROFILER_ENABLED
 
 def create_app(config_name=None):
     """Create and configure the Flask application."""
@@ -20,12 +27,32 @@ def create_app(config_name=None):
     # Initialize JSON storage
     json_storage.init_storage()
 
+    # Remove expired refresh tokens in the background
+    json_storage.start_token_sweeper()
+
+    # Archive or drop expired messages in the background
+    retention.start_retention_worker()
+
     # Enable CORS
     CORS(app)
 
+    # Time each request and report it in a Server-Timing header
+    timing.init_app(app)
+
+    # Count and time requests, and serve the metrics of every worker at /metrics
+    if METRICS_ENABLED:
+        metrics.init_app(app)
+
+    # Profile slow requests and a random sample of requests
+    if PROFILER_ENABLED:
+        profiler.init_app(app)
+
     # Register blueprints
     app.register_blueprint(api, url_prefix=API_PREFIX)
     app.register_blueprint(auth, url_prefix=f'{API_PREFIX}/auth')
+    app.register_blueprint(rooms, url_prefix=f'{API_PREFIX}/rooms')
+    app.register_blueprint(attachments, url_prefix=f'{API_PREFIX}/attachments')
+    app.register_blueprint(admin, url_prefix=f'{API_PREFIX}/admin')
 
     # Root route
     @app.route('/')
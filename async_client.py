@@ -0,0 +1,426 @@
+#!/usr/bin/env python
+"""
+Asyncio client for the 0xC Chat API.
+
+AsyncChatAPIClient has the same methods as ChatAPIClient in
+test_client.py, as coroutines, for services that keep many requests in
+flight at once without a thread for each:
+
+    async with AsyncChatAPIClient("http://localhost:5000") as client:
+        await client.login("alice", "password123")
+        messages = await asyncio.gather(*(client.get_message(i) for i in message_ids))
+
+Requests share a pool of keep-alive connections. The access token is
+refreshed before a request once its refresh_at time has passed, and
+concurrent requests that find it due share a single refresh.
+
+Requirements:
+    - aiohttp library: pip install aiohttp
+"""
+
+import asyncio
+import json
+import time
+
+
+class AsyncChatAPIClient:
+    """Asyncio client for interacting with the 0xC Chat API."""
+
+    def __init__(self, base_url="http://localhost:5000", api_key=None, session=None, pool_size=100):
+        """Initialize the client with the API base URL and optional API key.
+
+        Args:
+            base_url: The base URL of the API
+            api_key: The API key, if SECRET_KEY_ENABLED=1
+            session: The aiohttp session to send requests with; by default one
+                is created on first use and closed by close()
+            pool_size: Maximum number of connections of the default session
+        """
+        self.base_url = base_url
+        self.api_key = api_key
+        self.pool_size = pool_size
+        self.access_token = None
+        self.refresh_token = None
+        self.user_info = None
+        self.refresh_at = None
+        self.last_error = None
+        self._session = session
+        self._owns_session = session is None
+        self._refresh_task = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        """Close the default session and its connections."""
+        if self._owns_session and self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _get_session(self):
+        """Get the session, creating the default one with its connection pool if needed."""
+        if self._session is None:
+            import aiohttp
+            self._session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.pool_size))
+        return self._session
+
+    def _get_headers(self, include_auth=False):
+        """Get headers for API requests."""
+        headers = {"Content-Type": "application/json"}
+
+        # Add API key if provided
+        if self.api_key:
+            headers["X-API-Key"] = self.api_key
+
+        # Add authorization token if available and requested
+        if include_auth and self.access_token:
+            headers["Authorization"] = f"Bearer {self.access_token}"
+
+        return headers
+
+    async def _request(self, method, path, include_auth=False, **kwargs):
+        """Send a request, first refreshing the access token if it is due when authenticating.
+
+        Returns:
+            The response data, or None on error, with the error message in last_error
+        """
+        if include_auth:
+            if not self.access_token:
+                self.last_error = "Not logged in"
+                return None
+
+            # Check if token needs refreshing
+            await self.refresh_token_if_needed()
+
+        return await self._send(method, path, include_auth, **kwargs)
+
+    async def _send(self, method, path, include_auth=False, **kwargs):
+        """Send a request and get its response data, or None on error."""
+        # aiohttp does not accept None query parameters
+        if kwargs.get("params"):
+            kwargs["params"] = {key: value for key, value in kwargs["params"].items() if value is not None}
+
+        async with self._get_session().request(method, f"{self.base_url}{path}",
+                                               headers=self._get_headers(include_auth), **kwargs) as response:
+            return await self._handle_response(response)
+
+    async def _handle_response(self, response):
+        """Handle API response, checking for errors."""
+        try:
+            data = await response.json(content_type=None)
+        except json.JSONDecodeError:
+            self.last_error = f"Invalid JSON response - {await response.text()}"
+            return None
+
+        if response.status >= 400 or not data or data.get("status") != "success":
+            self.last_error = (data or {}).get("message", "Unknown error")
+            return None
+
+        self.last_error = None
+        return data
+
+    async def register(self, username, password, email=None):
+        """Register a new user."""
+        payload = {
+            "username": username,
+            "password": password
+        }
+
+        if email:
+            payload["email"] = email
+
+        return await self._request("POST", "/api/auth/register", json=payload) is not None
+
+    async def login(self, username, password):
+        """Login and get access and refresh tokens."""
+        data = await self._request("POST", "/api/auth/login", json={"username": username, "password": password})
+        if data is None:
+            return False
+
+        self.access_token = data["data"]["access_token"]
+        self.refresh_token = data["data"]["refresh_token"]
+        self.user_info = data["data"]["user"]
+
+        # Get token info to know when to refresh
+        await self.get_token_info()
+        return True
+
+    async def get_token_info(self):
+        """Get information about the current token."""
+        if not self.access_token:
+            self.last_error = "Not logged in"
+            return None
+
+        # Sent directly, as the refresh check itself depends on the token info
+        data = await self._send("GET", "/api/auth/token-info", include_auth=True)
+        if data is None:
+            return None
+
+        token_info = data["data"]["token_info"]
+        self.refresh_at = token_info.get("refresh_at")
+        return token_info
+
+    async def refresh_token_if_needed(self):
+        """Check if token needs refreshing and refresh if necessary."""
+        if not self.refresh_at:
+            return False
+
+        if int(time.time()) >= self.refresh_at:
+            return await self.refresh_access_token()
+
+        return False
+
+    async def refresh_access_token(self):
+        """Refresh the access token using the refresh token.
+
+        Concurrent calls share a single refresh request and its result.
+        """
+        if self._refresh_task is None:
+            self._refresh_task = asyncio.ensure_future(self._refresh())
+
+        # Shielded so that a cancelled caller does not cancel the refresh the others wait for
+        return await asyncio.shield(self._refresh_task)
+
+    async def _refresh(self):
+        """Refresh the access token and get its refresh time."""
+        try:
+            if not self.refresh_token:
+                self.last_error = "No refresh token available"
+                return False
+
+            data = await self._request("POST", "/api/auth/refresh", json={"refresh_token": self.refresh_token})
+            if data is None:
+                return False
+
+            self.access_token = data["data"]["access_token"]
+
+            # Update token info
+            await self.get_token_info()
+            return True
+        finally:
+            # Cleared once refresh_at is updated, so later callers see the new time instead
+            self._refresh_task = None
+
+    async def logout(self):
+        """Logout and invalidate the refresh token."""
+        if not self.refresh_token:
+            self.last_error = "Not logged in"
+            return False
+
+        if await self._request("POST", "/api/auth/logout", json={"refresh_token": self.refresh_token}) is None:
+            return False
+
+        self._clear_session()
+        return True
+
+    async def logout_all(self):
+        """Logout from every session by invalidating all refresh tokens of the user."""
+        if await self._request("POST", "/api/auth/logout-all", include_auth=True) is None:
+            return False
+
+        self._clear_session()
+        return True
+
+    def _clear_session(self):
+        """Forget the tokens and user of a logged out session."""
+        self.access_token = None
+        self.refresh_token = None
+        self.user_info = None
+        self.refresh_at = None
+
+    async def send_message(self, content, recipient_id=None, attachments=None):
+        """Send a new message.
+
+        Args:
+            content: The content of the message
+            recipient_id: Optional recipient user ID for private messages
+            attachments: Optional list of hashes of uploaded attachments
+        """
+        payload = {"content": content}
+        if recipient_id:
+            payload["recipient_id"] = recipient_id
+        if attachments:
+            payload["attachments"] = attachments
+
+        data = await self._request("POST", "/api/messages", include_auth=True, json=payload)
+        return data["data"] if data else None
+
+    async def send_messages_batch(self, messages):
+        """Send several messages with one request.
+
+        Args:
+            messages: List of dictionaries with 'content' and optional 'recipient_id'
+
+        Returns:
+            The batch data with 'created', 'failed' and per-message 'results', or None on error
+        """
+        data = await self._request("POST", "/api/messages/batch", include_auth=True, json={"messages": messages})
+        return data["data"] if data else None
+
+    async def fetch_messages(self, message_ids):
+        """Get several messages by ID with one request.
+
+        Returns:
+            The response data with 'messages', 'not_found' and 'forbidden', or None on error
+        """
+        return await self._request("POST", "/api/messages/fetch", include_auth=True, json={"ids": message_ids})
+
+    async def upload_attachment(self, path, content_type="application/octet-stream"):
+        """Upload a file as an attachment, streaming it from disk.
+
+        Returns:
+            The attachment with its 'hash', or None on error
+        """
+        if not self.access_token:
+            self.last_error = "Not logged in"
+            return None
+
+        # Check if token needs refreshing
+        await self.refresh_token_if_needed()
+
+        headers = self._get_headers(include_auth=True)
+        headers["Content-Type"] = content_type
+
+        with open(path, "rb") as f:
+            async with self._get_session().post(f"{self.base_url}/api/attachments", headers=headers,
+                                                data=f) as response:
+                data = await self._handle_response(response)
+
+        return data["data"] if data else None
+
+    async def download_attachment(self, attachment_hash, path, chunk_size=64 * 1024):
+        """Download an attachment to a file, streaming it to disk.
+
+        Returns:
+            The number of bytes written, or None on error
+        """
+        if not self.access_token:
+            self.last_error = "Not logged in"
+            return None
+
+        # Check if token needs refreshing
+        await self.refresh_token_if_needed()
+
+        async with self._get_session().get(f"{self.base_url}/api/attachments/{attachment_hash}",
+                                           headers=self._get_headers(include_auth=True)) as response:
+            if response.status >= 400:
+                await self._handle_response(response)
+                return None
+
+            size = 0
+            with open(path, "wb") as f:
+                async for chunk in response.content.iter_chunked(chunk_size):
+                    f.write(chunk)
+                    size += len(chunk)
+
+        return size
+
+    async def get_messages(self, fields=None, limit=None):
+        """Get all messages, or only the most recent ones.
+
+        Args:
+            fields: Optional list of the message fields to include
+            limit: Optional maximum number of messages to get
+        """
+        params = {"fields": ",".join(fields) if fields else None, "limit": limit}
+        data = await self._request("GET", "/api/messages", include_auth=True, params=params)
+        return data["messages"] if data else []
+
+    async def get_my_messages(self):
+        """Get messages by the authenticated user."""
+        data = await self._request("GET", "/api/messages/me", include_auth=True)
+        return data["messages"] if data else []
+
+    async def mark_read(self, cursor, user_id=None):
+        """Mark messages, or the conversation with user_id, as read up to a cursor.
+
+        Returns:
+            The updated unread counts, or None on error
+        """
+        payload = {"cursor": cursor}
+        if user_id:
+            payload["user_id"] = user_id
+
+        data = await self._request("POST", "/api/messages/read", include_auth=True, json=payload)
+        return data["data"] if data else None
+
+    async def get_unread(self):
+        """Get the unread message counts of the current user, or None on error."""
+        data = await self._request("GET", "/api/unread", include_auth=True)
+        return data["data"] if data else None
+
+    async def search_messages(self, query, limit=None):
+        """Search the messages viewable by the authenticated user."""
+        data = await self._request("GET", "/api/messages/search", include_auth=True,
+                                   params={"q": query, "limit": limit})
+        return data["messages"] if data else []
+
+    async def get_message(self, message_id):
+        """Get a specific message by ID."""
+        data = await self._request("GET", f"/api/messages/{message_id}", include_auth=True)
+        return data["data"] if data else None
+
+    async def delete_message(self, message_id):
+        """Delete a message by ID."""
+        return await self._request("DELETE", f"/api/messages/{message_id}", include_auth=True) is not None
+
+    async def sync_messages(self, since=0):
+        """Get the messages created and deleted since a sync cursor.
+
+        Returns:
+            The sync data with 'messages', 'deleted' and 'last_seq', or None on error
+        """
+        data = await self._request("GET", "/api/sync", include_auth=True, params={"since": since})
+        return data["data"] if data else None
+
+    async def get_conversations(self, limit=None, cursor=None):
+        """Get the authenticated user's direct conversations, most recently active first.
+
+        Returns:
+            A tuple of the conversations and the cursor of the next page (None on the last page)
+        """
+        data = await self._request("GET", "/api/conversations", include_auth=True,
+                                   params={"limit": limit, "cursor": cursor})
+        return (data["conversations"], data["next_cursor"]) if data else ([], None)
+
+    async def get_conversation(self, user_id, limit=None, cursor=None):
+        """Get the private messages exchanged with another user.
+
+        Returns:
+            A tuple of the messages (oldest first) and the cursor of the previous page (None at the start)
+        """
+        data = await self._request("GET", f"/api/conversations/{user_id}", include_auth=True,
+                                   params={"limit": limit, "cursor": cursor})
+        return (data["messages"], data["next_cursor"]) if data else ([], None)
+
+    async def create_room(self, name, retention_days=None):
+        """Create a new chat room and join it, optionally with its own message retention in days."""
+        payload = {"name": name}
+        if retention_days is not None:
+            payload["retention_days"] = retention_days
+
+        data = await self._request("POST", "/api/rooms", include_auth=True, json=payload)
+        return data["data"] if data else None
+
+    async def join_room(self, room_id):
+        """Join a chat room."""
+        return await self._request("POST", f"/api/rooms/{room_id}/join", include_auth=True) is not None
+
+    async def leave_room(self, room_id):
+        """Leave a chat room."""
+        return await self._request("POST", f"/api/rooms/{room_id}/leave", include_auth=True) is not None
+
+    async def send_room_message(self, room_id, content):
+        """Post a message to a chat room."""
+        data = await self._request("POST", f"/api/rooms/{room_id}/messages", include_auth=True,
+                                   json={"content": content})
+        return data["data"] if data else None
+
+    async def get_room_messages(self, room_id, limit=None):
+        """Get the messages of a chat room."""
+        data = await self._request("GET", f"/api/rooms/{room_id}/messages", include_auth=True,
+                                   params={"limit": limit})
+        return data["messages"] if data else []
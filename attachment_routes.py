@@ -0,0 +1,97 @@
+"""
+Attachment routes for the 0xC Chat API.
+"""
+
+import os
+from flask import Blueprint, request, jsonify, send_file
+from models import Attachment
+from attachments import AttachmentTooLargeError
+from env import MAX_ATTACHMENT_SIZE
+from auth import token_required
+from api_key import api_key_required
+
+# Create a Blueprint for the attachment routes
+attachments = Blueprint('attachments', __name__)
+
+# Attachments never change, so clients can cache them for a year
+ATTACHMENT_MAX_AGE = 365 * 24 * 60 * 60
+
+# Content types served inline with the type given on upload; others are downloaded as octet streams,
+# so uploaded HTML, SVG or scripts never run in the API's origin
+INLINE_CONTENT_TYPES = frozenset({
+    'image/png', 'image/jpeg', 'image/gif', 'image/webp', 'text/plain', 'application/pdf'
+})
+
+def attachment_summary(attachment):
+    """Convert an attachment to its API representation."""
+    return {
+        'hash': attachment.hash,
+        'size': attachment.size,
+        'content_type': attachment.content_type,
+        'created_at': attachment.created_at.isoformat()
+    }
+
+def too_large():
+    """Build the error response for an upload over the maximum attachment size."""
+    return jsonify({
+        'status': 'error',
+        'message': f'Attachment exceeds maximum size of {MAX_ATTACHMENT_SIZE} bytes'
+    }), 413
+
+@attachments.route('', methods=['POST'])
+@api_key_required
+@token_required
+def upload_attachment(current_user):
+    """Upload an attachment (requires authentication).
+
+    The request body is the raw content of the attachment, sent with its
+    Content-Type, and may use chunked transfer encoding. It is streamed
+    to disk, so it is never held in memory. Uploading content that is
+    already stored returns the existing attachment, with the same status
+    as a new upload so users cannot tell what others have uploaded.
+    """
+    if request.content_length is not None and request.content_length > MAX_ATTACHMENT_SIZE:
+        return too_large()
+
+    try:
+        attachment, _ = Attachment.upload(request.stream, request.mimetype or 'application/octet-stream',
+                                          current_user.id)
+    except AttachmentTooLargeError:
+        return too_large()
+
+    return jsonify({
+        'status': 'success',
+        'message': 'Attachment uploaded successfully',
+        'data': attachment_summary(attachment)
+    }), 201
+
+@attachments.route('/<attachment_hash>', methods=['GET'])
+@api_key_required
+@token_required
+def download_attachment(current_user, attachment_hash):
+    """Download an attachment (requires authentication and permission).
+
+    A user can download an attachment they uploaded, or one referenced by
+    a message they can view. The blob file is sent as is, so the server
+    can use zero-copy file sending, and Range and conditional requests
+    are supported. Content types outside INLINE_CONTENT_TYPES are sent as
+    application/octet-stream downloads.
+    """
+    attachment = Attachment.get_by_hash(attachment_hash)
+
+    if (not attachment or not attachment.is_viewable_by(current_user.id)
+            or not os.path.exists(attachment.path)):
+        return jsonify({
+            'status': 'error',
+            'message': f'Attachment {attachment_hash} not found or you do not have permission to view it'
+        }), 404
+
+    inline = attachment.content_type in INLINE_CONTENT_TYPES
+    response = send_file(os.path.abspath(attachment.path),
+                         mimetype=attachment.content_type if inline else 'application/octet-stream',
+                         as_attachment=not inline, download_name=attachment.hash, conditional=True,
+                         etag=attachment.hash, max_age=ATTACHMENT_MAX_AGE)
+    response.headers['X-Content-Type-Options'] = 'nosniff'
+    response.cache_control.public = False
+    response.cache_control.private = True
+    return response
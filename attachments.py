@@ -0,0 +1,92 @@
+"""
+Content-addressed attachment store for the 0xC Chat application.
+
+Attachment bytes are stored on local disk under their SHA-256 hash, so
+identical uploads are stored once, and never pass through the JSON
+message store: messages only reference attachments by hash. Uploads are
+streamed to disk in chunks while they are hashed, and downloads are
+served straight from the blob file.
+"""
+
+import hashlib
+import os
+import re
+import tempfile
+from typing import BinaryIO, Tuple
+from env import DATA_DIR, MAX_ATTACHMENT_SIZE, ATTACHMENT_CHUNK_SIZE
+
+# Directory for attachment blobs, sharded by the first two characters of the hash
+ATTACHMENTS_DIR = os.path.join(DATA_DIR, "attachments")
+
+# Directory for uploads in progress, on the same file system so they can be renamed into place
+UPLOADS_DIR = os.path.join(ATTACHMENTS_DIR, "tmp")
+
+_HASH_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+
+class AttachmentTooLargeError(ValueError):
+    """Raised when an upload exceeds the maximum attachment size."""
+
+
+class AttachmentNotFoundError(LookupError):
+    """Raised when a message references an attachment that does not exist."""
+
+
+def is_valid_hash(value: str) -> bool:
+    """Check whether a value is a well-formed attachment hash."""
+    return isinstance(value, str) and bool(_HASH_PATTERN.match(value))
+
+def blob_path(attachment_hash: str) -> str:
+    """Get the path of the blob file of an attachment."""
+    return os.path.join(ATTACHMENTS_DIR, attachment_hash[:2], attachment_hash)
+
+def delete_blob(attachment_hash: str) -> None:
+    """Delete the blob file of an attachment, if it exists."""
+    try:
+        os.remove(blob_path(attachment_hash))
+    except FileNotFoundError:
+        pass
+
+def store_stream(stream: BinaryIO, max_size: int = MAX_ATTACHMENT_SIZE,
+                 chunk_size: int = ATTACHMENT_CHUNK_SIZE) -> Tuple[str, int, bool]:
+    """Stream an upload into the blob store.
+
+    The stream is copied to a temporary file chunk by chunk while it is
+    hashed, then renamed to its hash, unless a blob with that hash
+    already exists, in which case the copy is discarded.
+
+    Returns:
+        The hash and size of the content, and whether a new blob was stored.
+
+    Raises:
+        AttachmentTooLargeError: If the stream is larger than max_size bytes.
+    """
+    os.makedirs(UPLOADS_DIR, exist_ok=True)
+    fd, temp_file = tempfile.mkstemp(dir=UPLOADS_DIR)
+    try:
+        digest = hashlib.sha256()
+        size = 0
+        with os.fdopen(fd, 'wb') as f:
+            while True:
+                chunk = stream.read(chunk_size)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_size:
+                    raise AttachmentTooLargeError(f'Attachment exceeds maximum size of {max_size} bytes')
+                digest.update(chunk)
+                f.write(chunk)
+
+        attachment_hash = digest.hexdigest()
+        path = blob_path(attachment_hash)
+        if os.path.exists(path):
+            os.remove(temp_file)
+            return attachment_hash, size, False
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(temp_file, path)
+        return attachment_hash, size, True
+    except BaseException:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+        raise
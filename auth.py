@@ -3,8 +3,10 @@ Authentication utilities for the 0xC Chat API.
 """
 
 from functools import wraps
-from flask import request, jsonify
+from flask import request, jsonify, g
 from models import User
+from env import ADMIN_USERNAMES
+from timing import span
 
 def token_required(f):
     """
@@ -32,7 +34,8 @@ def token_required(f):
             }), 401
         
         # Decode and validate token
-        payload = User.decode_token(token)
+        with span('auth.jwt'):
+            payload = User.decode_token(token)
         if 'error' in payload:
             return jsonify({
                 'status': 'error',
@@ -47,14 +50,37 @@ def token_required(f):
             }), 401
         
         # Get user from token
-        user = User.get_by_id(payload['user_id'])
+        with span('auth.user'):
+            user = User.get_by_id(payload['user_id'])
         if not user:
             return jsonify({
                 'status': 'error',
                 'message': 'User not found'
             }), 401
         
+        # Remember the user for request hooks such as the profiler
+        g.user_id = user.id
+
         # Pass user to the decorated function
         return f(user, *args, **kwargs)
     
     return decorated
+
+def admin_required(f):
+    """
+    Decorator to protect routes that only admins can use.
+    
+    Must be applied after token_required. The authenticated user must be
+    one of the ADMIN_USERNAMES.
+    """
+    @wraps(f)
+    def decorated(current_user, *args, **kwargs):
+        if current_user.username not in ADMIN_USERNAMES:
+            return jsonify({
+                'status': 'error',
+                'message': 'Admin access required'
+            }), 403
+        
+        return f(current_user, *args, **kwargs)
+    
+    return decorated
@@ -6,6 +6,7 @@ from flask import Blueprint, request, jsonify
 from models import User
 from env import ACCESS_TOKEN_EXPIRES, REFRESH_TOKEN_EXPIRES, REGISTER_ENABLED
 from api_key import api_key_required
+from auth import token_required
 
 # Create a Blueprint for the authentication routes
 auth = Blueprint('auth', __name__)
@@ -174,6 +175,21 @@ def logout():
         'message': 'Logged out successfully'
     }), 200
 
+@auth.route('/logout-all', methods=['POST'])
+@api_key_required
+@token_required
+def logout_all(current_user):
+    """Logout a user from every session by invalidating all their refresh tokens."""
+    revoked = User.invalidate_all_refresh_tokens(current_user.id)
+
+    return jsonify({
+        'status': 'success',
+        'message': 'Logged out of all sessions successfully',
+        'data': {
+            'revoked_sessions': revoked
+        }
+    }), 200
+
 @auth.route('/token-info', methods=['GET'])
 @api_key_required
 def token_info():
@@ -0,0 +1,321 @@
+#!/usr/bin/env python
+"""
+Storage and model microbenchmarks for the 0xC Chat application.
+
+Generates synthetic datasets of users, messages and refresh tokens at each
+requested size, then times the json_storage functions and the hot model
+paths (Message.get_viewable_by_user, Message.to_dict, model hydration,
+User.authenticate, User.decode_token) against them. Each size runs in its own process with
+its own temporary DATA_DIR, so no real data is touched and no cache or
+index carries over from one size to the next.
+
+Usage:
+    python benchmark.py --sizes 1000,10000 --output baseline.json
+    python benchmark.py --sizes 1000,10000 --compare baseline.json
+    python benchmark.py --compare baseline.json current.json
+
+In compare mode, a benchmark whose median time grew by more than the
+threshold is reported as a regression and the exit status is 1.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Any
+
+# Default dataset sizes: the number of users, messages and refresh tokens
+DEFAULT_SIZES = [1000, 10000]
+
+# Password of every synthetic user
+PASSWORD = 'benchmark-password'
+
+# Share of synthetic messages sent privately, and of refresh tokens already expired
+PRIVATE_RATIO = 0.3
+EXPIRED_RATIO = 0.1
+
+# Each benchmark is repeated until it has run for MIN_TIME seconds or MAX_REPS times
+MIN_TIME = 0.2
+MAX_REPS = 1000
+
+# Default relative growth of the median time reported as a regression
+DEFAULT_THRESHOLD = 0.2
+
+# Differences below this many milliseconds are timer noise, never a regression
+NOISE_MS = 0.01
+
+
+def measure(fn: Callable[[], Any], min_time: float = MIN_TIME, max_reps: int = MAX_REPS,
+            warmup: int = 1) -> Dict[str, Any]:
+    """Time repeated calls of a function.
+
+    Returns:
+        The number of timed 'reps' and the mean, median, min and p95 time
+        of a call in milliseconds.
+    """
+    for _ in range(warmup):
+        fn()
+
+    times = []
+    deadline = time.perf_counter() + min_time
+    while len(times) < max_reps and (not times or time.perf_counter() < deadline):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+
+    times.sort()
+    return {
+        'reps': len(times),
+        'mean_ms': round(statistics.fmean(times) * 1000, 4),
+        'median_ms': round(statistics.median(times) * 1000, 4),
+        'min_ms': round(times[0] * 1000, 4),
+        'p95_ms': round(times[min(len(times) - 1, int(len(times) * 0.95))] * 1000, 4)
+    }
+
+def generate_dataset(size: int, seed: int = 0) -> Dict[str, List[Dict[str, Any]]]:
+    """Generate size users, messages and refresh tokens as storage dictionaries.
+
+    Users and messages come from the bulk loader's generators, so every
+    user shares one password hash.
+    """
+    from init_db import synthetic_users, synthetic_messages
+
+    rng = random.Random(seed)
+    now = datetime.now(timezone.utc)
+
+    users = list(synthetic_users(size, PASSWORD, prefix='bench', seed=seed))
+    messages = list(synthetic_messages(size, [(user['id'], user['username']) for user in users], PRIVATE_RATIO, seed))
+
+    tokens = []
+    for user in users:
+        expires_at = now - timedelta(days=1) if rng.random() < EXPIRED_RATIO else now + timedelta(days=30)
+        tokens.append({
+            'id': str(uuid.UUID(int=rng.getrandbits(128), version=4)),
+            'user_id': user['id'],
+            'expires_at': expires_at.isoformat(),
+            'created_at': now.isoformat()
+        })
+
+    return {'users': users, 'messages': messages, 'tokens': tokens}
+
+def _touch(path: str) -> None:
+    """Change a file's modification time, so caches keyed on it reload the file."""
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000))
+
+def run_size(size: int, seed: int = 0, min_time: float = MIN_TIME) -> Dict[str, Dict[str, Any]]:
+    """Generate a dataset of the given size in DATA_DIR and run every benchmark against it.
+
+    DATA_DIR must point to an empty scratch directory before this module's
+    storage imports run, which is why main runs each size in a subprocess.
+    """
+    import json_storage
+    import init_db
+    from models import Message, User
+
+    dataset = generate_dataset(size, seed)
+    users, messages, tokens = dataset['users'], dataset['messages'], dataset['tokens']
+    init_db.load(users, messages)
+    json_storage.save_tokens(tokens)
+
+    rng = random.Random(seed + 1)
+    last_user = users[-1]
+    viewer = rng.choice(users)
+    message_ids = [message['id'] for message in rng.sample(messages, min(100, size))]
+    seq = json_storage.get_current_seq()
+    token = User.from_dict(viewer).generate_access_token()
+    message = Message.from_dict(messages[-1])
+    users_by_id = {user['id']: user for user in users}
+    page = messages[-50:]
+
+    # Messages and tokens consumed by the benchmarks that delete them
+    deletable_messages = iter(message['id'] for message in messages[:size // 2])
+    deletable_tokens = iter(token['id'] for token in tokens[:size // 2])
+
+    def timed(fn, **kwargs):
+        return measure(fn, min_time=min_time, **kwargs)
+
+    def cold_messages():
+        _touch(json_storage.MESSAGES_FILE)
+        json_storage.get_messages()
+
+    results = {
+        'json_storage.get_users': timed(json_storage.get_users),
+        'json_storage.get_user_by_id': timed(lambda: json_storage.get_user_by_id(last_user['id'])),
+        'json_storage.get_user_by_username': timed(lambda: json_storage.get_user_by_username(last_user['username'])),
+        'json_storage.get_users_by_ids': timed(lambda: json_storage.get_users_by_ids([viewer['id'], last_user['id']])),
+        'json_storage.update_user': timed(lambda: json_storage.update_user(viewer['id'], {'email': None}), max_reps=50),
+        'json_storage.get_messages': timed(json_storage.get_messages),
+        'json_storage.get_messages (cold)': timed(cold_messages, max_reps=50),
+        'json_storage.get_message_by_id': timed(lambda: json_storage.get_message_by_id(message_ids[0])),
+        'json_storage.get_messages_by_ids': timed(lambda: json_storage.get_messages_by_ids(message_ids)),
+        'json_storage.get_messages_by_user': timed(lambda: json_storage.get_messages_by_user(viewer['id'])),
+        'json_storage.serialize_messages': timed(lambda: json_storage.serialize_messages(page)),
+        'json_storage.get_changes_since': timed(lambda: json_storage.get_changes_since(seq - 50)),
+        'json_storage.get_tokens': timed(json_storage.get_tokens),
+        'json_storage.get_token_by_id': timed(lambda: json_storage.get_token_by_id(tokens[-1]['id'])),
+        'json_storage.get_tokens_by_user': timed(lambda: json_storage.get_tokens_by_user(last_user['id'])),
+        'User.decode_token': timed(lambda: User.decode_token(token)),
+        'User.authenticate': timed(lambda: User.authenticate(last_user['username'], PASSWORD), max_reps=20),
+        'Message.to_dict': timed(lambda: message.to_dict()),
+        'Message.to_dict (users given)': timed(lambda: message.to_dict(users_by_id)),
+        'Message.from_dict (each message)': timed(lambda: [Message.from_dict(m) for m in messages], max_reps=50),
+        'Message.from_dicts': timed(lambda: Message.from_dicts(messages), max_reps=50),
+        'User.from_dicts': timed(lambda: User.from_dicts(users), max_reps=50),
+        'Message.get_viewable_by_user (limit 50)': timed(lambda: Message.get_viewable_by_user(viewer['id'], 50)),
+        'Message.get_viewable_by_user': timed(lambda: Message.get_viewable_by_user(viewer['id'])),
+    }
+
+    # Writes last, as they change the dataset the reads above are timed against
+    results['json_storage.add_message'] = timed(
+        lambda: json_storage.add_message(Message(viewer['id'], 'Benchmark write').to_dict(users_by_id)),
+        max_reps=50)
+    results['json_storage.delete_message'] = timed(
+        lambda: json_storage.delete_message(next(deletable_messages)), max_reps=min(50, size // 2 - 1))
+    results['json_storage.add_token'] = timed(
+        lambda: json_storage.add_token({'id': str(uuid.uuid4()), 'user_id': viewer['id'],
+                                        'expires_at': (datetime.now(timezone.utc) + timedelta(days=30)).isoformat(),
+                                        'created_at': datetime.now(timezone.utc).isoformat()}),
+        max_reps=50)
+    results['json_storage.delete_token'] = timed(
+        lambda: json_storage.delete_token(next(deletable_tokens)), max_reps=min(50, size // 2 - 1))
+    results['json_storage.sweep_expired_tokens'] = timed(json_storage.sweep_expired_tokens, warmup=0, max_reps=1)
+
+    return results
+
+def run_benchmarks(sizes: List[int], seed: int = 0, min_time: float = MIN_TIME) -> Dict[str, Any]:
+    """Run the benchmarks at each size, each in a subprocess with a scratch DATA_DIR."""
+    results = {}
+    for size in sizes:
+        data_dir = tempfile.mkdtemp(prefix='0xc-benchmark-')
+        output = os.path.join(data_dir, 'results.json')
+        try:
+            print(f"Benchmarking {size} users, messages and tokens...", file=sys.stderr)
+            subprocess.run([sys.executable, os.path.abspath(__file__), '--run-size', str(size), '--seed', str(seed),
+                            '--min-time', str(min_time), '--output', output],
+                           env={**os.environ, 'DATA_DIR': os.path.join(data_dir, 'data')}, check=True)
+            with open(output) as f:
+                results[str(size)] = json.load(f)
+        finally:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    return {
+        'meta': {
+            'created_at': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'seed': seed
+        },
+        'results': results
+    }
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any],
+            threshold: float = DEFAULT_THRESHOLD) -> List[Dict[str, Any]]:
+    """Compare the median times of two benchmark runs.
+
+    Only benchmarks present in both runs at the same size are compared.
+
+    Returns:
+        A row for each compared benchmark with its 'size', 'name', the
+        'baseline_ms' and 'current_ms' median times, their 'ratio', and
+        whether it is a 'regression': slower by more than the threshold
+        and by more than timer noise.
+    """
+    rows = []
+    for size, benchmarks in current['results'].items():
+        baseline_benchmarks = baseline['results'].get(size, {})
+        for name, stats in benchmarks.items():
+            if name not in baseline_benchmarks:
+                continue
+            before, after = baseline_benchmarks[name]['median_ms'], stats['median_ms']
+            ratio = after / before if before else float('inf') if after else 1.0
+            rows.append({
+                'size': int(size),
+                'name': name,
+                'baseline_ms': before,
+                'current_ms': after,
+                'ratio': round(ratio, 3),
+                'regression': ratio > 1 + threshold and after - before > NOISE_MS
+            })
+    return rows
+
+def print_comparison(rows: List[Dict[str, Any]]) -> None:
+    """Print a comparison table, flagging regressions."""
+    width = max((len(row['name']) for row in rows), default=10)
+    print(f"{'size':>8}  {'benchmark':<{width}}  {'baseline ms':>12}  {'current ms':>12}  {'ratio':>7}")
+    for row in rows:
+        flag = '  REGRESSION' if row['regression'] else ''
+        print(f"{row['size']:>8}  {row['name']:<{width}}  {row['baseline_ms']:>12.4f}  {row['current_ms']:>12.4f}  "
+              f"{row['ratio']:>7.3f}{flag}")
+
+def _parse_sizes(value: str) -> List[int]:
+    """Parse a comma-separated list of dataset sizes."""
+    sizes = [int(size) for size in value.split(',') if size.strip()]
+    if not sizes or any(size < 10 for size in sizes):
+        raise argparse.ArgumentTypeError('sizes must be integers of at least 10')
+    return sizes
+
+def parse_arguments():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description="Storage and model microbenchmarks for the 0xC Chat application")
+    parser.add_argument("--sizes", type=_parse_sizes, default=DEFAULT_SIZES,
+                        help="Comma-separated dataset sizes, e.g. 1000,10000,100000,1000000")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed of the synthetic datasets")
+    parser.add_argument("--min-time", type=float, default=MIN_TIME,
+                        help="Minimum number of seconds to repeat each benchmark for")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--compare", nargs='+', metavar='RESULTS',
+                        help="Compare against a baseline results file, with a second file instead of a new run")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="Relative growth of the median time reported as a regression")
+    parser.add_argument("--run-size", type=int, help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_arguments()
+
+    if args.run_size is not None:
+        # A single size, run by run_benchmarks in a subprocess with a scratch DATA_DIR
+        with open(args.output, 'w') as f:
+            json.dump(run_size(args.run_size, args.seed, args.min_time), f)
+        sys.exit(0)
+
+    if args.compare and len(args.compare) > 2:
+        print("Error: --compare takes a baseline file and optionally a results file")
+        sys.exit(2)
+
+    if args.compare and len(args.compare) == 2:
+        with open(args.compare[1]) as f:
+            report = json.load(f)
+    else:
+        report = run_benchmarks(args.sizes, args.seed, args.min_time)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if not args.compare:
+        if not args.output:
+            print(json.dumps(report, indent=2))
+        sys.exit(0)
+
+    with open(args.compare[0]) as f:
+        baseline = json.load(f)
+    rows = compare(baseline, report, args.threshold)
+    print_comparison(rows)
+
+    regressions = [row for row in rows if row['regression']]
+    if regressions:
+        print(f"\n{len(regressions)} regressions over {args.threshold:.0%}")
+        sys.exit(1)
+    print("\nNo regressions")
@@ -0,0 +1,189 @@
+"""
+Direct conversation index for the 0xC Chat application.
+
+Private messages are indexed by the unordered pair of users that
+exchanged them, in sequence order, and each user's conversations are
+kept ordered by their last message along with a preview of it. Both are
+maintained as messages are added and deleted, so listing conversations
+or paging through one never scans the message store.
+"""
+
+import bisect
+from typing import Dict, List, Any, Optional, Tuple
+import json_storage
+from message_index import MessageIndex
+
+# Maximum number of characters of message content kept in a preview
+PREVIEW_LENGTH = 100
+
+def conversation_key(user_id: str, other_user_id: str) -> Tuple[str, str]:
+    """Get the key of the conversation between two users, independent of their order."""
+    return (user_id, other_user_id) if user_id <= other_user_id else (other_user_id, user_id)
+
+def _preview(message: Dict[str, Any]) -> Dict[str, Any]:
+    """Build the preview of a conversation's last message."""
+    return {
+        'id': message['id'],
+        'user_id': message['user_id'],
+        'username': message.get('username'),
+        'content': message['content'][:PREVIEW_LENGTH],
+        'timestamp': message['timestamp'],
+        'seq': message.get('seq', 0)
+    }
+
+
+class _ConversationIndex(MessageIndex):
+    """Index of private messages by conversation.
+
+    threads maps each conversation key to parallel lists of the sequence
+    numbers and IDs of its messages. recent maps each user to a sorted
+    list of (last_seq, other_user_id) for their conversations, and
+    conversations maps (user_id, other_user_id) to the other user's
+    username and the last message preview.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._reset()
+
+    def _reset(self) -> None:
+        """Empty the index."""
+        self.threads: Dict[Tuple[str, str], Dict[str, list]] = {}
+        self.recent: Dict[str, List[Tuple[int, str]]] = {}
+        self.conversations: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self.message_keys: Dict[str, Tuple[Tuple[str, str], int]] = {}
+
+    def _set_last_message(self, user_id: str, other_user_id: str, preview: Optional[Dict[str, Any]],
+                          other_username: Optional[str] = None) -> None:
+        """Update a user's entry for a conversation, removing it if preview is None."""
+        recent = self.recent.setdefault(user_id, [])
+        entry = self.conversations.get((user_id, other_user_id))
+        if entry is not None:
+            del recent[bisect.bisect_left(recent, (entry['last_seq'], other_user_id))]
+
+        if preview is None:
+            self.conversations.pop((user_id, other_user_id), None)
+            if not recent:
+                del self.recent[user_id]
+            return
+
+        username = other_username or (entry['username'] if entry else None)
+        self.conversations[(user_id, other_user_id)] = {
+            'username': username,
+            'last_seq': preview['seq'],
+            'last_message': preview
+        }
+        bisect.insort(recent, (preview['seq'], other_user_id))
+
+    def _insert(self, message: Dict[str, Any]) -> bool:
+        """Add a private message to its conversation."""
+        recipient_id = message.get('recipient_id')
+        if recipient_id is None or message['id'] in self.message_keys:
+            return False
+
+        sender_id = message['user_id']
+        seq = message.get('seq', 0)
+        key = conversation_key(sender_id, recipient_id)
+        thread = self.threads.setdefault(key, {'seqs': [], 'ids': []})
+        position = bisect.bisect_right(thread['seqs'], seq)
+        thread['seqs'].insert(position, seq)
+        thread['ids'].insert(position, message['id'])
+        self.message_keys[message['id']] = (key, seq)
+
+        if position == len(thread['seqs']) - 1:
+            preview = _preview(message)
+            self._set_last_message(sender_id, recipient_id, preview, message.get('recipient_username'))
+            if recipient_id != sender_id:
+                self._set_last_message(recipient_id, sender_id, preview, message.get('username'))
+        return True
+
+    def _delete(self, message_id: str) -> bool:
+        """Remove a private message from its conversation."""
+        entry = self.message_keys.pop(message_id, None)
+        if entry is None:
+            return False
+
+        key, seq = entry
+        thread = self.threads[key]
+        position = bisect.bisect_left(thread['seqs'], seq)
+        while thread['ids'][position] != message_id:
+            position += 1
+        del thread['seqs'][position]
+        del thread['ids'][position]
+        was_last = position == len(thread['seqs'])
+
+        if not thread['ids']:
+            del self.threads[key]
+
+        if was_last:
+            preview = None
+            if key in self.threads:
+                last_message = json_storage.get_message_by_id(self.threads[key]['ids'][-1])
+                preview = _preview(last_message) if last_message else None
+            user_id, other_user_id = key
+            self._set_last_message(user_id, other_user_id, preview)
+            if other_user_id != user_id:
+                self._set_last_message(other_user_id, user_id, preview)
+        return True
+
+    def list_conversations(self, user_id: str, limit: int, cursor: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Get a user's conversations, most recently active first.
+
+        Args:
+            user_id: The user whose conversations to list
+            limit: Maximum number of conversations to return
+            cursor: Only return conversations whose last message is older than this sequence number
+        """
+        with self.lock:
+            self._catch_up()
+            recent = self.recent.get(user_id, [])
+            end = len(recent) if cursor is None else bisect.bisect_left(recent, (cursor, ''))
+            page = recent[max(0, end - limit):end]
+            return [
+                dict(self.conversations[(user_id, other_user_id)], user_id=other_user_id)
+                for _, other_user_id in reversed(page)
+            ]
+
+    def get_thread(self, user_id: str, other_user_id: str, limit: int,
+                   cursor: Optional[int] = None) -> List[str]:
+        """Get the IDs of the messages between two users, oldest first.
+
+        Args:
+            user_id: One user of the conversation
+            other_user_id: The other user of the conversation
+            limit: Maximum number of messages to return (the most recent ones before the cursor)
+            cursor: Only return messages older than this sequence number
+        """
+        with self.lock:
+            self._catch_up()
+            thread = self.threads.get(conversation_key(user_id, other_user_id))
+            if thread is None:
+                return []
+            end = len(thread['seqs']) if cursor is None else bisect.bisect_left(thread['seqs'], cursor)
+            return thread['ids'][max(0, end - limit):end]
+
+_index = _ConversationIndex()
+
+def add_message(message: Dict[str, Any]) -> None:
+    """Add a newly stored message to the conversation index."""
+    _index.add(message)
+
+def add_messages(messages: List[Dict[str, Any]]) -> None:
+    """Add a batch of newly stored messages to the conversation index."""
+    _index.add_many(messages)
+
+def remove_message(message_id: str) -> None:
+    """Remove a deleted message from the conversation index."""
+    _index.remove(message_id)
+
+def rebuild() -> None:
+    """Rebuild the conversation index from the message store."""
+    _index.rebuild()
+
+def list_conversations(user_id: str, limit: int, cursor: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Get a user's conversations with last message previews, most recently active first."""
+    return _index.list_conversations(user_id, limit, cursor)
+
+def get_thread(user_id: str, other_user_id: str, limit: int, cursor: Optional[int] = None) -> List[str]:
+    """Get the IDs of the messages between two users before a cursor, oldest first."""
+    return _index.get_thread(user_id, other_user_id, limit, cursor)
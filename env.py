@@ -62,6 +62,26 @@ TOKEN_REFRESH_SECONDS = int(os.environ.get('TOKEN_REFRESH_SECONDS', 600))
 # - Default: 30 days
 REFRESH_TOKEN_EXPIRES = int(os.environ.get('REFRESH_TOKEN_EXPIRES', 30))
 
+# TOKEN_SWEEP_INTERVAL: Time in seconds between runs of the expired refresh token sweeper
+# - The sweeper runs in a background thread and deletes expired tokens from tokens.json
+# - Set to 0 to disable the sweeper (expired tokens are then only removed when presented)
+# - Default: 300 seconds (5 minutes)
+TOKEN_SWEEP_INTERVAL = int(os.environ.get('TOKEN_SWEEP_INTERVAL', 300))
+
+# TOKEN_SWEEP_BATCH_SIZE: Maximum number of expired tokens deleted per write to tokens.json
+# - Default: 500
+TOKEN_SWEEP_BATCH_SIZE = int(os.environ.get('TOKEN_SWEEP_BATCH_SIZE', 500))
+
+# MAX_SESSIONS_PER_USER: Maximum number of refresh tokens (sessions) a user can hold
+# - When a user logs in with this many sessions, their oldest session is revoked
+# - Set to 0 for no limit
+# - Default: 10
+MAX_SESSIONS_PER_USER = int(os.environ.get('MAX_SESSIONS_PER_USER', 10))
+
+# ADMIN_USERNAMES: Comma-separated usernames of the users allowed to use the admin endpoints under /api/admin
+# - Default: empty (no admins, the admin endpoints always return 403)
+ADMIN_USERNAMES = {username.strip() for username in os.environ.get('ADMIN_USERNAMES', '').split(',') if username.strip()}
+
 # API configuration
 API_PREFIX = os.environ.get('API_PREFIX', '/api')
 
@@ -82,3 +102,156 @@ RATE_LIMIT = int(os.environ.get('RATE_LIMIT', 100))  # requests per minute
 
 # Message configuration
 MAX_MESSAGE_LENGTH = int(os.environ.get('MAX_MESSAGE_LENGTH', 1000))
+
+# TOMBSTONE_RETENTION_DAYS: Time in days that delete tombstones are kept for /api/sync
+# - Clients whose sync cursor is older than the oldest dropped tombstone must re-download all messages
+# - Default: 30 days
+TOMBSTONE_RETENTION_DAYS = int(os.environ.get('TOMBSTONE_RETENTION_DAYS', 30))
+
+# MAX_BATCH_SIZE: Maximum number of messages accepted by one request to /api/messages/batch
+# - Default: 100
+MAX_BATCH_SIZE = int(os.environ.get('MAX_BATCH_SIZE', 100))
+
+# PAGE_SIZE: Default number of items returned by paginated endpoints such as /api/conversations
+# - Default: 50
+PAGE_SIZE = int(os.environ.get('PAGE_SIZE', 50))
+
+# MAX_PAGE_SIZE: Maximum number of items a client can request per page with the limit parameter
+# - Default: 200
+MAX_PAGE_SIZE = int(os.environ.get('MAX_PAGE_SIZE', 200))
+
+# SEARCH_MAX_RESULTS: Maximum number of messages returned by /api/messages/search
+# - Default: 100
+SEARCH_MAX_RESULTS = int(os.environ.get('SEARCH_MAX_RESULTS', 100))
+
+# INDEX_LOG_COMPACT_THRESHOLD: Number of index changes logged before the log is compacted
+# - The search index and the inbox timelines are persisted as a snapshot plus a log of changes since the snapshot
+# - Default: 10000
+INDEX_LOG_COMPACT_THRESHOLD = int(os.environ.get('INDEX_LOG_COMPACT_THRESHOLD', 10000))
+
+# MESSAGE_FRAGMENT_CACHE_SIZE: Number of messages whose serialized JSON is kept in memory
+# - List responses are assembled from these cached fragments instead of re-serializing each message
+# - Set to 0 to disable the cache
+# - Default: 100000
+MESSAGE_FRAGMENT_CACHE_SIZE = int(os.environ.get('MESSAGE_FRAGMENT_CACHE_SIZE', 100000))
+
+# Attachments
+# MAX_ATTACHMENT_SIZE: Maximum size in bytes of an uploaded attachment
+# - Larger uploads are rejected with a 413 error
+# - Default: 10485760 (10 MB)
+MAX_ATTACHMENT_SIZE = int(os.environ.get('MAX_ATTACHMENT_SIZE', 10 * 1024 * 1024))
+
+# MAX_ATTACHMENTS_PER_MESSAGE: Maximum number of attachments a message can reference
+# - Default: 10
+MAX_ATTACHMENTS_PER_MESSAGE = int(os.environ.get('MAX_ATTACHMENTS_PER_MESSAGE', 10))
+
+# ATTACHMENT_CHUNK_SIZE: Size in bytes of the chunks uploads are streamed to disk in
+# - Default: 65536 (64 KB)
+ATTACHMENT_CHUNK_SIZE = int(os.environ.get('ATTACHMENT_CHUNK_SIZE', 64 * 1024))
+
+# Message retention
+# MESSAGE_RETENTION_DAYS: Age in days after which messages expire
+# - Expired messages are archived or dropped by a background job, see RETENTION_ARCHIVE
+# - Set to 0 to keep messages forever
+# - Default: 0
+MESSAGE_RETENTION_DAYS = int(os.environ.get('MESSAGE_RETENTION_DAYS', 0))
+
+# PUBLIC_MESSAGE_RETENTION_DAYS / PRIVATE_MESSAGE_RETENTION_DAYS: Retention of public and private messages
+# - Default: MESSAGE_RETENTION_DAYS
+PUBLIC_MESSAGE_RETENTION_DAYS = int(os.environ.get('PUBLIC_MESSAGE_RETENTION_DAYS', MESSAGE_RETENTION_DAYS))
+PRIVATE_MESSAGE_RETENTION_DAYS = int(os.environ.get('PRIVATE_MESSAGE_RETENTION_DAYS', MESSAGE_RETENTION_DAYS))
+
+# MESSAGE_RETENTION_COUNT: Maximum number of messages kept in messages.json, the oldest expire first
+# - Set to 0 for no limit
+# - Default: 0
+MESSAGE_RETENTION_COUNT = int(os.environ.get('MESSAGE_RETENTION_COUNT', 0))
+
+# ROOM_MESSAGE_RETENTION_DAYS: Age in days after which room messages expire
+# - A room created with retention_days uses that instead
+# - Set to 0 to keep room messages forever
+# - Default: 0
+ROOM_MESSAGE_RETENTION_DAYS = int(os.environ.get('ROOM_MESSAGE_RETENTION_DAYS', 0))
+
+# ROOM_MESSAGE_RETENTION_COUNT: Maximum number of messages kept per room, the oldest expire first
+# - Set to 0 for no limit
+# - Default: 0
+ROOM_MESSAGE_RETENTION_COUNT = int(os.environ.get('ROOM_MESSAGE_RETENTION_COUNT', 0))
+
+# RETENTION_ARCHIVE: If true, expired messages are moved into gzip-compressed archive segments
+# - Segments are written to the archive directory inside DATA_DIR, one JSON message per line
+# - When disabled, expired messages are dropped
+# - Default: True (enabled)
+RETENTION_ARCHIVE = os.environ.get('RETENTION_ARCHIVE', '1') == '1'
+
+# RETENTION_INTERVAL: Time in seconds between runs of the background retention job
+# - Set to 0 to disable the job
+# - Default: 3600 seconds (1 hour)
+RETENTION_INTERVAL = int(os.environ.get('RETENTION_INTERVAL', 3600))
+
+# ===================================
+# Instrumentation
+# ===================================
+
+# SERVER_TIMING_SAMPLE_RATE: Share of requests timed and answered with a Server-Timing header
+# - Each sampled response lists the time spent in auth checks, storage calls, model methods and serialization
+# - Between 0 and 1; opt-in, as the header exposes internal timings to every client
+# - Default: 0 (disabled)
+SERVER_TIMING_SAMPLE_RATE = float(os.environ.get('SERVER_TIMING_SAMPLE_RATE', 0))
+
+# METRICS_ENABLED: If true, request, storage and cache metrics are served at /metrics in the Prometheus text format
+# - The endpoint requires the API key if SECRET_KEY_ENABLED is set, and is otherwise public
+# - Default: False (disabled)
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '0') == '1'
+
+# METRICS_DIR: Directory where each worker process writes the snapshot of its metrics
+# - /metrics adds up the snapshots of every process, so all workers of a server must share it
+# - Snapshots of processes that no longer exist are deleted, so the workers must also share a PID namespace
+# - Default: the metrics directory inside DATA_DIR
+METRICS_DIR = os.environ.get('METRICS_DIR', os.path.join(DATA_DIR, 'metrics'))
+
+# METRICS_FLUSH_INTERVAL: Time in seconds between snapshots of each worker process's metrics
+# - The process serving /metrics always reports its own metrics up to date
+# - Set to 0 to only write a snapshot when a process serves /metrics
+# - Default: 10 seconds
+METRICS_FLUSH_INTERVAL = int(os.environ.get('METRICS_FLUSH_INTERVAL', 10))
+
+# PROFILER_ENABLED: If true, slow requests and a random sample of requests are profiled
+# - Profiles are listed and downloaded through /api/admin/profiles, see ADMIN_USERNAMES
+# - Default: False (disabled)
+PROFILER_ENABLED = os.environ.get('PROFILER_ENABLED', '0') == '1'
+
+# PROFILE_SLOW_MS: Duration in milliseconds above which a request's sampled stacks are kept as a profile
+# - While the profiler is enabled, the stacks of every request are sampled at PROFILE_SAMPLE_INTERVAL_MS
+# - Set to 0 to only keep the random sample
+# - Default: 1000 milliseconds
+PROFILE_SLOW_MS = int(os.environ.get('PROFILE_SLOW_MS', 1000))
+
+# PROFILE_SAMPLE_RATE: Share of requests run under cProfile and kept as a profile whatever their duration
+# - Between 0 and 1; cProfile slows the profiled request down, so keep it small
+# - Default: 0.0 (none)
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0.0))
+
+# PROFILE_SAMPLE_INTERVAL_MS: Time in milliseconds between stack samples of the requests in progress
+# - Default: 5 milliseconds
+PROFILE_SAMPLE_INTERVAL_MS = int(os.environ.get('PROFILE_SAMPLE_INTERVAL_MS', 5))
+
+# PROFILE_DIR: Directory where profiles are written
+# - Default: the profiles directory inside DATA_DIR
+PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join(DATA_DIR, 'profiles'))
+
+# PROFILE_MAX_FILES: Number of profiles kept, the oldest are deleted first
+# - Default: 100
+PROFILE_MAX_FILES = int(os.environ.get('PROFILE_MAX_FILES', 100))
+
+# MEMORY_SNAPSHOT_DIR: Directory where tracemalloc snapshots taken through /api/admin/memory/snapshots are written
+# - Default: the memory directory inside DATA_DIR
+MEMORY_SNAPSHOT_DIR = os.environ.get('MEMORY_SNAPSHOT_DIR', os.path.join(DATA_DIR, 'memory'))
+
+# MEMORY_SNAPSHOT_MAX_FILES: Number of tracemalloc snapshots kept, the oldest are deleted first
+# - Default: 20
+MEMORY_SNAPSHOT_MAX_FILES = int(os.environ.get('MEMORY_SNAPSHOT_MAX_FILES', 20))
+
+# TRACEMALLOC_FRAMES: Number of frames stored for each allocation once tracemalloc tracing starts
+# - Tracing starts with the first snapshot, unless PYTHONTRACEMALLOC starts it with the process
+# - Default: 10
+TRACEMALLOC_FRAMES = int(os.environ.get('TRACEMALLOC_FRAMES', 10))
@@ -1,53 +1,316 @@
 """
-Database initialization script for the 0xC Chat application.
+Bulk data loader for the 0xC Chat application.
 
-This script creates the database tables and optionally adds some sample data.
+Seeds the JSON store with synthetic users and messages, or loads them
+from JSONL files, streaming them straight into the storage layer in large
+batches instead of registering users and posting messages one at a time.
+Synthetic users share a password hashed once, and imported users with
+the same password share one hash. The indexes are rebuilt once at the
+end, from a single read of the message store.
+
+Usage:
+    python init_db.py --sample
+    python init_db.py --users 100000 --messages 1000000
+    python init_db.py --users-file users.jsonl --messages-file messages.jsonl
+
+Each line of a users file is a JSON object with a username and either a
+password or a password_hash, and optionally an id, email and created_at.
+Each line of a messages file has the content and the sender's user_id or
+username, and optionally a recipient_id or recipient_username, an id and
+a timestamp. Messages are stored in file order. Timestamps must be ISO
+8601 with a time zone, and are stored in UTC; ids must be unique.
+
+Setting SAMPLE_DATA=1 in the environment is equivalent to --sample.
 """
 
+import argparse
+import json
 import os
-from app import create_app
-from database import db
-from models import User, Message
-
-def init_db(with_sample_data=False):
-    """Initialize the database and optionally add sample data."""
-    app = create_app()
-    
-    with app.app_context():
-        # Create all tables
-        db.create_all()
-        
-        print("Database tables created successfully.")
-        
-        # Add sample data if requested
-        if with_sample_data:
-            add_sample_data()
-            print("Sample data added successfully.")
-
-def add_sample_data():
-    """Add sample users and messages to the database."""
-    # Check if we already have users
-    if db.session.query(User).count() > 0:
+import random
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, Iterator, List, Any, Optional, Tuple
+from passlib.hash import pbkdf2_sha256
+import json_storage
+import message_index
+import models  # Imported for the indexes it maintains, so rebuild_all covers them
+
+# Number of records serialized and written to the store at a time
+BATCH_SIZE = 10000
+
+# Default password of synthetic users
+SYNTHETIC_PASSWORD = 'password123'
+
+# Default share of synthetic messages sent privately
+PRIVATE_RATIO = 0.3
+
+# The sample users (username, password, email) and messages (sender, content) of --sample
+SAMPLE_USERS = [
+    ("admin", "admin123", "admin@example.com"),
+    ("user1", "password123", "user1@example.com"),
+    ("user2", "password123", "user2@example.com"),
+]
+SAMPLE_MESSAGES = [
+    ("admin", "Welcome to 0xC Chat!"),
+    ("user1", "Hello, world!"),
+    ("user2", "This is a test message."),
+    ("admin", "Feel free to explore the API."),
+]
+
+
+class _PasswordHashes:
+    """Hashes each distinct password once."""
+
+    def __init__(self):
+        self.hashes: Dict[str, str] = {}
+
+    def get(self, password: str) -> str:
+        if password not in self.hashes:
+            self.hashes[password] = pbkdf2_sha256.hash(password)
+        return self.hashes[password]
+
+
+def read_jsonl(path: str) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    """Read the JSON objects of a JSONL file with their line numbers, skipping blank lines."""
+    with open(path, 'r') as f:
+        for number, line in enumerate(f, 1):
+            if line.strip():
+                yield number, json.loads(line)
+
+def _timestamp(record: Dict[str, Any], field: str, number: int) -> Optional[str]:
+    """Get a record's timestamp field as an ISO 8601 string in UTC, or None if it is missing.
+
+    Raises:
+        ValueError: If the timestamp is not ISO 8601 or has no time zone.
+    """
+    value = record.get(field)
+    if value is None:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'Line {number}: {field} must be an ISO 8601 timestamp')
+    if parsed.tzinfo is None:
+        raise ValueError(f'Line {number}: {field} must include a time zone')
+    return parsed.astimezone(timezone.utc).isoformat()
+
+def _record_id(record: Dict[str, Any], number: int, seen: set) -> Optional[str]:
+    """Get a record's id, or None if it is missing.
+
+    Raises:
+        ValueError: If the id is not a non-empty string or was already seen.
+    """
+    record_id = record.get('id')
+    if record_id is None:
+        return None
+    if not isinstance(record_id, str) or not record_id:
+        raise ValueError(f'Line {number}: id must be a non-empty string')
+    if record_id in seen:
+        raise ValueError(f'Line {number}: id {record_id} already exists')
+    seen.add(record_id)
+    return record_id
+
+def _user(username: str, password_hash: str, email: Optional[str] = None, user_id: Optional[str] = None,
+          created_at: Optional[str] = None) -> Dict[str, Any]:
+    """Build a user's storage dictionary."""
+    return {
+        'id': user_id or str(uuid.uuid4()),
+        'username': username,
+        'password_hash': password_hash,
+        'email': email,
+        'created_at': created_at or datetime.now(timezone.utc).isoformat()
+    }
+
+def _message(sender: Tuple[str, str], content: str, recipient: Optional[Tuple[str, str]] = None,
+             message_id: Optional[str] = None, timestamp: Optional[str] = None) -> Dict[str, Any]:
+    """Build a message's storage dictionary from (id, username) pairs of its sender and recipient."""
+    return {
+        'id': message_id or str(uuid.uuid4()),
+        'user_id': sender[0],
+        'username': sender[1],
+        'content': content,
+        'timestamp': timestamp or datetime.now(timezone.utc).isoformat(),
+        'recipient_id': recipient[0] if recipient else None,
+        'recipient_username': recipient[1] if recipient else None,
+        'attachments': []
+    }
+
+def synthetic_users(count: int, password: str = SYNTHETIC_PASSWORD, prefix: str = 'user',
+                    seed: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+    """Generate users named prefix_<n> sharing one password, hashed once."""
+    rng = random.Random(seed)
+    password_hash = pbkdf2_sha256.hash(password)
+    created_at = datetime.now(timezone.utc).isoformat()
+    # Random suffix, so repeated runs do not generate taken usernames
+    run = uuid.UUID(int=rng.getrandbits(128), version=4).hex[:6]
+    for n in range(count):
+        yield _user(f'{prefix}_{run}_{n}', password_hash, user_id=str(uuid.UUID(int=rng.getrandbits(128), version=4)),
+                    created_at=created_at)
+
+def synthetic_messages(count: int, users: List[Tuple[str, str]], private_ratio: float = PRIVATE_RATIO,
+                       seed: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+    """Generate messages between users, given as (id, username) pairs, one second apart ending now."""
+    rng = random.Random(seed)
+    start = datetime.now(timezone.utc) - timedelta(seconds=count)
+    words = ('hello', 'world', 'chat', 'message', 'json', 'api', 'team', 'lunch', 'deploy', 'review')
+    for n in range(count):
+        sender = rng.choice(users)
+        recipient = rng.choice(users) if rng.random() < private_ratio else None
+        content = ' '.join(rng.choices(words, k=rng.randint(3, 12)))
+        yield _message(sender, content, recipient, str(uuid.UUID(int=rng.getrandbits(128), version=4)),
+                       (start + timedelta(seconds=n)).isoformat())
+
+def users_from_records(records: Iterable[Tuple[int, Dict[str, Any]]]) -> Iterator[Dict[str, Any]]:
+    """Convert the records of a users file to users.
+
+    Raises:
+        ValueError: If a record has no username, neither a password nor a
+            password_hash, a duplicate id or an invalid created_at.
+    """
+    hashes = _PasswordHashes()
+    seen = {user['id'] for user in json_storage.get_users()}
+    for number, record in records:
+        username = record.get('username')
+        if not isinstance(username, str) or not username:
+            raise ValueError(f'Line {number}: username is required')
+        if record.get('password_hash'):
+            password_hash = record['password_hash']
+        elif record.get('password'):
+            password_hash = hashes.get(record['password'])
+        else:
+            raise ValueError(f'Line {number}: password or password_hash is required')
+        yield _user(username, password_hash, record.get('email'), _record_id(record, number, seen),
+                    _timestamp(record, 'created_at', number))
+
+def messages_from_records(records: Iterable[Tuple[int, Dict[str, Any]]], by_id: Dict[str, str],
+                          by_username: Dict[str, str]) -> Iterator[Dict[str, Any]]:
+    """Convert the records of a messages file to messages.
+
+    Args:
+        records: The numbered records of the file
+        by_id: Username of each user by ID
+        by_username: ID of each user by username
+
+    Raises:
+        ValueError: If a record has no content, its sender or recipient does
+            not exist, or it has a duplicate id or an invalid timestamp.
+    """
+    seen = {message['id'] for message in json_storage.get_messages()}
+
+    def resolve(record, number, role):
+        user_id = record.get(f'{role}_id') or by_username.get(record.get(f'{role}_username') or '')
+        if user_id not in by_id:
+            raise ValueError(f'Line {number}: {role} not found')
+        return user_id, by_id[user_id]
+
+    for number, record in records:
+        if not isinstance(record.get('content'), str) or not record['content'].strip():
+            raise ValueError(f'Line {number}: content is required')
+        sender = resolve({'user_id': record.get('user_id'), 'user_username': record.get('username')}, number, 'user')
+        recipient = None
+        if record.get('recipient_id') or record.get('recipient_username'):
+            recipient = resolve(record, number, 'recipient')
+        yield _message(sender, record['content'], recipient, _record_id(record, number, seen),
+                       _timestamp(record, 'timestamp', number))
+
+def load(users: Iterable[Dict[str, Any]] = (), messages: Optional[Iterable[Dict[str, Any]]] = None,
+         message_count: int = 0, private_ratio: float = PRIVATE_RATIO, seed: Optional[int] = None,
+         batch_size: int = BATCH_SIZE, rebuild_indexes: bool = True) -> Dict[str, int]:
+    """Append users and messages to the store, then rebuild the indexes once.
+
+    Args:
+        users: The users to add; usernames already taken are rejected
+        messages: The messages to add, or a callable taking the ID to
+            username and username to ID maps of every user and returning them
+        message_count: Number of synthetic messages between all users to add if messages is None
+        private_ratio: Share of synthetic messages sent privately
+        seed: Optional random seed of the synthetic messages
+        batch_size: Number of records written to the store at a time
+        rebuild_indexes: Rebuild the indexes after loading
+
+    Returns:
+        The number of 'users' and 'messages' added, and 'indexed' messages.
+
+    Raises:
+        ValueError: If a username or user ID is taken or duplicated.
+    """
+    json_storage.init_storage()
+
+    by_id = {user['id']: user['username'] for user in json_storage.get_users()}
+    by_username = {username: user_id for user_id, username in by_id.items()}
+
+    def track(new_users):
+        for user in new_users:
+            if user['username'] in by_username:
+                raise ValueError(f"Username {user['username']} already exists")
+            if user['id'] in by_id:
+                raise ValueError(f"User ID {user['id']} already exists")
+            by_id[user['id']] = user['username']
+            by_username[user['username']] = user['id']
+            yield user
+
+    user_count = json_storage.bulk_load_users(track(users), batch_size)
+
+    if callable(messages):
+        messages = messages(by_id, by_username)
+    elif messages is None:
+        messages = synthetic_messages(message_count, list(by_id.items()), private_ratio, seed) if by_id else ()
+    message_count = json_storage.bulk_load_messages(messages, batch_size)
+
+    indexed = message_index.rebuild_all() if rebuild_indexes else 0
+    return {'users': user_count, 'messages': message_count, 'indexed': indexed}
+
+def load_sample_data() -> Dict[str, int]:
+    """Add the sample users and messages, unless the sample users already exist."""
+    if json_storage.get_user_by_username(SAMPLE_USERS[0][0]):
         print("Sample data already exists. Skipping.")
-        return
-    
-    # Create sample users
-    admin = User.register("admin", "admin123", "admin@example.com")
-    user1 = User.register("user1", "password123", "user1@example.com")
-    user2 = User.register("user2", "password123", "user2@example.com")
-    
-    # Create sample messages
-    Message.add(admin.id, "Welcome to 0xC Chat!")
-    Message.add(user1.id, "Hello, world!")
-    Message.add(user2.id, "This is a test message.")
-    Message.add(admin.id, "Feel free to explore the API.")
-    
-    print(f"Created {db.session.query(User).count()} sample users.")
-    print(f"Created {db.session.query(Message).count()} sample messages.")
+        return {'users': 0, 'messages': 0, 'indexed': 0}
+
+    hashes = _PasswordHashes()
+    users = [_user(username, hashes.get(password), email) for username, password, email in SAMPLE_USERS]
+
+    def messages(by_id, by_username):
+        return [_message((by_username[sender], sender), content) for sender, content in SAMPLE_MESSAGES]
+
+    return load(users, messages)
+
+def parse_arguments():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description="Bulk data loader for the 0xC Chat application")
+    parser.add_argument("--sample", action="store_true", help="Add a few sample users and messages")
+    parser.add_argument("--users", type=int, default=0, help="Number of synthetic users to add")
+    parser.add_argument("--messages", type=int, default=0,
+                        help="Number of synthetic messages to add, between all users")
+    parser.add_argument("--users-file", help="JSONL file of users to add instead of synthetic ones")
+    parser.add_argument("--messages-file", help="JSONL file of messages to add instead of synthetic ones")
+    parser.add_argument("--password", default=SYNTHETIC_PASSWORD, help="Password of the synthetic users")
+    parser.add_argument("--private-ratio", type=float, default=PRIVATE_RATIO,
+                        help="Share of synthetic messages sent privately")
+    parser.add_argument("--seed", type=int, help="Random seed of the synthetic data")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE,
+                        help="Number of records written to the store at a time")
+    return parser.parse_args()
+
 
 if __name__ == "__main__":
-    # Check if we should add sample data
-    sample_data = os.environ.get("SAMPLE_DATA", "0") == "1"
-    
-    # Initialize the database
-    init_db(with_sample_data=sample_data)
+    args = parse_arguments()
+    started = time.perf_counter()
+
+    if args.sample or os.environ.get("SAMPLE_DATA", "0") == "1":
+        counts = load_sample_data()
+    else:
+        if args.users_file:
+            users = users_from_records(read_jsonl(args.users_file))
+        else:
+            users = synthetic_users(args.users, args.password, seed=args.seed)
+
+        messages = None
+        if args.messages_file:
+            def messages(by_id, by_username):
+                return messages_from_records(read_jsonl(args.messages_file), by_id, by_username)
+
+        counts = load(users, messages, args.messages, args.private_ratio, args.seed, args.batch_size)
+
+    print(f"Added {counts['users']} users and {counts['messages']} messages, "
+          f"indexed {counts['indexed']} messages in {time.perf_counter() - started:.1f}s")
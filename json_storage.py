@@ -5,16 +5,32 @@ This module provides functions to read and write data to JSON files,
 serving as a simple persistence layer for the application.
 """
 
+import heapq
+import itertools
 import json
 import os
-from datetime import datetime
-from typing import Dict, List, Any, Optional
-from env import DATA_DIR
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Any, Optional, Set
+import metrics
+from singleflight import SingleFlight
+from timing import instrument_functions
+from env import (
+    DATA_DIR, TOKEN_SWEEP_INTERVAL, TOKEN_SWEEP_BATCH_SIZE, MAX_SESSIONS_PER_USER,
+    MESSAGE_FRAGMENT_CACHE_SIZE, TOMBSTONE_RETENTION_DAYS
+)
 
 # File paths for JSON storage
 USERS_FILE = os.path.join(DATA_DIR, "users.json")
 MESSAGES_FILE = os.path.join(DATA_DIR, "messages.json")
 TOKENS_FILE = os.path.join(DATA_DIR, "tokens.json")
+SYNC_FILE = os.path.join(DATA_DIR, "sync.json")
+ROOMS_FILE = os.path.join(DATA_DIR, "rooms.json")
+ROOMS_DIR = os.path.join(DATA_DIR, "rooms")
+READ_MARKERS_FILE = os.path.join(DATA_DIR, "read_markers.json")
+ATTACHMENTS_FILE = os.path.join(DATA_DIR, "attachments.json")
 
 # Initialize empty data structures if files don't exist
 def init_storage():
@@ -23,39 +39,87 @@ def init_storage():
     os.makedirs(DATA_DIR, exist_ok=True)
 
     if not os.path.exists(USERS_FILE):
-        with open(USERS_FILE, 'w') as f:
-            json.dump([], f)
+        _write_json(USERS_FILE, [], indent=None)
 
     if not os.path.exists(MESSAGES_FILE):
-        with open(MESSAGES_FILE, 'w') as f:
-            json.dump([], f)
+        _write_json(MESSAGES_FILE, [], indent=None)
 
     if not os.path.exists(TOKENS_FILE):
-        with open(TOKENS_FILE, 'w') as f:
-            json.dump([], f)
+        _write_json(TOKENS_FILE, [], indent=None)
+
+    if not os.path.exists(SYNC_FILE):
+        _write_json(SYNC_FILE, _empty_sync_state(), indent=None)
+
+    if not os.path.exists(ROOMS_FILE):
+        _write_json(ROOMS_FILE, [], indent=None)
+
+    if not os.path.exists(READ_MARKERS_FILE):
+        _write_json(READ_MARKERS_FILE, {}, indent=None)
+
+    if not os.path.exists(ATTACHMENTS_FILE):
+        _write_json(ATTACHMENTS_FILE, {}, indent=None)
+
+    # Each room's messages are stored in their own file in the rooms directory
+    os.makedirs(ROOMS_DIR, exist_ok=True)
+
+    _backfill_seq()
+
+def _file_signature(path: str) -> Optional[tuple]:
+    """Return an (mtime, size) signature used to detect changes to a data file."""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+def _file_label(path: str) -> str:
+    """Get the name of a data file in the storage metrics; room partitions share one."""
+    if os.path.dirname(path) == ROOMS_DIR:
+        return 'room_messages'
+    return os.path.splitext(os.path.basename(path))[0]
+
+def _read_json(path: str) -> Any:
+    """Read a JSON data file, counting the read in the storage metrics."""
+    with open(path, 'r') as f:
+        data = json.load(f)
+        size = f.tell()
+    metrics.inc('chat_storage_reads_total', file=_file_label(path))
+    metrics.inc('chat_storage_read_bytes_total', size, file=_file_label(path))
+    return data
+
+def _write_json(path: str, data: Any, indent: Optional[int] = 2) -> None:
+    """Write a JSON data file, counting the write in the storage metrics."""
+    with open(path, 'w') as f:
+        json.dump(data, f, indent=indent)
+        size = f.tell()
+    metrics.inc('chat_storage_writes_total', file=_file_label(path))
+    metrics.inc('chat_storage_written_bytes_total', size, file=_file_label(path))
 
 # User storage functions
+_users_lock = threading.RLock()
+
 def get_users() -> List[Dict[str, Any]]:
     """Get all users from the JSON file."""
     # Ensure data directory exists
     os.makedirs(DATA_DIR, exist_ok=True)
 
-    try:
-        with open(USERS_FILE, 'r') as f:
-            return json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
-        # If file doesn't exist or is invalid, initialize it
-        with open(USERS_FILE, 'w') as f:
-            json.dump([], f)
-        return []
+    # Held while reading too, so a concurrent save is never read half-written
+    # and mistaken for an invalid file
+    with _users_lock:
+        try:
+            return _read_json(USERS_FILE)
+        except (FileNotFoundError, json.JSONDecodeError):
+            # If file doesn't exist or is invalid, initialize it
+            _write_json(USERS_FILE, [], indent=None)
+            return []
 
 def save_users(users: List[Dict[str, Any]]) -> None:
     """Save users to the JSON file."""
     # Ensure data directory exists
     os.makedirs(DATA_DIR, exist_ok=True)
 
-    with open(USERS_FILE, 'w') as f:
-        json.dump(users, f, indent=2)
+    with _users_lock:
+        _write_json(USERS_FILE, users)
 
 def get_user_by_id(user_id: str) -> Optional[Dict[str, Any]]:
     """Get a user by ID."""
@@ -73,53 +137,212 @@ def get_user_by_username(username: str) -> Optional[Dict[str, Any]]:
             return user
     return None
 
+def get_users_by_ids(user_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    """Get the users with the given IDs, keyed by ID, with a single read of users.json.
+
+    IDs that do not exist are left out of the result.
+    """
+    wanted = set(user_ids)
+    return {user['id']: user for user in get_users() if user['id'] in wanted}
+
 def add_user(user: Dict[str, Any]) -> Dict[str, Any]:
     """Add a new user."""
-    users = get_users()
-    users.append(user)
-    save_users(users)
+    with _users_lock:
+        users = get_users()
+        users.append(user)
+        save_users(users)
     return user
 
 def update_user(user_id: str, updated_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
     """Update a user's data."""
-    users = get_users()
-    for i, user in enumerate(users):
-        if user['id'] == user_id:
-            users[i].update(updated_data)
-            save_users(users)
-            return users[i]
+    with _users_lock:
+        users = get_users()
+        for i, user in enumerate(users):
+            if user['id'] == user_id:
+                users[i].update(updated_data)
+                save_users(users)
+                return users[i]
     return None
 
+def _write_json_array(path: str, items: Iterable[Any], batch_size: int) -> int:
+    """Stream items into a JSON array file, serializing and writing them a batch at a time.
+
+    The array is written to a temporary file that replaces the file only
+    once every item is written, so a failure part way leaves it unchanged.
+
+    Returns:
+        The number of items written.
+    """
+    os.makedirs(DATA_DIR, exist_ok=True)
+    temp_file = f'{path}.tmp'
+    count = 0
+    try:
+        with open(temp_file, 'w') as f:
+            f.write('[')
+            batch = []
+            for item in itertools.chain(items, [None]):
+                if item is not None:
+                    batch.append(json.dumps(item))
+                if batch and (item is None or len(batch) >= batch_size):
+                    f.write((',\n' if count else '\n') + ',\n'.join(batch))
+                    count += len(batch)
+                    batch = []
+            f.write('\n]\n')
+            size = f.tell()
+        os.replace(temp_file, path)
+        metrics.inc('chat_storage_writes_total', file=_file_label(path))
+        metrics.inc('chat_storage_written_bytes_total', size, file=_file_label(path))
+    except BaseException:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+        raise
+    return count
+
+def bulk_load_users(users: Iterable[Dict[str, Any]], batch_size: int = 10000) -> int:
+    """Append users to the store, streaming them into users.json batch by batch.
+
+    Returns:
+        The number of users added.
+    """
+    with _users_lock:
+        existing = get_users()
+        return _write_json_array(USERS_FILE, itertools.chain(existing, users), batch_size) - len(existing)
+
 # Message storage functions
+class _FragmentCache:
+    """Bounded LRU cache of each message's serialized JSON bytes.
+
+    Messages never change once written, so a message's fragment can be
+    reused for every list response it appears in until it is deleted.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.fragments: "OrderedDict[str, bytes]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def put(self, message: Dict[str, Any]) -> bytes:
+        """Serialize a message and store its fragment."""
+        fragment = json.dumps(message, separators=(',', ':'), sort_keys=True).encode('utf-8')
+        if self.max_size > 0:
+            with self.lock:
+                self.fragments[message['id']] = fragment
+                self.fragments.move_to_end(message['id'])
+                while len(self.fragments) > self.max_size:
+                    self.fragments.popitem(last=False)
+        return fragment
+
+    def get(self, message: Dict[str, Any]) -> bytes:
+        """Get a message's fragment, serializing it on a cache miss."""
+        with self.lock:
+            fragment = self.fragments.get(message['id'])
+            if fragment is not None:
+                self.fragments.move_to_end(message['id'])
+                self.hits += 1
+                return fragment
+            self.misses += 1
+        return self.put(message)
+
+    def evict(self, message_id: str) -> None:
+        """Drop a message's fragment."""
+        with self.lock:
+            self.fragments.pop(message_id, None)
+
+class _MessageCache:
+    """Parsed contents of messages.json for the version last read or written.
+
+    The index by message ID is built lazily, the first time it is needed
+    for a given version.
+    """
+
+    def __init__(self):
+        self.version = None
+        self.messages: List[Dict[str, Any]] = []
+        self._by_id: Optional[Dict[str, Dict[str, Any]]] = None
+
+    def set(self, version: Optional[tuple], messages: List[Dict[str, Any]]) -> None:
+        """Replace the cached messages."""
+        self.messages = messages
+        self._by_id = None
+        self.version = version
+
+    def by_id(self) -> Dict[str, Dict[str, Any]]:
+        """Get the cached messages indexed by ID."""
+        by_id = self._by_id
+        if by_id is None:
+            by_id = {message['id']: message for message in self.messages}
+            self._by_id = by_id
+        return by_id
+
+_fragment_cache = _FragmentCache(MESSAGE_FRAGMENT_CACHE_SIZE)
+_message_cache = _MessageCache()
+_messages_lock = threading.RLock()
+_messages_flight = SingleFlight('messages')
+
+def get_messages_version() -> Optional[tuple]:
+    """Get a version of the message store that changes on every write."""
+    return _file_signature(MESSAGES_FILE)
+
+def _current_messages() -> _MessageCache:
+    """Get the message cache, reloading it if messages.json changed on disk.
+
+    Concurrent reloads of the same version of the file are coalesced into
+    a single parse.
+    """
+    version = get_messages_version()
+    if version is None or version != _message_cache.version:
+        metrics.inc('chat_cache_misses_total', cache='messages')
+        _messages_flight.do(version, lambda: _load_messages(version))
+    else:
+        metrics.inc('chat_cache_hits_total', cache='messages')
+    return _message_cache
+
 def get_messages() -> List[Dict[str, Any]]:
-    """Get all messages from the JSON file."""
+    """Get all messages from the JSON file.
+
+    Each caller gets its own list, but the message dictionaries are
+    shared with the cache and must not be modified.
+    """
+    return list(_current_messages().messages)
+
+def _load_messages(version: Optional[tuple]) -> List[Dict[str, Any]]:
+    """Load all messages from the JSON file into the cache."""
     # Ensure data directory exists
     os.makedirs(DATA_DIR, exist_ok=True)
 
     try:
-        with open(MESSAGES_FILE, 'r') as f:
-            return json.load(f)
+        messages = _read_json(MESSAGES_FILE)
     except (FileNotFoundError, json.JSONDecodeError):
         # If file doesn't exist or is invalid, initialize it
-        with open(MESSAGES_FILE, 'w') as f:
-            json.dump([], f)
-        return []
+        _write_json(MESSAGES_FILE, [], indent=None)
+        messages = []
+        version = get_messages_version()
+
+    _message_cache.set(version, messages)
+    return messages
 
 def save_messages(messages: List[Dict[str, Any]]) -> None:
     """Save messages to the JSON file."""
     # Ensure data directory exists
     os.makedirs(DATA_DIR, exist_ok=True)
 
-    with open(MESSAGES_FILE, 'w') as f:
-        json.dump(messages, f, indent=2)
+    _write_json(MESSAGES_FILE, messages)
+
+    _message_cache.set(get_messages_version(), list(messages))
 
 def get_message_by_id(message_id: str) -> Optional[Dict[str, Any]]:
     """Get a message by ID."""
-    messages = get_messages()
-    for message in messages:
-        if message['id'] == message_id:
-            return message
-    return None
+    return _current_messages().by_id().get(message_id)
+
+def get_messages_by_ids(message_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    """Get the messages with the given IDs, keyed by ID.
+
+    IDs that do not exist are left out of the result.
+    """
+    by_id = _current_messages().by_id()
+    return {message_id: by_id[message_id] for message_id in message_ids if message_id in by_id}
 
 def get_messages_by_user(user_id: str) -> List[Dict[str, Any]]:
     """Get all messages by a specific user."""
@@ -127,72 +350,853 @@ def get_messages_by_user(user_id: str) -> List[Dict[str, Any]]:
     return [message for message in messages if message['user_id'] == user_id]
 
 def add_message(message: Dict[str, Any]) -> Dict[str, Any]:
-    """Add a new message."""
-    messages = get_messages()
-    messages.append(message)
-    save_messages(messages)
+    """Add a new message, assigning it the next change sequence number."""
+    with _messages_lock:
+        messages = get_messages()
+        message['seq'] = _current_seq(messages, get_sync_state()) + 1
+        messages.append(message)
+        save_messages(messages)
+    _fragment_cache.put(message)
     return message
 
+def add_messages(messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Add a batch of new messages with a single write, assigning them consecutive sequence numbers."""
+    with _messages_lock:
+        stored = get_messages()
+        seq = _current_seq(stored, get_sync_state())
+        for message in messages:
+            seq += 1
+            message['seq'] = seq
+        stored.extend(messages)
+        save_messages(stored)
+    for message in messages:
+        _fragment_cache.put(message)
+    return messages
+
+def bulk_load_messages(messages: Iterable[Dict[str, Any]], batch_size: int = 10000) -> int:
+    """Append messages to the store, streaming them into messages.json batch by batch.
+
+    The messages are assigned consecutive sequence numbers as they are
+    written, and are not added to the fragment cache or the indexes,
+    which have to be rebuilt afterwards.
+
+    Returns:
+        The number of messages added.
+    """
+    with _messages_lock:
+        stored = get_messages()
+        seq = _current_seq(stored, get_sync_state())
+
+        def numbered():
+            nonlocal seq
+            for message in messages:
+                seq += 1
+                message['seq'] = seq
+                yield message
+
+        return _write_json_array(MESSAGES_FILE, itertools.chain(stored, numbered()), batch_size) - len(stored)
+
 def delete_message(message_id: str, user_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
-    """Delete a message by ID, optionally checking user ownership."""
-    messages = get_messages()
-    for i, message in enumerate(messages):
-        if message['id'] == message_id:
-            # If user_id is provided, check ownership
-            if user_id and message['user_id'] != user_id:
-                return None
-            deleted_message = messages.pop(i)
-            save_messages(messages)
-            return deleted_message
+    """Delete a message by ID, optionally checking user ownership.
+
+    A tombstone is recorded for the deleted message so that clients
+    syncing with get_changes_since learn about the delete.
+    """
+    with _messages_lock:
+        messages = get_messages()
+        for i, message in enumerate(messages):
+            if message['id'] == message_id:
+                # If user_id is provided, check ownership
+                if user_id and message['user_id'] != user_id:
+                    return None
+                deleted_message = messages.pop(i)
+                save_messages(messages)
+                _fragment_cache.evict(message_id)
+                _record_tombstones([deleted_message], messages)
+                return deleted_message
     return None
 
+def remove_messages(message_ids: List[str]) -> List[Dict[str, Any]]:
+    """Remove a batch of messages with a single write to messages.json.
+
+    Tombstones are recorded for the removed messages, as for deletes, so
+    syncing clients and indexes over the store drop them too.
+
+    Returns:
+        The removed messages.
+    """
+    removed_ids = set(message_ids)
+    with _messages_lock:
+        messages = get_messages()
+        kept = [message for message in messages if message['id'] not in removed_ids]
+        if len(kept) == len(messages):
+            return []
+
+        removed = [message for message in messages if message['id'] in removed_ids]
+        save_messages(kept)
+        for message in removed:
+            _fragment_cache.evict(message['id'])
+        _record_tombstones(removed, kept)
+    return removed
+
+def serialize_messages(messages: List[Dict[str, Any]]) -> bytes:
+    """Serialize a list of messages as a JSON array.
+
+    The array is assembled from each message's cached fragment, so only
+    messages missing from the cache are serialized.
+    """
+    return b'[' + b','.join(_fragment_cache.get(message) for message in messages) + b']'
+
+# Sync storage functions
+def _empty_sync_state() -> Dict[str, Any]:
+    """Get the sync state of an empty store."""
+    return {'last_seq': 0, 'pruned_seq': 0, 'tombstones': []}
+
+_sync_cache: Dict[str, Any] = {'version': None, 'state': None}
+
+def get_sync_state() -> Dict[str, Any]:
+    """Get the change sequence state and delete tombstones from the JSON file.
+
+    The state holds:
+        last_seq: The highest sequence number recorded by a delete
+        pruned_seq: The highest sequence number of a tombstone dropped by retention
+        tombstones: Deleted messages, in sequence order
+
+    The file is only parsed again when it changed on disk.
+    """
+    version = _file_signature(SYNC_FILE)
+    state = _sync_cache['state']
+    if version is None or version != _sync_cache['version']:
+        try:
+            state = _read_json(SYNC_FILE)
+        except (FileNotFoundError, json.JSONDecodeError):
+            state = _empty_sync_state()
+        _sync_cache.update(version=version, state=state)
+    return dict(state, tombstones=list(state['tombstones']))
+
+def save_sync_state(state: Dict[str, Any]) -> None:
+    """Save the sync state to the JSON file."""
+    # Ensure data directory exists
+    os.makedirs(DATA_DIR, exist_ok=True)
+
+    _write_json(SYNC_FILE, state)
+
+    _sync_cache.update(version=_file_signature(SYNC_FILE), state=dict(state, tombstones=list(state['tombstones'])))
+
+def get_current_seq() -> int:
+    """Get the highest change sequence number handed out so far."""
+    return _current_seq(_current_messages().messages, get_sync_state())
+
+def _current_seq(messages: List[Dict[str, Any]], state: Dict[str, Any]) -> int:
+    """Get the highest sequence number handed out so far.
+
+    Messages are only ever appended, so the last message carries the
+    highest insert sequence number. Deletes are tracked in the sync state.
+    """
+    last_insert = messages[-1].get('seq', 0) if messages else 0
+    return max(last_insert, state['last_seq'])
+
+def _record_tombstones(deleted_messages: List[Dict[str, Any]], messages: List[Dict[str, Any]]) -> None:
+    """Record delete tombstones and drop those past the retention window.
+
+    Must be called with _messages_lock held, after the deleted messages
+    have been removed from messages.
+    """
+    state = get_sync_state()
+    seq = max([_current_seq(messages, state)] + [message.get('seq', 0) for message in deleted_messages])
+    now = datetime.now(timezone.utc)
+
+    for message in deleted_messages:
+        seq += 1
+        state['tombstones'].append({
+            'seq': seq,
+            'id': message['id'],
+            'user_id': message['user_id'],
+            'recipient_id': message.get('recipient_id'),
+            'deleted_at': now.isoformat()
+        })
+    state['last_seq'] = seq
+
+    cutoff = (now - timedelta(days=TOMBSTONE_RETENTION_DAYS)).isoformat()
+    tombstones = state['tombstones']
+    pruned = 0
+    while pruned < len(tombstones) and tombstones[pruned]['deleted_at'] < cutoff:
+        pruned += 1
+    if pruned:
+        state['pruned_seq'] = max(state['pruned_seq'], tombstones[pruned - 1]['seq'])
+        state['tombstones'] = tombstones[pruned:]
+
+    save_sync_state(state)
+
+def _backfill_seq() -> int:
+    """Number the messages stored before they were given change sequence numbers.
+
+    Only the messages without a sequence number are numbered, in file
+    order after the highest number handed out so far, so the cursors and
+    read markers of the others stay valid. Being new to syncing clients
+    and indexes, they are moved after the numbered messages, keeping the
+    file in sequence order.
+
+    Returns:
+        The number of messages numbered, 0 if every message has a sequence number.
+    """
+    with _messages_lock:
+        messages = get_messages()
+        if all('seq' in message for message in messages):
+            return 0
+
+        state = get_sync_state()
+        seq = max([state['last_seq']] + [message.get('seq', 0) for message in messages])
+        numbered = []
+        for message in messages:
+            if 'seq' not in message:
+                seq += 1
+                numbered.append(dict(message, seq=seq))
+        save_messages([message for message in messages if 'seq' in message] + numbered)
+        for message in numbered:
+            _fragment_cache.evict(message['id'])
+        return len(numbered)
+
+def _tail_after_seq(entries: List[Dict[str, Any]], seq: int) -> List[Dict[str, Any]]:
+    """Get the entries of a sequence-ordered list with a sequence number above seq.
+
+    The list is walked backwards from the end, so the cost is proportional
+    to the number of entries returned rather than the length of the list.
+    """
+    start = len(entries)
+    while start > 0 and entries[start - 1].get('seq', 0) > seq:
+        start -= 1
+    return entries[start:]
+
+def get_changes_since(seq: int) -> Dict[str, Any]:
+    """Get the inserts and delete tombstones recorded after a sequence number.
+
+    Returns:
+        A dictionary with the inserted 'messages' and 'tombstones' with a
+        sequence number greater than seq, the current 'last_seq', and
+        'pruned_seq', the highest sequence number whose tombstone may no
+        longer be available.
+    """
+    with _messages_lock:
+        messages = _current_messages().messages
+        state = get_sync_state()
+
+    return {
+        'messages': _tail_after_seq(messages, seq),
+        'tombstones': _tail_after_seq(state['tombstones'], seq),
+        'last_seq': _current_seq(messages, state),
+        'pruned_seq': state['pruned_seq']
+    }
+
+# Read marker storage functions
+_read_markers_cache: Dict[str, Any] = {'version': None, 'markers': {}}
+_read_markers_lock = threading.RLock()
+
+def get_read_markers_version() -> Optional[tuple]:
+    """Get the signature of read_markers.json, which changes whenever a marker is moved."""
+    return _file_signature(READ_MARKERS_FILE)
+
+def get_read_markers() -> Dict[str, Dict[str, Any]]:
+    """Get every user's read markers from the JSON file.
+
+    Each user ID maps to a marker of:
+        all: The sequence number up to which every message has been read
+        conversations: Sequence numbers up to which each conversation, by
+            the other user's ID, has been read, where ahead of all
+
+    The file is only parsed again when it changed on disk, and the
+    returned dictionary is shared, so it must not be modified.
+    """
+    with _read_markers_lock:
+        version = get_read_markers_version()
+        if version is None or version != _read_markers_cache['version']:
+            try:
+                markers = _read_json(READ_MARKERS_FILE)
+            except (FileNotFoundError, json.JSONDecodeError):
+                markers = {}
+            _read_markers_cache.update(version=version, markers=markers)
+        return _read_markers_cache['markers']
+
+def get_read_marker(user_id: str) -> Dict[str, Any]:
+    """Get a copy of a user's read marker."""
+    marker = get_read_markers().get(user_id, {'all': 0, 'conversations': {}})
+    return {'all': marker['all'], 'conversations': dict(marker['conversations'])}
+
+def set_read_marker(user_id: str, seq: int, other_user_id: Optional[str] = None) -> Dict[str, Any]:
+    """Mark a user's messages as read up to a sequence number.
+
+    Markers only move forward. Without other_user_id every message is
+    marked read, otherwise only the conversation with that user.
+
+    Returns:
+        A copy of the user's updated read marker.
+    """
+    with _read_markers_lock:
+        markers = dict(get_read_markers())
+        marker = get_read_marker(user_id)
+        if other_user_id is None:
+            marker['all'] = max(marker['all'], seq)
+            marker['conversations'] = {
+                other: other_seq for other, other_seq in marker['conversations'].items() if other_seq > marker['all']
+            }
+        elif seq > max(marker['all'], marker['conversations'].get(other_user_id, 0)):
+            marker['conversations'][other_user_id] = seq
+        markers[user_id] = marker
+
+        # Ensure data directory exists
+        os.makedirs(DATA_DIR, exist_ok=True)
+
+        _write_json(READ_MARKERS_FILE, markers)
+
+        _read_markers_cache.update(version=get_read_markers_version(), markers=markers)
+        return get_read_marker(user_id)
+
+# Attachment storage functions
+_attachments_cache: Dict[str, Any] = {'version': None, 'attachments': {}}
+_attachments_lock = threading.RLock()
+
+def _get_attachments() -> Dict[str, Dict[str, Any]]:
+    """Get the metadata of every attachment by hash, parsing attachments.json only when it changed.
+
+    Must be called with _attachments_lock held. The returned dictionary
+    is shared, so it must not be modified.
+    """
+    version = _file_signature(ATTACHMENTS_FILE)
+    if version is None or version != _attachments_cache['version']:
+        try:
+            attachments = _read_json(ATTACHMENTS_FILE)
+        except (FileNotFoundError, json.JSONDecodeError):
+            attachments = {}
+        _attachments_cache.update(version=version, attachments=attachments)
+    return _attachments_cache['attachments']
+
+def _save_attachments(attachments: Dict[str, Dict[str, Any]]) -> None:
+    """Save attachment metadata to the JSON file. Must be called with _attachments_lock held."""
+    # Ensure data directory exists
+    os.makedirs(DATA_DIR, exist_ok=True)
+
+    _write_json(ATTACHMENTS_FILE, attachments)
+
+    _attachments_cache.update(version=_file_signature(ATTACHMENTS_FILE), attachments=attachments)
+
+def _copy_attachment(attachment: Dict[str, Any]) -> Dict[str, Any]:
+    """Copy an attachment's metadata so the cached copy cannot be modified."""
+    return dict(attachment, uploaded_by=list(attachment['uploaded_by']), messages=list(attachment['messages']))
+
+def get_attachment(attachment_hash: str) -> Optional[Dict[str, Any]]:
+    """Get an attachment's metadata by hash."""
+    with _attachments_lock:
+        attachment = _get_attachments().get(attachment_hash)
+        return _copy_attachment(attachment) if attachment else None
+
+def add_attachment_upload(attachment: Dict[str, Any], user_id: str) -> Dict[str, Any]:
+    """Record an upload of an attachment by a user.
+
+    The metadata is only created on the first upload of the content;
+    later uploads of the same content just add the user to uploaded_by.
+
+    Returns:
+        The attachment's metadata.
+    """
+    with _attachments_lock:
+        attachments = dict(_get_attachments())
+        existing = attachments.get(attachment['hash'])
+        updated = _copy_attachment(existing) if existing else dict(attachment, uploaded_by=[], messages=[])
+        if user_id not in updated['uploaded_by']:
+            updated['uploaded_by'].append(user_id)
+            attachments[attachment['hash']] = updated
+            _save_attachments(attachments)
+        return _copy_attachment(updated)
+
+def add_attachment_references(attachment_hashes: List[str], message_id: str) -> List[str]:
+    """Record that a message references attachments.
+
+    Nothing is recorded if any of the attachments no longer exists, for
+    example because it was removed since the message was validated.
+
+    Returns:
+        The hashes of the attachments that do not exist.
+    """
+    with _attachments_lock:
+        attachments = dict(_get_attachments())
+        missing = [attachment_hash for attachment_hash in attachment_hashes if attachment_hash not in attachments]
+        if missing:
+            return missing
+        for attachment_hash in attachment_hashes:
+            updated = _copy_attachment(attachments[attachment_hash])
+            updated['messages'].append(message_id)
+            attachments[attachment_hash] = updated
+        _save_attachments(attachments)
+        return []
+
+def remove_attachment_references(attachment_hashes: List[str], message_id: str, user_id: str) -> List[str]:
+    """Record that a user's deleted message no longer references attachments.
+
+    Posting an attachment uses up the sender's upload of it, so the sender
+    is also removed from its uploaders. Attachments that no message
+    references and no other user has uploaded are removed.
+
+    Returns:
+        The hashes of the removed attachments, whose blobs can be deleted.
+    """
+    with _attachments_lock:
+        attachments = dict(_get_attachments())
+        removed = []
+        for attachment_hash in attachment_hashes:
+            if attachment_hash not in attachments:
+                continue
+            updated = _copy_attachment(attachments[attachment_hash])
+            updated['messages'] = [other for other in updated['messages'] if other != message_id]
+            updated['uploaded_by'] = [uploader for uploader in updated['uploaded_by'] if uploader != user_id]
+            if updated['messages'] or updated['uploaded_by']:
+                attachments[attachment_hash] = updated
+            else:
+                del attachments[attachment_hash]
+                removed.append(attachment_hash)
+        _save_attachments(attachments)
+        return removed
+
 # Token storage functions
+class _TokenIndex:
+    """In-memory index over tokens.json.
+
+    Tokens are kept by ID (in file order) alongside a min-heap keyed on
+    expiry time, so lookups are O(1) and expired tokens can be popped off
+    in order without scanning the whole list. Entries for tokens deleted
+    by other means are left in the heap and skipped when popped.
+
+    Each user's sessions are also kept in a per-user table ordered from
+    oldest to newest, so a user's sessions can be listed, capped and
+    revoked without scanning every token.
+    """
+
+    def __init__(self):
+        self.signature = None
+        self.by_id: Dict[str, Dict[str, Any]] = {}
+        self.by_user: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self.expiry_heap: List[tuple] = []
+
+    def rebuild(self, tokens: List[Dict[str, Any]]) -> None:
+        """Rebuild the index from a full list of tokens."""
+        self.by_id = {token['id']: token for token in tokens}
+        self.by_user = {}
+        for token in tokens:
+            self.by_user.setdefault(token['user_id'], {})[token['id']] = token
+        self.expiry_heap = [(_expiry_timestamp(token), token['id']) for token in tokens]
+        heapq.heapify(self.expiry_heap)
+        self.signature = _file_signature(TOKENS_FILE)
+
+    def add(self, token: Dict[str, Any]) -> None:
+        """Add a token that has just been written to disk."""
+        self.by_id[token['id']] = token
+        self.by_user.setdefault(token['user_id'], {})[token['id']] = token
+        heapq.heappush(self.expiry_heap, (_expiry_timestamp(token), token['id']))
+        self.signature = _file_signature(TOKENS_FILE)
+
+    def remove(self, token_ids) -> None:
+        """Drop tokens that have just been removed from disk."""
+        for token_id in token_ids:
+            token = self.by_id.pop(token_id, None)
+            if token is None:
+                continue
+            sessions = self.by_user.get(token['user_id'])
+            if sessions is not None:
+                sessions.pop(token_id, None)
+                if not sessions:
+                    del self.by_user[token['user_id']]
+        self.signature = _file_signature(TOKENS_FILE)
+
+_token_index = _TokenIndex()
+_tokens_lock = threading.RLock()
+_token_sweeper = None
+
+def _expiry_timestamp(token: Dict[str, Any]) -> float:
+    """Get a token's expiry time as a POSIX timestamp."""
+    return datetime.fromisoformat(token['expires_at']).timestamp()
+
+def _get_token_index() -> _TokenIndex:
+    """Get the token index, rebuilding it if tokens.json changed on disk.
+
+    Must be called with _tokens_lock held.
+    """
+    if _token_index.signature is None or _token_index.signature != _file_signature(TOKENS_FILE):
+        _token_index.rebuild(get_tokens())
+    return _token_index
+
+def _write_tokens(tokens: List[Dict[str, Any]]) -> None:
+    """Write refresh tokens to the JSON file without touching the index."""
+    # Ensure data directory exists
+    os.makedirs(DATA_DIR, exist_ok=True)
+
+    _write_json(TOKENS_FILE, tokens)
+
 def get_tokens() -> List[Dict[str, Any]]:
     """Get all refresh tokens from the JSON file."""
     # Ensure data directory exists
     os.makedirs(DATA_DIR, exist_ok=True)
 
     try:
-        with open(TOKENS_FILE, 'r') as f:
-            return json.load(f)
+        return _read_json(TOKENS_FILE)
     except (FileNotFoundError, json.JSONDecodeError):
         # If file doesn't exist or is invalid, initialize it
-        with open(TOKENS_FILE, 'w') as f:
-            json.dump([], f)
+        _write_json(TOKENS_FILE, [], indent=None)
         return []
 
 def save_tokens(tokens: List[Dict[str, Any]]) -> None:
     """Save refresh tokens to the JSON file."""
-    # Ensure data directory exists
-    os.makedirs(DATA_DIR, exist_ok=True)
-
-    with open(TOKENS_FILE, 'w') as f:
-        json.dump(tokens, f, indent=2)
+    with _tokens_lock:
+        _write_tokens(tokens)
+        _token_index.rebuild(tokens)
 
 def get_token_by_id(token_id: str) -> Optional[Dict[str, Any]]:
     """Get a refresh token by ID."""
-    tokens = get_tokens()
-    for token in tokens:
-        if token['id'] == token_id:
-            return token
-    return None
+    with _tokens_lock:
+        return _get_token_index().by_id.get(token_id)
+
+def get_tokens_by_user(user_id: str) -> List[Dict[str, Any]]:
+    """Get all refresh tokens (sessions) of a user, oldest first."""
+    with _tokens_lock:
+        return list(_get_token_index().by_user.get(user_id, {}).values())
 
-def add_token(token: Dict[str, Any]) -> Dict[str, Any]:
-    """Add a new refresh token."""
-    tokens = get_tokens()
-    tokens.append(token)
-    save_tokens(tokens)
+def add_token(token: Dict[str, Any], max_sessions: int = MAX_SESSIONS_PER_USER) -> Dict[str, Any]:
+    """Add a new refresh token.
+
+    If the user already holds max_sessions tokens, their oldest tokens are
+    evicted in the same write so the user ends up with at most max_sessions.
+    A max_sessions of 0 or less means no limit.
+    """
+    with _tokens_lock:
+        index = _get_token_index()
+        evicted_ids = []
+        if max_sessions > 0:
+            sessions = index.by_user.get(token['user_id'], {})
+            excess = len(sessions) - max_sessions + 1
+            if excess > 0:
+                evicted_ids = list(sessions)[:excess]
+
+        evicted = set(evicted_ids)
+        tokens = [existing for existing in index.by_id.values() if existing['id'] not in evicted]
+        _write_tokens(tokens + [token])
+        index.remove(evicted_ids)
+        index.add(token)
     return token
 
 def delete_token(token_id: str) -> Optional[Dict[str, Any]]:
     """Delete a refresh token by ID."""
-    tokens = get_tokens()
-    for i, token in enumerate(tokens):
-        if token['id'] == token_id:
-            deleted_token = tokens.pop(i)
-            save_tokens(tokens)
-            return deleted_token
-    return None
+    with _tokens_lock:
+        index = _get_token_index()
+        deleted_token = index.by_id.get(token_id)
+        if deleted_token is None:
+            return None
+        _write_tokens([token for token in index.by_id.values() if token['id'] != token_id])
+        index.remove([token_id])
+        return deleted_token
+
+def delete_tokens_by_user(user_id: str) -> List[Dict[str, Any]]:
+    """Delete every refresh token of a user with a single write.
+
+    Returns:
+        The deleted tokens.
+    """
+    with _tokens_lock:
+        index = _get_token_index()
+        sessions = index.by_user.get(user_id)
+        if not sessions:
+            return []
+
+        deleted_tokens = list(sessions.values())
+        _write_tokens([token for token in index.by_id.values() if token['user_id'] != user_id])
+        index.remove(list(sessions))
+        return deleted_tokens
+
+def sweep_expired_tokens(batch_size: int = TOKEN_SWEEP_BATCH_SIZE, now: Optional[float] = None) -> int:
+    """Delete expired refresh tokens in batches.
+
+    Expired tokens are popped off the expiry heap in order, so only the
+    tokens being removed are visited. Each batch of up to batch_size
+    tokens is removed with a single write to tokens.json.
+
+    Returns:
+        The number of tokens deleted.
+    """
+    if now is None:
+        now = time.time()
+
+    deleted = 0
+    while True:
+        with _tokens_lock:
+            index = _get_token_index()
+            expired_ids = []
+            while index.expiry_heap and index.expiry_heap[0][0] <= now and len(expired_ids) < batch_size:
+                _, token_id = heapq.heappop(index.expiry_heap)
+                if token_id in index.by_id:
+                    expired_ids.append(token_id)
+
+            if not expired_ids:
+                return deleted
+
+            expired = set(expired_ids)
+            try:
+                _write_tokens([token for token in index.by_id.values() if token['id'] not in expired])
+            except OSError:
+                # The popped heap entries are gone, so force a rebuild next time
+                index.signature = None
+                raise
+            index.remove(expired_ids)
+            deleted += len(expired_ids)
+
+def start_token_sweeper(interval: int = TOKEN_SWEEP_INTERVAL) -> Optional[threading.Thread]:
+    """Start the background thread that periodically removes expired tokens.
+
+    Only one sweeper is started per process. Returns None if the sweeper is
+    disabled (interval of 0 or less).
+    """
+    global _token_sweeper
+
+    if interval <= 0:
+        return None
+
+    with _tokens_lock:
+        if _token_sweeper is not None and _token_sweeper.is_alive():
+            return _token_sweeper
+
+        def run():
+            while True:
+                try:
+                    sweep_expired_tokens()
+                except (OSError, ValueError):
+                    # Leave the tokens for the next run if the file is unreadable
+                    pass
+                time.sleep(interval)
+
+        _token_sweeper = threading.Thread(target=run, name='token-sweeper', daemon=True)
+        _token_sweeper.start()
+        return _token_sweeper
+
+# Room storage functions
+class _RoomIndex:
+    """In-memory index over rooms.json.
+
+    Rooms are kept by ID (in file order) with each room's members as a
+    set, so membership checks are O(1).
+    """
+
+    def __init__(self):
+        self.signature = None
+        self.rooms: Dict[str, Dict[str, Any]] = {}
+        self.members: Dict[str, Set[str]] = {}
+
+    def rebuild(self, rooms: List[Dict[str, Any]]) -> None:
+        """Rebuild the index from a full list of rooms."""
+        self.rooms = {room['id']: room for room in rooms}
+        self.members = {room['id']: set(room['members']) for room in rooms}
+        self.signature = _file_signature(ROOMS_FILE)
+
+_room_index = _RoomIndex()
+_rooms_lock = threading.RLock()
+_room_message_caches: Dict[str, _MessageCache] = {}
+_room_message_locks: Dict[str, threading.RLock] = {}
+
+def _get_room_index() -> _RoomIndex:
+    """Get the room index, rebuilding it if rooms.json changed on disk.
+
+    Must be called with _rooms_lock held.
+    """
+    if _room_index.signature is None or _room_index.signature != _file_signature(ROOMS_FILE):
+        _room_index.rebuild(get_rooms())
+    return _room_index
+
+def _copy_room(room: Dict[str, Any]) -> Dict[str, Any]:
+    """Copy a room so callers cannot modify the index."""
+    return dict(room, members=list(room['members']))
+
+def get_rooms() -> List[Dict[str, Any]]:
+    """Get all rooms from the JSON file."""
+    # Ensure data directory exists
+    os.makedirs(DATA_DIR, exist_ok=True)
+
+    try:
+        return _read_json(ROOMS_FILE)
+    except (FileNotFoundError, json.JSONDecodeError):
+        # If file doesn't exist or is invalid, initialize it
+        _write_json(ROOMS_FILE, [], indent=None)
+        return []
+
+def save_rooms(rooms: List[Dict[str, Any]]) -> None:
+    """Save rooms to the JSON file."""
+    # Ensure data directory exists
+    os.makedirs(DATA_DIR, exist_ok=True)
+
+    with _rooms_lock:
+        _write_json(ROOMS_FILE, rooms)
+        _room_index.rebuild(rooms)
+
+def get_room_by_id(room_id: str) -> Optional[Dict[str, Any]]:
+    """Get a room by ID."""
+    with _rooms_lock:
+        room = _get_room_index().rooms.get(room_id)
+        return _copy_room(room) if room else None
+
+def add_room(room: Dict[str, Any]) -> Dict[str, Any]:
+    """Add a new room."""
+    with _rooms_lock:
+        rooms = [_copy_room(existing) for existing in _get_room_index().rooms.values()]
+        save_rooms(rooms + [_copy_room(room)])
+    return room
+
+def is_room_member(room_id: str, user_id: str) -> bool:
+    """Check whether a user is a member of a room."""
+    with _rooms_lock:
+        return user_id in _get_room_index().members.get(room_id, ())
+
+def _update_room_members(room_id: str, user_id: str, join: bool) -> Optional[Dict[str, Any]]:
+    """Add a user to or remove a user from a room's members."""
+    with _rooms_lock:
+        index = _get_room_index()
+        room = index.rooms.get(room_id)
+        if room is None:
+            return None
+
+        members = index.members[room_id]
+        if (user_id in members) != join:
+            rooms = [_copy_room(existing) for existing in index.rooms.values()]
+            updated = next(existing for existing in rooms if existing['id'] == room_id)
+            if join:
+                updated['members'].append(user_id)
+            else:
+                updated['members'].remove(user_id)
+            save_rooms(rooms)
+            room = updated
+
+        return _copy_room(room)
+
+def add_room_member(room_id: str, user_id: str) -> Optional[Dict[str, Any]]:
+    """Add a user to a room's members. Returns the room, or None if it does not exist."""
+    return _update_room_members(room_id, user_id, join=True)
+
+def remove_room_member(room_id: str, user_id: str) -> Optional[Dict[str, Any]]:
+    """Remove a user from a room's members. Returns the room, or None if it does not exist."""
+    return _update_room_members(room_id, user_id, join=False)
+
+def _room_messages_file(room_id: str) -> str:
+    """Get the path of the file holding a room's messages."""
+    return os.path.join(ROOMS_DIR, f"{room_id}.json")
+
+def _room_messages(room_id: str) -> _MessageCache:
+    """Get the cached messages of a room, reloading them if the room's file changed on disk.
+
+    Only the room's own partition file is read.
+    """
+    path = _room_messages_file(room_id)
+    with _rooms_lock:
+        cache = _room_message_caches.setdefault(room_id, _MessageCache())
+        lock = _room_message_locks.setdefault(room_id, threading.RLock())
+
+    with lock:
+        version = _file_signature(path)
+        if version is None or version != cache.version:
+            try:
+                messages = _read_json(path)
+            except (FileNotFoundError, json.JSONDecodeError):
+                messages = []
+            cache.set(version, messages)
+    return cache
+
+def get_room_messages(room_id: str) -> List[Dict[str, Any]]:
+    """Get all messages of a room, oldest first."""
+    return list(_room_messages(room_id).messages)
+
+def add_room_message(room_id: str, message: Dict[str, Any]) -> Dict[str, Any]:
+    """Add a message to a room's partition, assigning it the room's next sequence number."""
+    _room_messages(room_id)
+    with _room_message_locks[room_id]:
+        cache = _room_messages(room_id)
+        messages = list(cache.messages)
+        message['seq'] = (messages[-1]['seq'] if messages else 0) + 1
+        messages.append(message)
+
+        os.makedirs(ROOMS_DIR, exist_ok=True)
+        path = _room_messages_file(room_id)
+        _write_json(path, messages)
+        cache.set(_file_signature(path), messages)
+
+    _fragment_cache.put(message)
+    return message
+
+def remove_room_messages(room_id: str, message_ids: List[str]) -> List[Dict[str, Any]]:
+    """Remove a batch of messages from a room's partition with a single write.
+
+    Returns:
+        The removed messages.
+    """
+    removed_ids = set(message_ids)
+    _room_messages(room_id)
+    with _room_message_locks[room_id]:
+        cache = _room_messages(room_id)
+        kept = [message for message in cache.messages if message['id'] not in removed_ids]
+        if len(kept) == len(cache.messages):
+            return []
+
+        removed = [message for message in cache.messages if message['id'] in removed_ids]
+        path = _room_messages_file(room_id)
+        _write_json(path, kept)
+        cache.set(_file_signature(path), kept)
+
+    for message in removed:
+        _fragment_cache.evict(message['id'])
+    return removed
+
+def count_active_tokens(now: Optional[float] = None) -> int:
+    """Count the refresh tokens that have not expired, including those not swept yet."""
+    if now is None:
+        now = time.time()
+    with _tokens_lock:
+        return sum(1 for token in _get_token_index().by_id.values() if _expiry_timestamp(token) > now)
+
+def get_memory_collections() -> Dict[str, Any]:
+    """Get the caches and indexes the store holds in memory, by name, for memory reports."""
+    return {
+        'messages': _message_cache.messages,
+        'messages_by_id': _message_cache._by_id or {},
+        'message_fragments': _fragment_cache.fragments,
+        'tokens': _token_index.by_id,
+        'token_sessions': _token_index.by_user,
+        'token_expiry_heap': _token_index.expiry_heap,
+        'rooms': _room_index.rooms,
+        'room_members': _room_index.members,
+        'room_messages': {room_id: cache.messages for room_id, cache in list(_room_message_caches.items())},
+        'sync_state': _sync_cache['state'],
+        'read_markers': _read_markers_cache['markers'],
+        'attachments': _attachments_cache['attachments']
+    }
+
+def _collect_metrics() -> List[tuple]:
+    """Get the cache counters of this process for its metrics snapshot."""
+    return [
+        ('chat_cache_hits_total', {'cache': 'message_fragments'}, _fragment_cache.hits),
+        ('chat_cache_misses_total', {'cache': 'message_fragments'}, _fragment_cache.misses)
+    ]
+
+def get_file_sizes() -> Dict[str, int]:
+    """Get the size in bytes of each data file that exists, by name."""
+    sizes = {}
+    for path in (USERS_FILE, MESSAGES_FILE, TOKENS_FILE, SYNC_FILE, ROOMS_FILE, READ_MARKERS_FILE, ATTACHMENTS_FILE):
+        signature = _file_signature(path)
+        if signature is not None:
+            sizes[_file_label(path)] = signature[1]
+    return sizes
+
+def _collect_gauges() -> List[tuple]:
+    """Get the sizes of the data files and the number of active refresh tokens."""
+    gauges = [('chat_data_file_bytes', {'file': name}, size) for name, size in get_file_sizes().items()]
+    gauges.append(('chat_active_refresh_tokens', {}, count_active_tokens()))
+    return gauges
+
+metrics.register_collector(_collect_metrics)
+metrics.register_gauges(_collect_gauges)
+
+# Time each storage call of sampled requests
+instrument_functions(globals(), 'storage')
 
 # Initialize storage on module import
 init_storage()
@@ -0,0 +1,426 @@
+#!/usr/bin/env python
+"""
+Load-testing harness for the 0xC Chat API.
+
+Simulates many users driving the API through ChatAPIClient, each with its
+own keep-alive session, performing a weighted mix of operations. Two
+arrival models are supported:
+
+- closed loop (default): each user performs an operation as soon as its
+  previous one has finished, after an optional think time
+- open loop (--rate): operations start at a fixed rate regardless of how
+  fast the server answers, and their latency includes the time spent
+  waiting for a free user, so a slow server is not hidden by fewer requests
+
+The report holds the throughput and p50/p95/p99 latency of each
+operation and each API endpoint, as JSON.
+
+Usage:
+    python loadtest.py --url http://localhost:5000 --users 20 --duration 30
+    python loadtest.py --in-process --users 5 --requests 500 --mix post=1,list=4
+    python loadtest.py --rate 50 --duration 60 --output report.json
+"""
+
+import argparse
+import json
+import queue
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Any, Optional
+from urllib.parse import urlsplit
+from test_client import ChatAPIClient
+
+# Operations a simulated user can perform, and their default weights
+OPERATIONS = ('register', 'login', 'refresh', 'post', 'list')
+DEFAULT_MIX = {'register': 1, 'login': 1, 'refresh': 1, 'post': 5, 'list': 10}
+
+# Password of every simulated user
+PASSWORD = 'loadtest-password'
+
+# Share of posted messages sent privately to another simulated user
+PRIVATE_RATIO = 0.3
+
+# Number of messages fetched by the list operation
+LIST_LIMIT = 50
+
+# Path segments that are IDs or attachment hashes, reported as <id> so they group by endpoint
+_ID_SEGMENT = re.compile(r'^([0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}|[0-9a-f]{64})$')
+
+
+def endpoint_name(method: str, url: str) -> str:
+    """Get the endpoint of a request, e.g. 'GET /api/messages/<id>'."""
+    path = urlsplit(url).path
+    segments = ['<id>' if _ID_SEGMENT.match(segment) else segment for segment in path.split('/')]
+    return f"{method.upper()} {'/'.join(segments)}"
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    """Get the nearest-rank percentile of a sorted list of values."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(-(-p * len(sorted_values) // 100)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+def parse_mix(value: str) -> Dict[str, float]:
+    """Parse an operation mix such as 'post=5,list=10' into weights by operation.
+
+    Raises:
+        ValueError: If an operation is unknown or a weight is not a non-negative number.
+    """
+    mix = {}
+    for item in value.split(','):
+        name, _, weight = item.partition('=')
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise ValueError(f"Unknown operation '{name}', expected one of: {', '.join(OPERATIONS)}")
+        try:
+            mix[name] = float(weight) if weight else 1.0
+        except ValueError:
+            raise ValueError(f"Weight of operation '{name}' must be a number")
+        if mix[name] < 0:
+            raise ValueError(f"Weight of operation '{name}' must not be negative")
+
+    if not any(mix.values()):
+        raise ValueError('At least one operation must have a positive weight')
+    return mix
+
+
+class LatencyRecorder:
+    """Thread-safe collection of latencies and errors by name."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+
+    def record(self, name: str, seconds: float, ok: bool = True) -> None:
+        """Record the latency of one call, and whether it failed."""
+        with self.lock:
+            self.latencies.setdefault(name, []).append(seconds)
+            if not ok:
+                self.errors[name] = self.errors.get(name, 0) + 1
+
+    def summary(self, elapsed: float) -> Dict[str, Dict[str, Any]]:
+        """Summarize the calls of each name, with latencies in milliseconds.
+
+        Args:
+            elapsed: The duration of the run in seconds, to compute throughput
+        """
+        with self.lock:
+            result = {}
+            for name, latencies in sorted(self.latencies.items()):
+                latencies = sorted(latencies)
+                result[name] = {
+                    'count': len(latencies),
+                    'errors': self.errors.get(name, 0),
+                    'throughput': round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+                    'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3),
+                    'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+                    'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+                    'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+                    'max_ms': round(latencies[-1] * 1000, 3)
+                }
+            return result
+
+
+class TimedSession:
+    """Session wrapper that records the latency of each request by endpoint.
+
+    Nothing is recorded until a recorder is set, so setting up the
+    simulated users does not count towards the results.
+    """
+
+    def __init__(self, session, recorder: Optional[LatencyRecorder] = None):
+        self.session = session
+        self.recorder = recorder
+
+    def request(self, method: str, url: str, **kwargs):
+        """Send a request through the wrapped session, timing it."""
+        start = time.perf_counter()
+        ok = False
+        try:
+            response = self.session.request(method, url, **kwargs)
+            ok = response.status_code < 400
+            return response
+        finally:
+            if self.recorder is not None:
+                self.recorder.record(endpoint_name(method, url), time.perf_counter() - start, ok)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request('PUT', url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request('DELETE', url, **kwargs)
+
+
+class _FlaskResponse:
+    """The parts of a requests response that ChatAPIClient uses, for a Flask test response."""
+
+    def __init__(self, response):
+        self.status_code = response.status_code
+        self.content = response.get_data()
+        self.text = response.get_data(as_text=True)
+
+    def json(self):
+        return json.loads(self.text)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class FlaskTestSession:
+    """Session that sends requests to an in-process Flask app through its test client."""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method: str, url: str, params=None, json=None, data=None, headers=None, **kwargs):
+        """Send a request to the app, ignoring the scheme and host of the URL."""
+        response = self.client.open(urlsplit(url).path, method=method, query_string=params, json=json, data=data,
+                                     headers=headers)
+        return _FlaskResponse(response)
+
+
+class SimulatedUser:
+    """A simulated user with its own client and session."""
+
+    def __init__(self, base_url: str, session, api_key: Optional[str] = None):
+        self.session = TimedSession(session)
+        self.client = ChatAPIClient(base_url=base_url, api_key=api_key, session=self.session, verbose=False)
+        self.username = f"load_{uuid.uuid4().hex[:12]}"
+
+    def setup(self) -> None:
+        """Register and log in the user.
+
+        Raises:
+            RuntimeError: If the user cannot be registered or logged in.
+        """
+        if not self.client.register(self.username, PASSWORD) or not self.client.login(self.username, PASSWORD):
+            raise RuntimeError(f"Could not register and log in simulated user {self.username}")
+
+    @property
+    def user_id(self) -> str:
+        return self.client.user_info['id']
+
+    def perform(self, operation: str, others: List['SimulatedUser'], rng: random.Random) -> bool:
+        """Perform an operation, returning whether it succeeded."""
+        client = self.client
+        if operation == 'register':
+            return client.register(f"load_{uuid.uuid4().hex[:12]}", PASSWORD)
+        if operation == 'login':
+            return client.login(self.username, PASSWORD)
+        if operation == 'refresh':
+            return client.refresh_access_token()
+        if operation == 'post':
+            recipient_id = rng.choice(others).user_id if others and rng.random() < PRIVATE_RATIO else None
+            return client.send_message(f"Load test message {rng.random()}", recipient_id) is not None
+        if operation == 'list':
+            return client.get_messages(limit=LIST_LIMIT) is not None
+        raise ValueError(f"Unknown operation '{operation}'")
+
+
+def create_users(base_url: str = 'http://localhost:5000', app=None, users: int = 10,
+                 api_key: Optional[str] = None) -> List[SimulatedUser]:
+    """Set up simulated users, each registered and logged in with its own session.
+
+    Args:
+        base_url: The base URL of the API, unless app is given
+        app: A Flask app to test in-process through its test client instead
+        users: Number of simulated users
+        api_key: The API key, if SECRET_KEY_ENABLED=1
+    """
+    simulated = []
+    for _ in range(users):
+        session = FlaskTestSession(app) if app is not None else requests.Session()
+        user = SimulatedUser(base_url, session, api_key)
+        user.setup()
+        simulated.append(user)
+    return simulated
+
+def run_load_test(base_url: str = 'http://localhost:5000', app=None, users: int = 10,
+                  mix: Optional[Dict[str, float]] = None, duration: float = 10.0,
+                  total_requests: Optional[int] = None, rate: Optional[float] = None,
+                  think_time: float = 0.0, api_key: Optional[str] = None,
+                  seed: Optional[int] = None,
+                  simulated_users: Optional[List['SimulatedUser']] = None) -> Dict[str, Any]:
+    """Run a load test and report its results.
+
+    Args:
+        base_url: The base URL of the API, unless app is given
+        app: A Flask app to test in-process through its test client instead
+        users: Number of simulated users
+        mix: Weights of the operations to perform (default: DEFAULT_MIX)
+        duration: Maximum duration of the run in seconds
+        total_requests: Optional maximum number of operations to perform
+        rate: Operations per second for an open-loop run; closed loop if None
+        think_time: Seconds each user waits between operations in a closed-loop run
+        api_key: The API key, if SECRET_KEY_ENABLED=1
+        seed: Optional random seed, to repeat the same sequence of operations
+        simulated_users: Users set up by create_users to run as, instead of
+            setting up new ones; users is then ignored
+
+    Returns:
+        The run's configuration, elapsed time, totals, and the summary of
+        each 'operations' and 'endpoints' entry (see LatencyRecorder.summary).
+    """
+    mix = mix or DEFAULT_MIX
+    names = [name for name in mix if mix[name] > 0]
+    weights = [mix[name] for name in names]
+
+    simulated = simulated_users if simulated_users is not None else create_users(base_url, app, users, api_key)
+    users = len(simulated)
+
+    operations = LatencyRecorder()
+    endpoints = LatencyRecorder()
+    for user in simulated:
+        user.session.recorder = endpoints
+
+    budget_lock = threading.Lock()
+    budget = [total_requests]
+
+    def take_budget() -> bool:
+        """Claim one operation of the request budget, if any is left."""
+        with budget_lock:
+            if budget[0] is None:
+                return True
+            if budget[0] <= 0:
+                return False
+            budget[0] -= 1
+            return True
+
+    def perform(user: SimulatedUser, rng: random.Random, started: float) -> None:
+        operation = rng.choices(names, weights)[0]
+        others = [other for other in simulated if other is not user]
+        try:
+            ok = user.perform(operation, others, rng)
+        except Exception:
+            # Connection errors and the like count as failed operations
+            ok = False
+        operations.record(operation, time.perf_counter() - started, ok)
+
+    start = time.perf_counter()
+    deadline = start + duration
+
+    if rate is None:
+        def closed_loop(user: SimulatedUser, rng: random.Random) -> None:
+            while time.perf_counter() < deadline and take_budget():
+                perform(user, rng, time.perf_counter())
+                if think_time:
+                    time.sleep(think_time)
+
+        threads = [
+            threading.Thread(target=closed_loop, args=(user, random.Random(None if seed is None else seed + i)))
+            for i, user in enumerate(simulated)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    else:
+        idle = queue.Queue()
+        for i, user in enumerate(simulated):
+            idle.put((user, random.Random(None if seed is None else seed + i)))
+
+        def open_loop(scheduled: float) -> None:
+            user, rng = idle.get()
+            try:
+                perform(user, rng, scheduled)
+            finally:
+                idle.put((user, rng))
+
+        with ThreadPoolExecutor(max_workers=users) as executor:
+            sent = 0
+            while take_budget():
+                scheduled = start + sent / rate
+                if scheduled >= deadline:
+                    break
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                executor.submit(open_loop, scheduled)
+                sent += 1
+
+    elapsed = time.perf_counter() - start
+    operation_summary = operations.summary(elapsed)
+    count = sum(summary['count'] for summary in operation_summary.values())
+    errors = sum(summary['errors'] for summary in operation_summary.values())
+
+    return {
+        'config': {
+            'target': 'in-process' if app is not None else base_url,
+            'users': users,
+            'mix': mix,
+            'arrival': 'open' if rate is not None else 'closed',
+            'rate': rate,
+            'duration': duration,
+            'total_requests': total_requests,
+            'think_time': think_time
+        },
+        'elapsed': round(elapsed, 3),
+        'total': {
+            'count': count,
+            'errors': errors,
+            'throughput': round(count / elapsed, 2) if elapsed else 0.0
+        },
+        'operations': operation_summary,
+        'endpoints': endpoints.summary(elapsed)
+    }
+
+
+def parse_arguments():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description="Load-testing harness for the 0xC Chat API")
+    parser.add_argument("--url", default="http://localhost:5000", help="Base URL of the API")
+    parser.add_argument("--api-key", help="API key for authentication (if SECRET_KEY_ENABLED=1)")
+    parser.add_argument("--in-process", action="store_true",
+                        help="Test an in-process app through the Flask test client instead of --url")
+    parser.add_argument("--users", type=int, default=10, help="Number of simulated users")
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX,
+                        help="Weights of the operations, e.g. register=1,login=1,refresh=1,post=5,list=10")
+    parser.add_argument("--duration", type=float, default=10.0, help="Maximum duration of the run in seconds")
+    parser.add_argument("--requests", type=int, dest="total_requests",
+                        help="Maximum number of operations to perform")
+    parser.add_argument("--rate", type=float,
+                        help="Start operations at this many per second (open loop) instead of back to back")
+    parser.add_argument("--think-time", type=float, default=0.0,
+                        help="Seconds each user waits between operations in a closed-loop run")
+    parser.add_argument("--seed", type=int, help="Random seed, to repeat the same sequence of operations")
+    parser.add_argument("--output", help="Write the JSON report to this file instead of standard output")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_arguments()
+    if args.users < 1 or (args.rate is not None and args.rate <= 0):
+        print("Error: --users and --rate must be positive")
+        sys.exit(1)
+
+    app = None
+    if args.in_process:
+        from app import create_app
+        app = create_app()
+
+    report = run_load_test(base_url=args.url, app=app, users=args.users, mix=args.mix, duration=args.duration,
+                           total_requests=args.total_requests, rate=args.rate, think_time=args.think_time,
+                           api_key=args.api_key, seed=args.seed)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
@@ -0,0 +1,346 @@
+"""
+Memory footprint reporting for the 0xC Chat API.
+
+A memory report estimates the bytes held by each cache and index of the
+store, and counts the live model objects of the process. tracemalloc
+snapshots record where the memory of a process was allocated, and two
+snapshots of the same process can be compared to find what grew.
+
+Usage:
+    python memory.py report
+    python memory.py snapshots
+    python memory.py show <snapshot_id> [--compare <snapshot_id>] [--group-by lineno|filename|traceback]
+
+The report command loads the store and its indexes into a fresh process
+and reports their footprint, to size the workers serving a data set.
+Snapshots of a running server are taken through the admin endpoint POST
+/api/admin/memory/snapshots and written to MEMORY_SNAPSHOT_DIR; DELETE
+/api/admin/memory/snapshots stops tracing and discards them.
+"""
+
+import argparse
+import gc
+import json
+import os
+import re
+import sys
+import time
+import tracemalloc
+import uuid
+from collections import deque
+from datetime import datetime, timezone
+from types import FunctionType, ModuleType
+from typing import Any, Dict, List, Optional, Set, Tuple
+import json_storage
+import message_index
+from models import RefreshToken, User, Message, Attachment, Room
+from env import MEMORY_SNAPSHOT_DIR, MEMORY_SNAPSHOT_MAX_FILES, TRACEMALLOC_FRAMES
+
+# The model classes whose live objects are counted
+MODEL_CLASSES = (RefreshToken, User, Message, Attachment, Room)
+
+# Pattern of snapshot IDs: the time in milliseconds, then a random suffix
+SNAPSHOT_ID_PATTERN = re.compile(r'^\d{13}-[0-9a-f]{8}$')
+
+# Ways allocations can be grouped in snapshot statistics
+GROUP_BY = ('lineno', 'filename', 'traceback')
+
+# Objects that are shared by the whole process rather than held by a collection
+_NOT_TRAVERSED = (type, ModuleType, FunctionType)
+
+
+def deep_size(obj: Any, seen: Optional[Set[int]] = None) -> Tuple[int, int]:
+    """Estimate the bytes of an object and every object it holds through containers and attributes.
+
+    Objects whose ID is in seen are skipped, and the IDs of the objects
+    visited are added to it, so an object shared by several collections
+    is counted once.
+
+    Returns:
+        The estimated bytes and the number of objects visited.
+    """
+    if seen is None:
+        seen = set()
+
+    size = 0
+    count = 0
+    stack = [obj]
+    while stack:
+        current = stack.pop()
+        if id(current) in seen or isinstance(current, _NOT_TRAVERSED):
+            continue
+        seen.add(id(current))
+        size += sys.getsizeof(current)
+        count += 1
+
+        if isinstance(current, dict):
+            stack.extend(current.keys())
+            stack.extend(current.values())
+        elif isinstance(current, (list, tuple, set, frozenset, deque)):
+            stack.extend(current)
+        else:
+            if hasattr(current, '__dict__'):
+                stack.append(vars(current))
+            for cls in type(current).__mro__:
+                for slot in getattr(cls, '__slots__', ()):
+                    if hasattr(current, slot):
+                        stack.append(getattr(current, slot))
+    return size, count
+
+def _items(collection: Any) -> Optional[int]:
+    """Get the number of items of a store collection, or None if it has no length."""
+    try:
+        return len(collection)
+    except TypeError:
+        return None
+
+def get_collections() -> Dict[str, Any]:
+    """Get the caches and indexes held in memory by the process, by name."""
+    collections = {f'store.{name}': value for name, value in json_storage.get_memory_collections().items()}
+    for index in message_index.MessageIndex.instances:
+        contents = {name: value for name, value in vars(index).items() if name != 'lock'}
+        collections[f'index.{type(index).__module__}'] = contents
+    return collections
+
+def _rss_bytes() -> Optional[int]:
+    """Get the resident set size of the process, or None if the platform does not report it."""
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+def memory_report() -> Dict[str, Any]:
+    """Report the memory held by the process.
+
+    Each collection's 'bytes' are estimated from the objects it holds
+    that no collection before it holds, so indexes sharing the cached
+    messages only count what they add. Traversing millions of objects
+    takes seconds, so reports are only made on demand.
+
+    Returns:
+        The 'collections' with their item (for store caches) and object
+        counts and estimated bytes, the live 'models' with their counts
+        and estimated bytes, and the 'process' RSS and number of
+        objects tracked by the garbage collector.
+    """
+    seen: Set[int] = set()
+    collections = {}
+    for name, collection in get_collections().items():
+        size, objects = deep_size(collection, seen)
+        items = _items(collection) if name.startswith('store.') else None
+        collections[name] = {'items': items, 'objects': objects, 'bytes': size}
+
+    tracked = gc.get_objects()
+    instances = {cls.__name__: [] for cls in MODEL_CLASSES}
+    for obj in tracked:
+        if type(obj) in MODEL_CLASSES:
+            instances[type(obj).__name__].append(obj)
+
+    models = {}
+    for name, objects in instances.items():
+        size, _ = deep_size(objects, seen)
+        models[name] = {'count': len(objects), 'bytes': size - sys.getsizeof(objects)}
+
+    return {
+        'pid': os.getpid(),
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'collections': collections,
+        'models': models,
+        'process': {
+            'rss_bytes': _rss_bytes(),
+            'gc_objects': len(tracked),
+            'tracemalloc': tracemalloc.is_tracing()
+        }
+    }
+
+def _snapshot_path(snapshot_id: str, extension: str, snapshot_dir: str = MEMORY_SNAPSHOT_DIR) -> str:
+    """Get the path of a snapshot's file with the given extension."""
+    return os.path.join(snapshot_dir, snapshot_id + extension)
+
+def take_snapshot(snapshot_dir: str = MEMORY_SNAPSHOT_DIR, frames: int = TRACEMALLOC_FRAMES,
+                  max_files: int = MEMORY_SNAPSHOT_MAX_FILES) -> Dict[str, Any]:
+    """Take a tracemalloc snapshot of the process, then delete the oldest snapshots over max_files.
+
+    Tracing is started by the first snapshot unless it is already on, so
+    that snapshot only covers the allocations made from then on.
+
+    Returns:
+        The metadata of the snapshot.
+    """
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start(frames)
+
+    snapshot = tracemalloc.take_snapshot()
+    traced, peak = tracemalloc.get_traced_memory()
+    snapshot_id = f'{int(time.time() * 1000):013d}-{uuid.uuid4().hex[:8]}'
+    metadata = {
+        'id': snapshot_id,
+        'pid': os.getpid(),
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'traced_bytes': traced,
+        'peak_bytes': peak,
+        'frames': tracemalloc.get_traceback_limit(),
+        'started_tracing': started
+    }
+
+    os.makedirs(snapshot_dir, exist_ok=True)
+    snapshot.dump(_snapshot_path(snapshot_id, '.snapshot', snapshot_dir))
+    # Written last, as a snapshot is listed once its metadata exists
+    with open(_snapshot_path(snapshot_id, '.json', snapshot_dir), 'w') as f:
+        json.dump(metadata, f, indent=2)
+
+    for old in list_snapshots(snapshot_dir)[max(max_files, 0):]:
+        delete_snapshot(old['id'], snapshot_dir)
+    return metadata
+
+def list_snapshots(snapshot_dir: str = MEMORY_SNAPSHOT_DIR) -> List[Dict[str, Any]]:
+    """Get the metadata of every snapshot, newest first."""
+    try:
+        names = os.listdir(snapshot_dir)
+    except FileNotFoundError:
+        return []
+
+    snapshots = []
+    for name in sorted(names, reverse=True):
+        snapshot_id, extension = os.path.splitext(name)
+        if extension == '.json':
+            snapshot = get_snapshot(snapshot_id, snapshot_dir)
+            if snapshot is not None:
+                snapshots.append(snapshot)
+    return snapshots
+
+def get_snapshot(snapshot_id: str, snapshot_dir: str = MEMORY_SNAPSHOT_DIR) -> Optional[Dict[str, Any]]:
+    """Get the metadata of a snapshot, or None if it does not exist."""
+    if not SNAPSHOT_ID_PATTERN.match(snapshot_id):
+        return None
+    try:
+        with open(_snapshot_path(snapshot_id, '.json', snapshot_dir), 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+def delete_snapshot(snapshot_id: str, snapshot_dir: str = MEMORY_SNAPSHOT_DIR) -> None:
+    """Delete a snapshot and its metadata."""
+    for extension in ('.json', '.snapshot'):
+        try:
+            os.remove(_snapshot_path(snapshot_id, extension, snapshot_dir))
+        except FileNotFoundError:
+            pass
+
+def stop_tracing(snapshot_dir: str = MEMORY_SNAPSHOT_DIR) -> Dict[str, Any]:
+    """Stop tracing the process's allocations and delete its snapshots.
+
+    Snapshots of other processes are kept, as those may still be tracing.
+
+    Returns:
+        Whether tracing was 'stopped', and the number of snapshots 'deleted'.
+    """
+    stopped = tracemalloc.is_tracing()
+    tracemalloc.stop()
+
+    deleted = 0
+    for snapshot in list_snapshots(snapshot_dir):
+        if snapshot['pid'] == os.getpid():
+            delete_snapshot(snapshot['id'], snapshot_dir)
+            deleted += 1
+    return {'stopped': stopped, 'deleted': deleted}
+
+def _load_snapshot(snapshot_id: str, snapshot_dir: str) -> tracemalloc.Snapshot:
+    """Load a snapshot without the allocations made by tracemalloc and the import system."""
+    snapshot = tracemalloc.Snapshot.load(_snapshot_path(snapshot_id, '.snapshot', snapshot_dir))
+    return snapshot.filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+        tracemalloc.Filter(False, '<unknown>')
+    ))
+
+def snapshot_statistics(snapshot_id: str, compare_to: Optional[str] = None, group_by: str = 'lineno',
+                        limit: int = 20, snapshot_dir: str = MEMORY_SNAPSHOT_DIR) -> Optional[Dict[str, Any]]:
+    """Get the largest allocation sites of a snapshot, or those that grew most since another snapshot.
+
+    Args:
+        snapshot_id: The snapshot to report
+        compare_to: Optional ID of an earlier snapshot of the same process
+        group_by: Group allocations by 'lineno', 'filename' or 'traceback'
+        limit: Number of allocation sites returned
+
+    Returns:
+        The 'snapshot' and 'compared_to' metadata, the 'total_bytes'
+        allocated, and the 'statistics' of each site, largest first; or
+        None if a snapshot does not exist.
+
+    Raises:
+        ValueError: If group_by is not one of GROUP_BY.
+    """
+    if group_by not in GROUP_BY:
+        raise ValueError(f"group_by must be one of {', '.join(GROUP_BY)}")
+
+    metadata = get_snapshot(snapshot_id, snapshot_dir)
+    previous = get_snapshot(compare_to, snapshot_dir) if compare_to is not None else None
+    if metadata is None or (compare_to is not None and previous is None):
+        return None
+
+    snapshot = _load_snapshot(snapshot_id, snapshot_dir)
+    if previous is not None:
+        stats = snapshot.compare_to(_load_snapshot(compare_to, snapshot_dir), group_by)
+    else:
+        stats = snapshot.statistics(group_by)
+
+    statistics = []
+    for stat in stats[:limit]:
+        entry = {
+            'traceback': [f'{frame.filename}:{frame.lineno}' for frame in stat.traceback],
+            'bytes': stat.size,
+            'count': stat.count
+        }
+        if previous is not None:
+            entry['bytes_diff'] = stat.size_diff
+            entry['count_diff'] = stat.count_diff
+        statistics.append(entry)
+
+    return {
+        'snapshot': metadata,
+        'compared_to': previous,
+        'total_bytes': sum(trace.size for trace in snapshot.traces),
+        'statistics': statistics
+    }
+
+def parse_arguments():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description="Memory footprint reporting for the 0xC Chat API")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("report", help="Load the store and its indexes and report their memory footprint")
+    commands.add_parser("snapshots", help="List the tracemalloc snapshots, newest first")
+    show = commands.add_parser("show", help="Show the largest allocation sites of a snapshot")
+    show.add_argument("snapshot_id", help="ID of the snapshot")
+    show.add_argument("--compare", help="ID of an earlier snapshot to compare it to")
+    show.add_argument("--group-by", choices=GROUP_BY, default="lineno", help="How to group allocations")
+    show.add_argument("--limit", type=int, default=20, help="Number of allocation sites shown")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_arguments()
+
+    if args.command == "report":
+        json_storage.get_message_by_id('')
+        json_storage.count_active_tokens()
+        for room in json_storage.get_rooms():
+            json_storage.get_room_messages(room['id'])
+        json_storage.get_sync_state()
+        json_storage.get_read_markers()
+        json_storage.get_attachment('')
+        for index in message_index.MessageIndex.instances:
+            index.refresh()
+        result = memory_report()
+    elif args.command == "snapshots":
+        result = list_snapshots()
+    else:
+        result = snapshot_statistics(args.snapshot_id, args.compare, args.group_by, args.limit)
+        if result is None:
+            sys.exit(f"Snapshot {args.snapshot_id if get_snapshot(args.snapshot_id) is None else args.compare} not found")
+
+    print(json.dumps(result, indent=2))
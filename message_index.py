@@ -0,0 +1,236 @@
+"""
+Base class for in-memory indexes derived from the message store.
+
+An index is updated incrementally as messages are added and deleted, and
+is kept current with changes made by other processes through the store's
+change sequence numbers: before each use, the inserts and delete
+tombstones recorded since the index was last updated are applied. If the
+tombstones needed to catch up are no longer retained, the index is
+rebuilt from the whole store.
+
+Indexes can be persisted next to the JSON data files as a snapshot plus
+an append-only log of the changes made since the snapshot was taken.
+"""
+
+import json
+import os
+import threading
+from typing import Dict, List, Any, Optional
+import json_storage
+from env import DATA_DIR, INDEX_LOG_COMPACT_THRESHOLD
+
+
+class MessageIndex:
+    """In-memory index over the message store, kept current through change sequence numbers.
+
+    Subclasses implement _reset, _insert and _delete. To persist the
+    index, they set snapshot_file and log_file and implement _dump and
+    _restore; _record and _replay control what is logged for an insert.
+    Every method that reads the index should hold self.lock and call
+    _catch_up first.
+    """
+
+    snapshot_file: Optional[str] = None
+    log_file: Optional[str] = None
+
+    # Every index created, so they can all be rebuilt with one read of the store
+    instances: List['MessageIndex'] = []
+
+    def __init__(self):
+        self.ready = False
+        self.last_seq = 0
+        self.log_entries = 0
+        self.lock = threading.RLock()
+        MessageIndex.instances.append(self)
+
+    def _reset(self) -> None:
+        """Empty the index."""
+        raise NotImplementedError
+
+    def _insert(self, message: Dict[str, Any]) -> bool:
+        """Add a stored message to the index. Returns False if it was already indexed."""
+        raise NotImplementedError
+
+    def _delete(self, message_id: str) -> bool:
+        """Remove a message from the index. Returns False if it was not indexed."""
+        raise NotImplementedError
+
+    def _dump(self) -> Any:
+        """Get the contents of the index as JSON-serializable data for a snapshot."""
+        raise NotImplementedError
+
+    def _restore(self, data: Any) -> None:
+        """Restore the contents of the index from a snapshot."""
+        raise NotImplementedError
+
+    def _record(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        """Get what is logged for an inserted message."""
+        return {
+            'id': message['id'],
+            'user_id': message['user_id'],
+            'recipient_id': message.get('recipient_id'),
+            'seq': message.get('seq', 0)
+        }
+
+    def _replay(self, record: Dict[str, Any]) -> None:
+        """Apply a logged insert."""
+        self._insert(record)
+
+    def _load(self) -> bool:
+        """Load the snapshot and replay the log written since it was taken.
+
+        Returns:
+            False if the index is not persisted or could not be loaded.
+        """
+        if self.snapshot_file is None:
+            return False
+
+        self._reset()
+        try:
+            with open(self.snapshot_file, 'r') as f:
+                snapshot = json.load(f)
+            self._restore(snapshot['data'])
+            self.last_seq = snapshot['last_seq']
+
+            self.log_entries = 0
+            if os.path.exists(self.log_file):
+                with open(self.log_file, 'r') as f:
+                    for line in f:
+                        try:
+                            entry = json.loads(line)
+                        except json.JSONDecodeError:
+                            # Skip a partially written last line
+                            continue
+                        if entry['op'] == 'insert':
+                            self._replay(entry['record'])
+                        elif entry['op'] == 'delete':
+                            self._delete(entry['id'])
+                        elif entry['op'] == 'seq':
+                            self.last_seq = entry['last_seq']
+                        self.log_entries += 1
+        except (OSError, ValueError, KeyError, TypeError, IndexError):
+            self._reset()
+            self.last_seq = 0
+            return False
+
+        return True
+
+    def _persist(self, inserted: List[Dict[str, Any]], deleted: List[str], rebuilt: bool = False) -> None:
+        """Log the messages just inserted and the IDs just deleted, or snapshot the index if rebuilt."""
+        if self.snapshot_file is None:
+            return
+
+        if rebuilt:
+            self._compact()
+            return
+
+        entries = [{'op': 'insert', 'record': self._record(message)} for message in inserted]
+        entries += [{'op': 'delete', 'id': message_id} for message_id in deleted]
+        entries.append({'op': 'seq', 'last_seq': self.last_seq})
+
+        os.makedirs(DATA_DIR, exist_ok=True)
+        with open(self.log_file, 'a') as f:
+            f.write(''.join(json.dumps(entry) + '\n' for entry in entries))
+        self.log_entries += len(entries)
+
+        if self.log_entries >= INDEX_LOG_COMPACT_THRESHOLD:
+            self._compact()
+
+    def _compact(self) -> None:
+        """Write a snapshot of the whole index and truncate the log."""
+        os.makedirs(DATA_DIR, exist_ok=True)
+        temp_file = f'{self.snapshot_file}.tmp'
+        with open(temp_file, 'w') as f:
+            # dumps rather than dump, which streams through the much slower pure Python encoder
+            f.write(json.dumps({'last_seq': self.last_seq, 'data': self._dump()}))
+        os.replace(temp_file, self.snapshot_file)
+
+        with open(self.log_file, 'w'):
+            pass
+        self.log_entries = 0
+
+    def _catch_up(self) -> None:
+        """Apply the changes made to the message store since the index was last updated."""
+        if not self.ready:
+            self.ready = True
+            if not self._load():
+                self._rebuild()
+                return
+
+        current_seq = json_storage.get_current_seq()
+        if current_seq == self.last_seq:
+            return
+
+        changes = json_storage.get_changes_since(self.last_seq)
+        if current_seq < self.last_seq or self.last_seq < changes['pruned_seq']:
+            self._rebuild()
+            return
+
+        inserted = [message for message in changes['messages'] if self._insert(message)]
+        deleted = [tombstone['id'] for tombstone in changes['tombstones'] if self._delete(tombstone['id'])]
+        self.last_seq = changes['last_seq']
+        self._persist(inserted, deleted)
+
+    def _rebuild(self) -> None:
+        """Rebuild the whole index from the message store."""
+        # Read the sequence number first: messages stored in between are
+        # picked up again (and skipped) by the next catch-up
+        last_seq = json_storage.get_current_seq()
+        self._rebuild_from(last_seq, json_storage.get_messages())
+
+    def _rebuild_from(self, last_seq: int, messages: List[Dict[str, Any]]) -> None:
+        """Rebuild the whole index from the messages stored up to a sequence number."""
+        self._reset()
+        self.last_seq = last_seq
+        for message in messages:
+            self._insert(message)
+        self.ready = True
+        self._persist([], [], rebuilt=True)
+
+    def add(self, message: Dict[str, Any]) -> None:
+        """Add a newly stored message to the index."""
+        self.add_many([message])
+
+    def add_many(self, messages: List[Dict[str, Any]]) -> None:
+        """Add a batch of newly stored messages to the index with a single log write."""
+        with self.lock:
+            self._catch_up()
+            inserted = [message for message in messages if self._insert(message)]
+            if inserted:
+                self._persist(inserted, [])
+
+    def remove(self, message_id: str) -> None:
+        """Remove a deleted message from the index."""
+        with self.lock:
+            self._catch_up()
+            if self._delete(message_id):
+                self._persist([], [message_id])
+
+    def rebuild(self) -> None:
+        """Rebuild the whole index from the message store."""
+        with self.lock:
+            self._rebuild()
+
+    def refresh(self) -> None:
+        """Load the index, or apply the changes made to the message store since it was last updated."""
+        with self.lock:
+            self._catch_up()
+
+def rebuild_all() -> int:
+    """Rebuild every index from a single read of the message store.
+
+    Returns:
+        The number of messages indexed.
+    """
+    indexes = list(MessageIndex.instances)
+    for index in indexes:
+        index.lock.acquire()
+    try:
+        last_seq = json_storage.get_current_seq()
+        messages = json_storage.get_messages()
+        for index in indexes:
+            index._rebuild_from(last_seq, messages)
+        return len(messages)
+    finally:
+        for index in reversed(indexes):
+            index.lock.release()
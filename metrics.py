@@ -0,0 +1,343 @@
+"""
+Prometheus metrics for the 0xC Chat API.
+
+Once init_app has been called, each process counts its requests, storage
+reads and writes and cache lookups in per-thread tables, so recording a
+sample never takes a lock.
+A background thread periodically writes the totals of the process to its
+own snapshot file in METRICS_DIR, replacing the file atomically. GET
+/metrics adds up the snapshot files of every worker process and renders
+them in the Prometheus text format, along with gauges read at scrape time
+such as the sizes of the data files and the number of active refresh
+tokens.
+
+Snapshot files of processes that no longer exist are deleted when the
+snapshots are added up, so the totals drop the counts of exited workers;
+Prometheus treats the drop as a counter reset. The endpoint is off by
+default and requires the API key when SECRET_KEY_ENABLED is set.
+"""
+
+import bisect
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from flask import Response, g, request
+import singleflight
+from api_key import api_key_required
+from env import METRICS_DIR, METRICS_FLUSH_INTERVAL
+
+# Upper bounds in seconds of the request latency histogram buckets
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Type and help text of each metric
+METRICS = {
+    'chat_requests_total': ('counter', 'Requests handled, by route, method and status'),
+    'chat_request_duration_seconds': ('histogram', 'Request latency in seconds, by route and method'),
+    'chat_storage_reads_total': ('counter', 'Data file reads, by file'),
+    'chat_storage_read_bytes_total': ('counter', 'Bytes read from data files, by file'),
+    'chat_storage_writes_total': ('counter', 'Data file writes, by file'),
+    'chat_storage_written_bytes_total': ('counter', 'Bytes written to data files, by file'),
+    'chat_cache_hits_total': ('counter', 'Cache lookups answered from the cache, by cache'),
+    'chat_cache_misses_total': ('counter', 'Cache lookups that had to load or compute the value, by cache'),
+    'chat_cache_hit_ratio': ('gauge', 'Share of cache lookups answered from the cache, by cache'),
+    'chat_singleflight_calls_total': ('counter', 'Coalescable reads, by group'),
+    'chat_singleflight_coalesced_total': ('counter', 'Reads that shared the result of an identical in-flight read, by group'),
+    'chat_data_file_bytes': ('gauge', 'Size of each data file in bytes'),
+    'chat_active_refresh_tokens': ('gauge', 'Refresh tokens that have not expired'),
+    'chat_metrics_processes': ('gauge', 'Processes with a metrics snapshot'),
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+Sample = Tuple[str, Dict[str, Any], float]
+
+
+class _Table:
+    """The counters and histograms recorded by one thread."""
+
+    __slots__ = ('counters', 'histograms')
+
+    def __init__(self):
+        self.counters: Dict[Tuple[str, Labels], float] = {}
+        # Each histogram is a count per bucket, then the +Inf bucket, then the sum
+        self.histograms: Dict[Tuple[str, Labels], List[float]] = {}
+
+    def merge(self, other: "_Table") -> None:
+        """Add the samples of another table to this one."""
+        for key, value in list(other.counters.items()):
+            self.counters[key] = self.counters.get(key, 0) + value
+        for key, buckets in list(other.histograms.items()):
+            mine = self.histograms.setdefault(key, [0] * len(buckets))
+            for i, value in enumerate(buckets):
+                mine[i] += value
+
+
+_local = threading.local()
+# The table of each live thread; taken once per thread, when it records its first sample
+_tables: List[Tuple[threading.Thread, _Table]] = []
+_tables_lock = threading.Lock()
+# Samples of threads that have exited
+_retired = _Table()
+_collectors: List[Callable[[], Iterable[Sample]]] = []
+_gauge_collectors: List[Callable[[], Iterable[Sample]]] = []
+_flusher = None
+# Whether samples are recorded; set by init_app, so a process without metrics keeps no tables
+_enabled = False
+
+def _retire_exited() -> List[Tuple[threading.Thread, _Table]]:
+    """Fold the tables of exited threads into the retired table, and get those of live threads.
+
+    Must be called with _tables_lock held.
+    """
+    live = []
+    for thread, table in _tables:
+        if thread.is_alive():
+            live.append((thread, table))
+        else:
+            _retired.merge(table)
+    _tables[:] = live
+    return list(live)
+
+def _table() -> _Table:
+    """Get the table of the current thread."""
+    table = getattr(_local, 'table', None)
+    if table is None:
+        table = _Table()
+        with _tables_lock:
+            # Threads that come and go between snapshots must not pile up
+            _retire_exited()
+            _tables.append((threading.current_thread(), table))
+        _local.table = table
+    return table
+
+def inc(name: str, value: float = 1, **labels) -> None:
+    """Add value to a counter of the current process."""
+    if not _enabled:
+        return
+    counters = _table().counters
+    key = (name, tuple(labels.items()))
+    counters[key] = counters.get(key, 0) + value
+
+def observe(name: str, seconds: float, **labels) -> None:
+    """Record a latency in a histogram of the current process."""
+    if not _enabled:
+        return
+    histograms = _table().histograms
+    key = (name, tuple(labels.items()))
+    buckets = histograms.get(key)
+    if buckets is None:
+        buckets = histograms[key] = [0] * (len(LATENCY_BUCKETS) + 2)
+    buckets[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+    buckets[-1] += seconds
+
+def register_collector(collector: Callable[[], Iterable[Sample]]) -> None:
+    """Register a function returning (name, labels, value) counters kept elsewhere by the process.
+
+    The counters are added to each snapshot of the process, and summed
+    across processes like the recorded ones.
+    """
+    _collectors.append(collector)
+
+def register_gauges(collector: Callable[[], Iterable[Sample]]) -> None:
+    """Register a function returning (name, labels, value) gauges, read by the scraping process only."""
+    _gauge_collectors.append(collector)
+
+def snapshot() -> Dict[str, Any]:
+    """Get the totals of the current process.
+
+    The tables of exited threads are folded into a single retired table,
+    so threads that come and go do not pile up.
+    """
+    total = _Table()
+    with _tables_lock:
+        live = _retire_exited()
+        # Under the lock, as a thread taking its table may retire others into it
+        total.merge(_retired)
+    for _, table in live:
+        total.merge(table)
+    for collector in _collectors:
+        for name, labels, value in collector():
+            key = (name, tuple(labels.items()))
+            total.counters[key] = total.counters.get(key, 0) + value
+
+    return {
+        'pid': os.getpid(),
+        'time': time.time(),
+        'counters': [[name, list(labels), value] for (name, labels), value in total.counters.items()],
+        'histograms': [[name, list(labels), buckets] for (name, labels), buckets in total.histograms.items()]
+    }
+
+def flush(metrics_dir: str = METRICS_DIR) -> None:
+    """Write the totals of the current process to its snapshot file."""
+    os.makedirs(metrics_dir, exist_ok=True)
+    path = os.path.join(metrics_dir, f'{os.getpid()}.json')
+    # Per thread, as the flusher and a scrape may write the snapshot at once
+    temp_file = f'{path}.{threading.get_ident()}.tmp'
+    with open(temp_file, 'w') as f:
+        f.write(json.dumps(snapshot()))
+    os.replace(temp_file, path)
+
+def start_flusher(interval: int = METRICS_FLUSH_INTERVAL) -> Optional[threading.Thread]:
+    """Start the background thread that periodically writes the snapshot of the process.
+
+    Only one flusher is started per process. Returns None if the flusher
+    is disabled (interval of 0 or less).
+    """
+    global _flusher
+
+    if interval <= 0:
+        return None
+
+    with _tables_lock:
+        if _flusher is not None and _flusher.is_alive():
+            return _flusher
+
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    flush()
+                except OSError:
+                    # Try again on the next run if the directory is not writable
+                    pass
+
+        _flusher = threading.Thread(target=run, name='metrics-flusher', daemon=True)
+        _flusher.start()
+        return _flusher
+
+def _process_exists(pid: Any) -> bool:
+    """Check whether a process with the given ID is running, assuming it is where that cannot be checked."""
+    if not isinstance(pid, int) or pid <= 0 or os.name != 'posix':
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Running, but owned by another user
+        return True
+    return True
+
+def aggregate(metrics_dir: str = METRICS_DIR) -> Dict[str, Any]:
+    """Add up the snapshot files of every running process, deleting those of exited processes.
+
+    Returns:
+        The summed 'counters' and 'histograms', keyed by (name, labels),
+        and the number of 'processes'.
+    """
+    total = _Table()
+    processes = 0
+    try:
+        names = os.listdir(metrics_dir)
+    except FileNotFoundError:
+        names = []
+
+    for filename in names:
+        if not filename.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(metrics_dir, filename), 'r') as f:
+                data = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            continue
+
+        if not _process_exists(data.get('pid')):
+            try:
+                os.remove(os.path.join(metrics_dir, filename))
+            except FileNotFoundError:
+                pass
+            continue
+
+        processes += 1
+        part = _Table()
+        part.counters = {(name, tuple(map(tuple, labels))): value for name, labels, value in data['counters']}
+        part.histograms = {(name, tuple(map(tuple, labels))): buckets for name, labels, buckets in data['histograms']}
+        total.merge(part)
+
+    return {'counters': total.counters, 'histograms': total.histograms, 'processes': processes}
+
+def _format_labels(labels: Iterable[Tuple[str, Any]]) -> str:
+    """Format labels as {name="value",...}, escaped as the text format requires."""
+    parts = []
+    for name, value in labels:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{name}="{value}"')
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+def render(totals: Dict[str, Any], gauges: Iterable[Sample] = ()) -> str:
+    """Render aggregated totals and gauges in the Prometheus text format."""
+    samples: Dict[str, List[str]] = {name: [] for name in METRICS}
+
+    for (name, labels), value in sorted(totals['counters'].items()):
+        samples.setdefault(name, []).append(f'{name}{_format_labels(labels)} {value}')
+
+    for (name, labels), buckets in sorted(totals['histograms'].items()):
+        lines = samples.setdefault(name, [])
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), buckets):
+            cumulative += count
+            lines.append(f'{name}_bucket{_format_labels(labels + (("le", bound),))} {cumulative}')
+        lines.append(f'{name}_sum{_format_labels(labels)} {buckets[-1]}')
+        lines.append(f'{name}_count{_format_labels(labels)} {cumulative}')
+
+    hits = {labels: value for (name, labels), value in totals['counters'].items() if name == 'chat_cache_hits_total'}
+    misses = {labels: value for (name, labels), value in totals['counters'].items() if name == 'chat_cache_misses_total'}
+    for labels in sorted(set(hits) | set(misses)):
+        lookups = hits.get(labels, 0) + misses.get(labels, 0)
+        if lookups:
+            samples['chat_cache_hit_ratio'].append(
+                f'chat_cache_hit_ratio{_format_labels(labels)} {hits.get(labels, 0) / lookups}')
+
+    samples['chat_metrics_processes'].append(f"chat_metrics_processes {totals['processes']}")
+    for name, labels, value in gauges:
+        samples.setdefault(name, []).append(f'{name}{_format_labels(labels.items())} {value}')
+
+    lines = []
+    for name, metric_samples in samples.items():
+        if not metric_samples:
+            continue
+        metric_type, help_text = METRICS.get(name, ('untyped', name))
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {metric_type}')
+        lines.extend(metric_samples)
+    return '\n'.join(lines) + '\n'
+
+def _collect_singleflight() -> List[Sample]:
+    """Get the counters of the request coalescing groups."""
+    samples = []
+    for group, stats in singleflight.get_stats().items():
+        samples.append(('chat_singleflight_calls_total', {'group': group}, stats['calls']))
+        samples.append(('chat_singleflight_coalesced_total', {'group': group}, stats['coalesced']))
+    return samples
+
+register_collector(_collect_singleflight)
+
+
+def init_app(app) -> None:
+    """Count and time the app's requests, and serve the metrics of every process at /metrics."""
+    global _enabled
+    _enabled = True
+
+    @app.before_request
+    def start_metrics():
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def record_metrics(response):
+        start = g.pop('metrics_start', None)
+        if start is not None:
+            route = request.url_rule.rule if request.url_rule is not None else '<unmatched>'
+            inc('chat_requests_total', route=route, method=request.method, status=str(response.status_code))
+            observe('chat_request_duration_seconds', time.perf_counter() - start, route=route, method=request.method)
+        return response
+
+    @app.route('/metrics')
+    @api_key_required
+    def metrics():
+        # The snapshot of this process is brought up to date; the other processes' are as of their last flush
+        flush()
+        gauges = [sample for collector in _gauge_collectors for sample in collector()]
+        return Response(render(aggregate(), gauges), mimetype='text/plain; version=0.0.4')
+
+    start_flusher()
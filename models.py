@@ -1,52 +1,129 @@
 from datetime import datetime, timedelta, timezone
+import time
 import uuid
 import jwt
 from passlib.hash import pbkdf2_sha256
 import json_storage
+import attachments
+from attachments import AttachmentNotFoundError
+import search_index
+import conversations
+import timelines
+import unread
+from singleflight import SingleFlight
+from timing import instrument_class
 from env import JWT_SECRET_KEY, ACCESS_TOKEN_EXPIRES, REFRESH_TOKEN_EXPIRES, TOKEN_REFRESH_SECONDS
 
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+MICROSECOND = timedelta(microseconds=1)
+MICROSECONDS_PER_DAY = 86400 * 1000000
+
+def now_us():
+    """Get the current time in integer epoch microseconds."""
+    return time.time_ns() // 1000
+
+def parse_timestamp(value):
+    """Convert a stored ISO 8601 timestamp to integer epoch microseconds."""
+    return (datetime.fromisoformat(value) - EPOCH) // MICROSECOND
+
+def format_timestamp(value):
+    """Convert integer epoch microseconds to an ISO 8601 timestamp.
+
+    A stored timestamp that was never parsed is returned as it is.
+    """
+    if value.__class__ is str:
+        return value
+    return (EPOCH + timedelta(microseconds=value)).isoformat()
+
+
+class Timestamp:
+    """Timestamp attribute of a slotted model, in integer epoch microseconds.
+
+    The value is kept in the slot named after the attribute with a leading
+    underscore. Models hydrated from storage hold the stored ISO string
+    there until the attribute is first read, so timestamps that are only
+    passed through to the API are never parsed.
+    """
+
+    def __set_name__(self, owner, name):
+        self.slot = vars(owner)['_' + name]
+
+    def __get__(self, obj, owner=None):
+        if obj is None:
+            return self
+        value = self.slot.__get__(obj, owner)
+        if value.__class__ is str:
+            value = parse_timestamp(value)
+            self.slot.__set__(obj, value)
+        return value
+
+    def __set__(self, obj, value):
+        self.slot.__set__(obj, value)
+
+
 class RefreshToken:
     """Refresh token model for storing valid refresh tokens."""
 
+    __slots__ = ('id', 'user_id', '_expires_at', '_created_at')
+
+    expires_at = Timestamp()
+    created_at = Timestamp()
+
     def __init__(self, user_id, token=None, expires_days=REFRESH_TOKEN_EXPIRES):
         """Initialize a new refresh token."""
         self.id = token or str(uuid.uuid4())
         self.user_id = user_id
-        self.expires_at = datetime.now(timezone.utc) + timedelta(days=expires_days)
-        self.created_at = datetime.now(timezone.utc)
+        self.created_at = now_us()
+        self.expires_at = self.created_at + int(expires_days * MICROSECONDS_PER_DAY)
 
     def to_dict(self):
         """Convert token to dictionary for JSON storage."""
         return {
             'id': self.id,
             'user_id': self.user_id,
-            'expires_at': self.expires_at.isoformat(),
-            'created_at': self.created_at.isoformat()
+            'expires_at': format_timestamp(self._expires_at),
+            'created_at': format_timestamp(self._created_at)
         }
 
     @classmethod
     def from_dict(cls, data):
         """Create a token instance from dictionary data."""
-        token = cls(data['user_id'], data['id'])
-        token.expires_at = datetime.fromisoformat(data['expires_at'])
-        token.created_at = datetime.fromisoformat(data['created_at'])
-        return token
+        return cls.from_dicts([data])[0]
+
+    @classmethod
+    def from_dicts(cls, dicts):
+        """Create token instances from many dictionaries in one pass."""
+        new = cls.__new__
+        tokens = []
+        append = tokens.append
+        for data in dicts:
+            token = new(cls)  # Create instance without calling __init__
+            token.id = data['id']
+            token.user_id = data['user_id']
+            token._expires_at = data['expires_at']
+            token._created_at = data['created_at']
+            append(token)
+        return tokens
 
     def is_expired(self):
         """Check if the token is expired."""
-        return datetime.now(timezone.utc) > self.expires_at
+        return now_us() > self.expires_at
 
 
 class User:
     """User model for chat application."""
 
+    __slots__ = ('id', 'username', 'password_hash', 'email', '_created_at')
+
+    created_at = Timestamp()
+
     def __init__(self, username, password, email=None):
         """Initialize a new user."""
         self.id = str(uuid.uuid4())
         self.username = username
         self.password_hash = pbkdf2_sha256.hash(password)
         self.email = email
-        self.created_at = datetime.now(timezone.utc)
+        self.created_at = now_us()
 
     def to_dict(self):
         """Convert user to dictionary for JSON storage."""
@@ -55,19 +132,29 @@ class User:
             'username': self.username,
             'password_hash': self.password_hash,
             'email': self.email,
-            'created_at': self.created_at.isoformat()
+            'created_at': format_timestamp(self._created_at)
         }
 
     @classmethod
     def from_dict(cls, data):
         """Create a user instance from dictionary data."""
-        user = cls.__new__(cls)  # Create instance without calling __init__
-        user.id = data['id']
-        user.username = data['username']
-        user.password_hash = data['password_hash']
-        user.email = data['email']
-        user.created_at = datetime.fromisoformat(data['created_at'])
-        return user
+        return cls.from_dicts([data])[0]
+
+    @classmethod
+    def from_dicts(cls, dicts):
+        """Create user instances from many dictionaries in one pass."""
+        new = cls.__new__
+        users = []
+        append = users.append
+        for data in dicts:
+            user = new(cls)  # Create instance without calling __init__
+            user.id = data['id']
+            user.username = data['username']
+            user.password_hash = data['password_hash']
+            user.email = data['email']
+            user._created_at = data['created_at']
+            append(user)
+        return users
 
     def verify_password(self, password):
         """Verify password against stored hash."""
@@ -163,6 +250,16 @@ class User:
         deleted_token = json_storage.delete_token(token_id)
         return deleted_token is not None
 
+    @classmethod
+    def invalidate_all_refresh_tokens(cls, user_id):
+        """Invalidate every refresh token of a user.
+
+        Returns:
+            The number of refresh tokens invalidated.
+        """
+        deleted_tokens = json_storage.delete_tokens_by_user(user_id)
+        return len(deleted_tokens)
+
     @staticmethod
     def decode_token(token):
         """Decode and validate a JWT token."""
@@ -178,53 +275,107 @@ class User:
 class Message:
     """Message model for chat application."""
 
-    def __init__(self, user_id, content, recipient_id=None):
+    __slots__ = ('id', 'user_id', 'content', '_timestamp', 'recipient_id', 'attachments', 'seq')
+
+    timestamp = Timestamp()
+
+    # Coalesces concurrent computations of the same user's view of the same store version
+    _viewable_flight = SingleFlight('viewable_messages')
+
+    # The fields of a message's API representation, which clients can select from
+    FIELDS = ('id', 'user_id', 'username', 'content', 'timestamp', 'recipient_id', 'recipient_username',
+              'attachments', 'seq', 'room_id')
+
+    def __init__(self, user_id, content, recipient_id=None, attachments=None):
         """Initialize a new message.
 
         Args:
             user_id: The ID of the user sending the message
             content: The content of the message
             recipient_id: The ID of the recipient user (None for public messages)
+            attachments: References to the message's attachments, each with
+                the attachment's 'hash', 'size' and 'content_type'
         """
         self.id = str(uuid.uuid4())
         self.user_id = user_id
         self.content = content
         self.recipient_id = recipient_id
-        self.timestamp = datetime.now(timezone.utc)
+        self.attachments = attachments or []
+        self.timestamp = now_us()
+        self.seq = None  # Assigned by the storage layer when the message is saved
 
-    def to_dict(self):
-        """Convert message to dictionary for JSON storage."""
-        user = User.get_by_id(self.user_id)
-        username = user.username if user else "Unknown"
+    @staticmethod
+    def _username(user_id, users=None):
+        """Look up a user's username, in users if given, or None if the user does not exist."""
+        if users is not None:
+            user = users.get(user_id)
+            return user['username'] if user else None
+        user = User.get_by_id(user_id)
+        return user.username if user else None
+
+    def to_dict(self, users=None, fields=None):
+        """Convert message to dictionary for JSON storage.
+
+        Args:
+            users: Optional dictionary of user dictionaries by ID to take the
+                usernames from, instead of looking up each user
+            fields: Optional fields to include, see FIELDS (default: all of
+                them); usernames are only looked up if they are included
+        """
+        username = recipient_username = None
+        if fields is None or 'username' in fields:
+            username = self._username(self.user_id, users) or "Unknown"
 
         # Get recipient information if available
-        recipient_username = None
-        if self.recipient_id:
-            recipient = User.get_by_id(self.recipient_id)
-            recipient_username = recipient.username if recipient else None
+        if self.recipient_id and (fields is None or 'recipient_username' in fields):
+            recipient_username = self._username(self.recipient_id, users)
 
         result = {
             'id': self.id,
             'user_id': self.user_id,
             'username': username,
             'content': self.content,
-            'timestamp': self.timestamp.isoformat(),
+            'timestamp': format_timestamp(self._timestamp),
             'recipient_id': self.recipient_id,
-            'recipient_username': recipient_username
+            'recipient_username': recipient_username,
+            'attachments': self.attachments,
+            'seq': self.seq
         }
 
-        return result
+        if fields is None:
+            return result
+        return self.project(result, fields)
+
+    @staticmethod
+    def project(message_dict, fields):
+        """Keep only the given fields of a message dictionary, in the order they are given.
+
+        Fields the message does not have, such as room_id outside a room, are left out.
+        """
+        return {field: message_dict[field] for field in fields if field in message_dict}
 
     @classmethod
     def from_dict(cls, data):
         """Create a message instance from dictionary data."""
-        message = cls.__new__(cls)  # Create instance without calling __init__
-        message.id = data['id']
-        message.user_id = data['user_id']
-        message.content = data['content']
-        message.timestamp = datetime.fromisoformat(data['timestamp'])
-        message.recipient_id = data.get('recipient_id')  # Use get() to handle older messages without this field
-        return message
+        return cls.from_dicts([data])[0]
+
+    @classmethod
+    def from_dicts(cls, dicts):
+        """Create message instances from many dictionaries in one pass."""
+        new = cls.__new__
+        messages = []
+        append = messages.append
+        for data in dicts:
+            message = new(cls)  # Create instance without calling __init__
+            message.id = data['id']
+            message.user_id = data['user_id']
+            message.content = data['content']
+            message._timestamp = data['timestamp']
+            message.recipient_id = data.get('recipient_id')  # Use get() to handle older messages without this field
+            message.attachments = data.get('attachments', [])
+            message.seq = data.get('seq')
+            append(message)
+        return messages
 
     @classmethod
     def get_all(cls):
@@ -243,31 +394,59 @@ class Message:
         return messages_dict
 
     @classmethod
-    def get_viewable_by_user(cls, user_id):
-        """Get all messages that a user can view.
+    def get_viewable_by_user(cls, user_id, limit=None, cursor=None):
+        """Get the messages that a user can view, oldest first.
 
         This includes:
         1. Messages sent by the user
         2. Messages sent to the user
         3. Public messages (no recipient_id)
+
+        If limit is given, only the most recent limit messages with a
+        sequence number below cursor are returned. Concurrent calls for
+        the same page while the store is unchanged share one computation,
+        so the returned list must not be modified.
         """
-        all_messages = json_storage.get_messages()
-        viewable_messages = []
-
-        for message in all_messages:
-            # Include if user is the sender
-            if message['user_id'] == user_id:
-                viewable_messages.append(message)
-            # Include if user is the recipient
-            elif message.get('recipient_id') == user_id:
-                viewable_messages.append(message)
-            # Include if message is public (no recipient)
-            elif message.get('recipient_id') is None:
-                viewable_messages.append(message)
+        key = (user_id, limit, cursor, json_storage.get_messages_version())
+        return cls._viewable_flight.do(key, lambda: cls._compute_viewable_by_user(user_id, limit, cursor))
 
-        # Sort messages by timestamp
-        viewable_messages.sort(key=lambda x: x['timestamp'])
-        return viewable_messages
+    @classmethod
+    def _compute_viewable_by_user(cls, user_id, limit=None, cursor=None):
+        """Load the messages on a user's inbox timelines."""
+        message_ids = timelines.get_viewable(user_id, limit, cursor)
+        messages = json_storage.get_messages_by_ids(message_ids)
+        return [messages[message_id] for message_id in message_ids if message_id in messages]
+
+    @staticmethod
+    def is_viewable_by(message, user_id):
+        """Check whether a user can view a stored message or delete tombstone."""
+        return (message['user_id'] == user_id
+                or message.get('recipient_id') == user_id
+                or message.get('recipient_id') is None)
+
+    @classmethod
+    def get_changes_since(cls, user_id, since):
+        """Get the changes visible to a user after a sync sequence number.
+
+        Returns:
+            A dictionary with the inserted 'messages', the 'deleted' message
+            tombstones and the 'last_seq' to use as the next cursor, or None
+            if tombstones after since have already been dropped and the
+            client has to re-download all messages.
+        """
+        changes = json_storage.get_changes_since(since)
+
+        if 0 < since < changes['pruned_seq']:
+            return None
+
+        return {
+            'messages': [m for m in changes['messages'] if cls.is_viewable_by(m, user_id)],
+            'deleted': [
+                {'id': t['id'], 'seq': t['seq'], 'deleted_at': t['deleted_at']}
+                for t in changes['tombstones'] if cls.is_viewable_by(t, user_id)
+            ],
+            'last_seq': changes['last_seq']
+        }
 
     @classmethod
     def get_by_id(cls, message_id):
@@ -278,23 +457,350 @@ class Message:
         return None
 
     @classmethod
-    def add(cls, user_id, content, recipient_id=None):
+    def get_by_ids_for_user(cls, user_id, message_ids):
+        """Get several messages by ID, checking that a user can view each one.
+
+        All IDs are resolved in one pass through the message ID index.
+
+        Returns:
+            The viewable messages in the order of message_ids, the IDs that
+            do not exist, and the IDs of messages the user cannot view.
+        """
+        found = json_storage.get_messages_by_ids(message_ids)
+        messages, not_found, forbidden = [], [], []
+        for message_id in dict.fromkeys(message_ids):
+            message = found.get(message_id)
+            if message is None:
+                not_found.append(message_id)
+            elif cls.is_viewable_by(message, user_id):
+                messages.append(message)
+            else:
+                forbidden.append(message_id)
+        return messages, not_found, forbidden
+
+    @classmethod
+    def add(cls, user_id, content, recipient_id=None, attachments=None):
         """Add a new message.
 
         Args:
             user_id: The ID of the user sending the message
             content: The content of the message
             recipient_id: The ID of the recipient user (None for public messages)
+            attachments: The Attachment instances the message references
+
+        Raises:
+            AttachmentNotFoundError: If an attachment was removed since it was
+                looked up; the message is not stored then.
         """
-        message = Message(user_id, content, recipient_id)
+        attachments = attachments or []
+        message = Message(user_id, content, recipient_id, [attachment.reference() for attachment in attachments])
+        if attachments:
+            # Referenced before the message is stored, so the attachments cannot be removed in between
+            missing = json_storage.add_attachment_references([attachment.hash for attachment in attachments],
+                                                             message.id)
+            if missing:
+                raise AttachmentNotFoundError(f'Attachment {missing[0]} not found')
         message_dict = message.to_dict()
         json_storage.add_message(message_dict)
+        message.seq = message_dict['seq']
+        search_index.index_message(message_dict)
+        timelines.add_message(message_dict)
+        unread.add_message(message_dict)
+        if recipient_id:
+            conversations.add_message(message_dict)
         return message
 
+    @classmethod
+    def add_many(cls, user_id, items, users):
+        """Add a batch of new messages from one user with a single storage write.
+
+        Args:
+            user_id: The ID of the user sending the messages
+            items: (content, recipient_id) pairs, with recipient_id None for public messages
+            users: User dictionaries by ID, including the sender and every recipient
+
+        Returns:
+            The stored message dictionaries, in the order of items.
+        """
+        message_dicts = [Message(user_id, content, recipient_id).to_dict(users) for content, recipient_id in items]
+        json_storage.add_messages(message_dicts)
+        search_index.index_messages(message_dicts)
+        timelines.add_messages(message_dicts)
+        unread.add_messages(message_dicts)
+        private = [message_dict for message_dict in message_dicts if message_dict['recipient_id']]
+        if private:
+            conversations.add_messages(private)
+        return message_dicts
+
     @classmethod
     def delete(cls, message_id, user_id=None):
         """Delete a message by ID, optionally checking user ownership."""
         deleted_message = json_storage.delete_message(message_id, user_id)
         if deleted_message:
+            search_index.remove_message(message_id)
+            timelines.remove_message(message_id)
+            unread.remove_message(message_id)
+            if deleted_message.get('recipient_id'):
+                conversations.remove_message(message_id)
+            attachment_hashes = [reference['hash'] for reference in deleted_message.get('attachments', [])]
+            if attachment_hashes:
+                for attachment_hash in json_storage.remove_attachment_references(
+                        attachment_hashes, message_id, deleted_message['user_id']):
+                    attachments.delete_blob(attachment_hash)
             return cls.from_dict(deleted_message)
         return None
+
+    @classmethod
+    def search(cls, user_id, query, limit):
+        """Search the messages a user can view for every term of a query.
+
+        Returns:
+            Up to limit matching messages, newest first.
+        """
+        message_ids = search_index.search(query, user_id, limit)
+        messages = json_storage.get_messages_by_ids(message_ids)
+        return [messages[message_id] for message_id in message_ids if message_id in messages]
+
+    @classmethod
+    def get_unread_counts(cls, user_id):
+        """Get a user's unread message counts.
+
+        Returns a dictionary with the 'total' number of unread messages,
+        the unread 'public' messages, and the unread private messages of
+        each conversation by the other user's ID in 'conversations'.
+        """
+        return unread.get_counts(user_id)
+
+    @classmethod
+    def mark_read(cls, user_id, cursor, other_user_id=None):
+        """Mark the messages a user can view as read up to a sequence number.
+
+        Args:
+            user_id: The ID of the user who read the messages
+            cursor: The seq of the last message read
+            other_user_id: Only mark the conversation with this user as read
+        """
+        unread.mark_read(user_id, cursor, other_user_id)
+
+    @classmethod
+    def get_conversations(cls, user_id, limit, cursor=None):
+        """Get a user's direct conversations, most recently active first.
+
+        Each conversation holds the other user's 'user_id' and 'username',
+        the 'last_seq' of the conversation and a 'last_message' preview.
+        Pass the last_seq of the last conversation as cursor to get the next page.
+        """
+        return conversations.list_conversations(user_id, limit, cursor)
+
+    @classmethod
+    def get_conversation(cls, user_id, other_user_id, limit, cursor=None):
+        """Get the private messages between two users, oldest first.
+
+        Returns the most recent limit messages with a sequence number
+        below cursor. Pass the seq of the first message as cursor to get
+        the previous page.
+        """
+        message_ids = conversations.get_thread(user_id, other_user_id, limit, cursor)
+        messages = json_storage.get_messages_by_ids(message_ids)
+        return [messages[message_id] for message_id in message_ids if message_id in messages]
+
+
+class Attachment:
+    """Attachment model for files referenced by messages.
+
+    The bytes are kept in the content-addressed blob store, so the same
+    content uploaded by several users is one attachment with several
+    uploaders.
+    """
+
+    def __init__(self, attachment_hash, size, content_type):
+        """Initialize a new attachment.
+
+        Args:
+            attachment_hash: The SHA-256 hash of the content
+            size: The size of the content in bytes
+            content_type: The MIME type given on the first upload
+        """
+        self.hash = attachment_hash
+        self.size = size
+        self.content_type = content_type
+        self.uploaded_by = []
+        self.messages = []
+        self.created_at = datetime.now(timezone.utc)
+
+    def to_dict(self):
+        """Convert attachment to dictionary for JSON storage."""
+        return {
+            'hash': self.hash,
+            'size': self.size,
+            'content_type': self.content_type,
+            'uploaded_by': self.uploaded_by,
+            'messages': self.messages,
+            'created_at': self.created_at.isoformat()
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """Create an attachment instance from dictionary data."""
+        attachment = cls.__new__(cls)  # Create instance without calling __init__
+        attachment.hash = data['hash']
+        attachment.size = data['size']
+        attachment.content_type = data['content_type']
+        attachment.uploaded_by = data['uploaded_by']
+        attachment.messages = data['messages']
+        attachment.created_at = datetime.fromisoformat(data['created_at'])
+        return attachment
+
+    def reference(self):
+        """Get the reference to the attachment stored in messages."""
+        return {
+            'hash': self.hash,
+            'size': self.size,
+            'content_type': self.content_type
+        }
+
+    @property
+    def path(self):
+        """The path of the attachment's blob file."""
+        return attachments.blob_path(self.hash)
+
+    @classmethod
+    def upload(cls, stream, content_type, user_id):
+        """Store an uploaded stream and record the user as an uploader.
+
+        Returns:
+            The attachment, and whether its content was new to the store.
+
+        Raises:
+            AttachmentTooLargeError: If the upload exceeds MAX_ATTACHMENT_SIZE.
+        """
+        attachment_hash, size, created = attachments.store_stream(stream)
+        attachment = Attachment(attachment_hash, size, content_type)
+        attachment_dict = json_storage.add_attachment_upload(attachment.to_dict(), user_id)
+        return cls.from_dict(attachment_dict), created
+
+    @classmethod
+    def get_by_hash(cls, attachment_hash):
+        """Get attachment by hash."""
+        if not attachments.is_valid_hash(attachment_hash):
+            return None
+        attachment_dict = json_storage.get_attachment(attachment_hash)
+        if attachment_dict:
+            return cls.from_dict(attachment_dict)
+        return None
+
+    def is_viewable_by(self, user_id):
+        """Check whether a user uploaded the attachment or can view a message referencing it."""
+        if user_id in self.uploaded_by:
+            return True
+        messages = json_storage.get_messages_by_ids(self.messages)
+        return any(Message.is_viewable_by(message, user_id) for message in messages.values())
+
+
+class Room:
+    """Chat room model.
+
+    Each room's messages are stored in their own partition, so reading a
+    room only touches that room's data.
+    """
+
+    def __init__(self, name, created_by, retention_days=None):
+        """Initialize a new room.
+
+        Args:
+            name: The name of the room
+            created_by: The ID of the user creating the room, who becomes its first member
+            retention_days: Age in days after which the room's messages expire
+                (None for ROOM_MESSAGE_RETENTION_DAYS, 0 to keep them forever)
+        """
+        self.id = str(uuid.uuid4())
+        self.name = name
+        self.created_by = created_by
+        self.members = [created_by]
+        self.retention_days = retention_days
+        self.created_at = datetime.now(timezone.utc)
+
+    def to_dict(self):
+        """Convert room to dictionary for JSON storage."""
+        return {
+            'id': self.id,
+            'name': self.name,
+            'created_by': self.created_by,
+            'members': self.members,
+            'retention_days': self.retention_days,
+            'created_at': self.created_at.isoformat()
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """Create a room instance from dictionary data."""
+        room = cls.__new__(cls)  # Create instance without calling __init__
+        room.id = data['id']
+        room.name = data['name']
+        room.created_by = data['created_by']
+        room.members = data['members']
+        room.retention_days = data.get('retention_days')
+        room.created_at = datetime.fromisoformat(data['created_at'])
+        return room
+
+    @classmethod
+    def create(cls, name, user_id, retention_days=None):
+        """Create a new room with the user as its first member."""
+        room = Room(name, user_id, retention_days)
+        json_storage.add_room(room.to_dict())
+        return room
+
+    @classmethod
+    def get_all(cls):
+        """Get all rooms."""
+        return [cls.from_dict(room_dict) for room_dict in json_storage.get_rooms()]
+
+    @classmethod
+    def get_by_id(cls, room_id):
+        """Get room by ID."""
+        room_dict = json_storage.get_room_by_id(room_id)
+        if room_dict:
+            return cls.from_dict(room_dict)
+        return None
+
+    @classmethod
+    def join(cls, room_id, user_id):
+        """Add a user to a room. Returns the room, or None if it does not exist."""
+        room_dict = json_storage.add_room_member(room_id, user_id)
+        if room_dict:
+            return cls.from_dict(room_dict)
+        return None
+
+    @classmethod
+    def leave(cls, room_id, user_id):
+        """Remove a user from a room. Returns the room, or None if it does not exist."""
+        room_dict = json_storage.remove_room_member(room_id, user_id)
+        if room_dict:
+            return cls.from_dict(room_dict)
+        return None
+
+    def is_member(self, user_id):
+        """Check whether a user is a member of the room."""
+        return json_storage.is_room_member(self.id, user_id)
+
+    def add_message(self, user_id, content):
+        """Post a message to the room.
+
+        Returns:
+            The stored message dictionary, including its room sequence number.
+        """
+        message_dict = Message(user_id, content).to_dict()
+        message_dict['room_id'] = self.id
+        return json_storage.add_room_message(self.id, message_dict)
+
+    def get_messages(self, limit=None):
+        """Get the room's messages, oldest first, optionally only the last limit messages."""
+        messages = json_storage.get_room_messages(self.id)
+        if limit:
+            messages = messages[-limit:]
+        return messages
+
+# Time the model methods of sampled requests, except those called per object
+for _model in (RefreshToken, User, Message, Attachment, Room):
+    instrument_class(_model, f'model.{_model.__name__}',
+                     exclude=('from_dict', 'from_dicts', 'project', 'is_viewable_by'))
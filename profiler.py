@@ -0,0 +1,227 @@
+"""
+Sampling profiler for slow requests of the 0xC Chat API.
+
+While the profiler is enabled, a background thread samples the stack of
+every request in progress every PROFILE_SAMPLE_INTERVAL_MS. A request
+slower than PROFILE_SLOW_MS keeps its samples as a profile in the
+collapsed stack format of flame graph tools, one stack and its sample
+count per line. A random PROFILE_SAMPLE_RATE share of requests is also
+run under cProfile, and kept as a profile that pstats or snakeviz can
+load, whatever its duration.
+
+Each profile is written to PROFILE_DIR as a data file, <id>.prof or
+<id>.stacks, next to <id>.json with its route, user ID, duration and the
+sizes of the data files when it was taken. Only the PROFILE_MAX_FILES
+newest profiles are kept.
+"""
+
+import cProfile
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+from flask import g, request
+import json_storage
+from env import (
+    PROFILE_SLOW_MS, PROFILE_SAMPLE_RATE, PROFILE_SAMPLE_INTERVAL_MS, PROFILE_DIR, PROFILE_MAX_FILES
+)
+
+# Pattern of profile IDs: the time in milliseconds, then a random suffix
+PROFILE_ID_PATTERN = re.compile(r'^\d{13}-[0-9a-f]{8}$')
+
+# File extension of the data file of each kind of profile
+PROFILE_EXTENSIONS = {'cprofile': '.prof', 'stacks': '.stacks'}
+
+
+class StackSampler:
+    """Background thread sampling the stacks of the threads handling requests."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        # Sample counts of each stack, by the ID of the thread handling the request
+        self.active: Dict[int, Counter] = {}
+        self.thread: Optional[threading.Thread] = None
+        self.lock = threading.Lock()
+
+    def start(self) -> None:
+        """Start the sampling thread, unless it is running."""
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, name='stack-sampler', daemon=True)
+                self.thread.start()
+
+    def run(self) -> None:
+        """Count the current stack of each tracked thread every interval, forever."""
+        while True:
+            time.sleep(self.interval)
+            if not self.active:
+                continue
+            frames = sys._current_frames()
+            for thread_id, stacks in list(self.active.items()):
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    stacks[self.stack_key(frame)] += 1
+
+    @staticmethod
+    def stack_key(frame) -> str:
+        """Collapse a stack into frames separated by semicolons, outermost first."""
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+            frame = frame.f_back
+        return ';'.join(reversed(names))
+
+    def track(self, thread_id: int) -> None:
+        """Start sampling the request handled by a thread."""
+        self.active[thread_id] = Counter()
+
+    def untrack(self, thread_id: int) -> Counter:
+        """Stop sampling the request handled by a thread and get its samples."""
+        return self.active.pop(thread_id, None) or Counter()
+
+
+def _profile_path(profile_id: str, extension: str, profile_dir: str = PROFILE_DIR) -> str:
+    """Get the path of a profile's file with the given extension."""
+    return os.path.join(profile_dir, profile_id + extension)
+
+def save_profile(metadata: Dict[str, Any], profile: Optional[cProfile.Profile] = None,
+                 stacks: Optional[Counter] = None, profile_dir: str = PROFILE_DIR,
+                 max_files: int = PROFILE_MAX_FILES) -> Dict[str, Any]:
+    """Write a profile and its metadata, then delete the oldest profiles over max_files.
+
+    Args:
+        metadata: The route, user ID, duration and other tags of the profile
+        profile: A cProfile profile, saved in the pstats format
+        stacks: Otherwise, the sample count of each collapsed stack
+
+    Returns:
+        The metadata with the 'id', 'kind' and 'storage' file sizes of the profile added.
+    """
+    os.makedirs(profile_dir, exist_ok=True)
+    profile_id = f'{int(time.time() * 1000):013d}-{uuid.uuid4().hex[:8]}'
+    kind = 'cprofile' if profile is not None else 'stacks'
+    metadata = dict(metadata, id=profile_id, kind=kind, storage=json_storage.get_file_sizes())
+
+    path = _profile_path(profile_id, PROFILE_EXTENSIONS[kind], profile_dir)
+    if profile is not None:
+        profile.dump_stats(path)
+    else:
+        with open(path, 'w') as f:
+            f.writelines(f'{stack} {count}\n' for stack, count in stacks.most_common())
+    metadata['size'] = os.path.getsize(path)
+
+    # Written last, as a profile is listed once its metadata exists
+    with open(_profile_path(profile_id, '.json', profile_dir), 'w') as f:
+        json.dump(metadata, f, indent=2)
+
+    for old in list_profiles(profile_dir)[max(max_files, 0):]:
+        delete_profile(old['id'], profile_dir)
+    return metadata
+
+def list_profiles(profile_dir: str = PROFILE_DIR) -> List[Dict[str, Any]]:
+    """Get the metadata of every profile, newest first."""
+    try:
+        names = os.listdir(profile_dir)
+    except FileNotFoundError:
+        return []
+
+    profiles = []
+    for name in sorted(names, reverse=True):
+        profile_id, extension = os.path.splitext(name)
+        if extension == '.json' and PROFILE_ID_PATTERN.match(profile_id):
+            profile = get_profile(profile_id, profile_dir)
+            if profile is not None:
+                profiles.append(profile)
+    return profiles
+
+def get_profile(profile_id: str, profile_dir: str = PROFILE_DIR) -> Optional[Dict[str, Any]]:
+    """Get the metadata of a profile, or None if it does not exist."""
+    if not PROFILE_ID_PATTERN.match(profile_id):
+        return None
+    try:
+        with open(_profile_path(profile_id, '.json', profile_dir), 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+def get_profile_file(profile: Dict[str, Any], profile_dir: str = PROFILE_DIR) -> str:
+    """Get the path of a profile's data file."""
+    return _profile_path(profile['id'], PROFILE_EXTENSIONS[profile['kind']], profile_dir)
+
+def delete_profile(profile_id: str, profile_dir: str = PROFILE_DIR) -> None:
+    """Delete a profile's metadata and data file."""
+    for extension in ('.json',) + tuple(PROFILE_EXTENSIONS.values()):
+        try:
+            os.remove(_profile_path(profile_id, extension, profile_dir))
+        except FileNotFoundError:
+            pass
+
+
+def init_app(app, slow_ms: int = PROFILE_SLOW_MS, sample_rate: float = PROFILE_SAMPLE_RATE,
+             interval_ms: int = PROFILE_SAMPLE_INTERVAL_MS) -> StackSampler:
+    """Profile the app's slow requests and a random sample of them."""
+    sampler = StackSampler(interval_ms / 1000)
+    if slow_ms > 0:
+        sampler.start()
+
+    @app.before_request
+    def start_profile():
+        g.profile_start = time.perf_counter()
+        if slow_ms > 0:
+            sampler.track(threading.get_ident())
+        if sample_rate > 0 and random.random() < sample_rate:
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                # Another profiler is active in this process
+                return
+            g.profile = profile
+
+    @app.after_request
+    def save_request_profile(response):
+        start = g.pop('profile_start', None)
+        profile = g.pop('profile', None)
+        if profile is not None:
+            profile.disable()
+        stacks = sampler.untrack(threading.get_ident())
+        if start is None:
+            return response
+
+        duration_ms = (time.perf_counter() - start) * 1000
+        slow = slow_ms > 0 and duration_ms >= slow_ms
+        if profile is not None or (slow and stacks):
+            metadata = {
+                'route': request.url_rule.rule if request.url_rule is not None else None,
+                'method': request.method,
+                'path': request.path,
+                'status': response.status_code,
+                'user_id': g.get('user_id'),
+                'duration_ms': round(duration_ms, 3),
+                'reason': 'slow' if slow else 'sample',
+                'created_at': datetime.now(timezone.utc).isoformat()
+            }
+            try:
+                save_profile(metadata, profile, stacks)
+            except OSError:
+                # Never fail the request because its profile could not be written
+                pass
+        return response
+
+    @app.teardown_request
+    def stop_profile(error=None):
+        # Clean up after requests that failed before their response was built
+        profile = g.pop('profile', None)
+        if profile is not None:
+            profile.disable()
+        sampler.untrack(threading.get_ident())
+
+    return sampler
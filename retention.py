@@ -0,0 +1,166 @@
+"""
+Message retention for the 0xC Chat application.
+
+Messages expire by age and/or count, with separate ages for public and
+private messages, and room messages expire by their own age and count,
+which a room can override with its retention_days. A background job
+moves expired messages into gzip-compressed archive segments, or drops
+them, and compacts the live files.
+
+Expired messages are selected from a snapshot of the store without
+holding any lock and archived before they are removed, so writers only
+wait for the single write that removes them. If the job stops between
+the two steps, the messages are archived again on the next run.
+
+Run this module to apply retention once:
+
+    python retention.py
+"""
+
+import gzip
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Any, Optional
+import json_storage
+from env import (
+    DATA_DIR, PUBLIC_MESSAGE_RETENTION_DAYS, PRIVATE_MESSAGE_RETENTION_DAYS, MESSAGE_RETENTION_COUNT,
+    ROOM_MESSAGE_RETENTION_DAYS, ROOM_MESSAGE_RETENTION_COUNT, RETENTION_ARCHIVE, RETENTION_INTERVAL
+)
+
+# Directory for archive segments
+ARCHIVE_DIR = os.path.join(DATA_DIR, "archive")
+
+_retention_lock = threading.Lock()
+_retention_worker = None
+
+def _cutoff(days: int, now: datetime) -> Optional[str]:
+    """Get the timestamp before which messages older than days expire, or None if they never do."""
+    if days <= 0:
+        return None
+    return (now - timedelta(days=days)).isoformat()
+
+def _select_expired(messages: List[Dict[str, Any]], cutoff_for: Callable[[Dict[str, Any]], Optional[str]],
+                    max_count: int, keep_last: bool = False) -> List[Dict[str, Any]]:
+    """Select the expired messages of an oldest-first list.
+
+    Args:
+        messages: The messages, oldest first
+        cutoff_for: Gets the timestamp before which a message expires, or None
+        max_count: Number of messages to keep, the oldest beyond it expire (0 for no limit)
+        keep_last: Never expire the newest message
+    """
+    excess = len(messages) - max_count if max_count > 0 else 0
+    candidates = messages[:-1] if keep_last else messages
+
+    expired = []
+    for position, message in enumerate(candidates):
+        cutoff = cutoff_for(message)
+        if position < excess or (cutoff is not None and message['timestamp'] < cutoff):
+            expired.append(message)
+    return expired
+
+def _write_segment(directory: str, messages: List[Dict[str, Any]]) -> str:
+    """Write messages to a new gzip-compressed archive segment, one JSON message per line.
+
+    Returns:
+        The path of the segment.
+    """
+    os.makedirs(directory, exist_ok=True)
+    first_seq, last_seq = messages[0].get('seq') or 0, messages[-1].get('seq') or 0
+    path = os.path.join(directory, f"{first_seq:012d}-{last_seq:012d}-{time.time_ns()}.jsonl.gz")
+
+    temp_file = f'{path}.tmp'
+    with gzip.open(temp_file, 'wt', encoding='utf-8') as f:
+        for message in messages:
+            f.write(json.dumps(message) + '\n')
+    os.replace(temp_file, path)
+    return path
+
+def read_segment(path: str) -> List[Dict[str, Any]]:
+    """Read the messages of an archive segment."""
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        return [json.loads(line) for line in f]
+
+def _expire(directory: str, expired: List[Dict[str, Any]],
+            remove: Callable[[List[str]], List[Dict[str, Any]]]) -> int:
+    """Archive expired messages if enabled, then remove them. Returns the number removed."""
+    if not expired:
+        return 0
+    if RETENTION_ARCHIVE:
+        _write_segment(directory, expired)
+    return len(remove([message['id'] for message in expired]))
+
+def apply_retention(now: Optional[datetime] = None) -> Dict[str, int]:
+    """Archive or drop every expired message and compact the files that held them.
+
+    The newest message of a room is always kept, as the room's sequence
+    numbers continue from it.
+
+    Returns:
+        The number of 'messages' and 'room_messages' that expired.
+    """
+    if now is None:
+        now = datetime.now(timezone.utc)
+
+    with _retention_lock:
+        removed = 0
+        public_cutoff = _cutoff(PUBLIC_MESSAGE_RETENTION_DAYS, now)
+        private_cutoff = _cutoff(PRIVATE_MESSAGE_RETENTION_DAYS, now)
+        if public_cutoff or private_cutoff or MESSAGE_RETENTION_COUNT > 0:
+            expired = _select_expired(
+                json_storage.get_messages(),
+                lambda message: public_cutoff if message.get('recipient_id') is None else private_cutoff,
+                MESSAGE_RETENTION_COUNT
+            )
+            removed = _expire(os.path.join(ARCHIVE_DIR, 'messages'), expired, json_storage.remove_messages)
+
+        room_removed = 0
+        for room in json_storage.get_rooms():
+            days = room.get('retention_days')
+            cutoff = _cutoff(ROOM_MESSAGE_RETENTION_DAYS if days is None else days, now)
+            if cutoff is None and ROOM_MESSAGE_RETENTION_COUNT <= 0:
+                continue
+
+            room_id = room['id']
+            expired = _select_expired(json_storage.get_room_messages(room_id), lambda message: cutoff,
+                                      ROOM_MESSAGE_RETENTION_COUNT, keep_last=True)
+            room_removed += _expire(os.path.join(ARCHIVE_DIR, 'rooms', room_id), expired,
+                                    lambda message_ids: json_storage.remove_room_messages(room_id, message_ids))
+
+        return {'messages': removed, 'room_messages': room_removed}
+
+def start_retention_worker(interval: int = RETENTION_INTERVAL) -> Optional[threading.Thread]:
+    """Start the background thread that periodically applies retention.
+
+    Only one worker is started per process. Returns None if the worker is
+    disabled (interval of 0 or less).
+    """
+    global _retention_worker
+
+    if interval <= 0:
+        return None
+
+    with _retention_lock:
+        if _retention_worker is not None and _retention_worker.is_alive():
+            return _retention_worker
+
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    apply_retention()
+                except (OSError, ValueError):
+                    # Leave the messages for the next run if a file is unreadable
+                    pass
+
+        _retention_worker = threading.Thread(target=run, name='retention-worker', daemon=True)
+        _retention_worker.start()
+        return _retention_worker
+
+
+if __name__ == '__main__':
+    counts = apply_retention()
+    print(f"Expired {counts['messages']} messages and {counts['room_messages']} room messages")
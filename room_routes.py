@@ -0,0 +1,243 @@
+"""
+Chat room routes for the 0xC Chat API.
+"""
+
+from flask import Blueprint, request, jsonify
+from models import Room
+from env import MAX_MESSAGE_LENGTH
+from auth import token_required
+from api_key import api_key_required
+from routes import messages_response, fields_arg
+
+# Create a Blueprint for the chat room routes
+rooms = Blueprint('rooms', __name__)
+
+# Maximum length of a room name
+MAX_ROOM_NAME_LENGTH = 100
+
+def room_summary(room):
+    """Convert a room to its API representation."""
+    return {
+        'id': room.id,
+        'name': room.name,
+        'created_by': room.created_by,
+        'created_at': room.created_at.isoformat(),
+        'retention_days': room.retention_days,
+        'member_count': len(room.members)
+    }
+
+def room_not_found(room_id):
+    """Build the error response for a missing room."""
+    return jsonify({
+        'status': 'error',
+        'message': f'Room with ID {room_id} not found'
+    }), 404
+
+def not_a_member(room_id):
+    """Build the error response for a user who is not a member of a room."""
+    return jsonify({
+        'status': 'error',
+        'message': f'You are not a member of room {room_id}'
+    }), 403
+
+@rooms.route('', methods=['GET'])
+@api_key_required
+@token_required
+def get_rooms(current_user):
+    """Get all rooms (requires authentication)."""
+    return jsonify({
+        'status': 'success',
+        'rooms': [room_summary(room) for room in Room.get_all()]
+    }), 200
+
+@rooms.route('', methods=['POST'])
+@api_key_required
+@token_required
+def create_room(current_user):
+    """Create a new room with the current user as its first member (requires authentication).
+
+    Request body:
+    {
+        "name": "Room name",
+        "retention_days": 30
+    }
+
+    retention_days is optional: the age in days after which the room's
+    messages expire, overriding ROOM_MESSAGE_RETENTION_DAYS (0 keeps them forever).
+    """
+    data = request.get_json()
+
+    # Validate request data
+    if not data:
+        return jsonify({
+            'status': 'error',
+            'message': 'No input data provided'
+        }), 400
+
+    name = data.get('name')
+    if name is None:
+        return jsonify({
+            'status': 'error',
+            'message': 'Missing required field: name'
+        }), 400
+
+    if not isinstance(name, str) or not name.strip():
+        return jsonify({
+            'status': 'error',
+            'message': 'Field name must be a non-empty string'
+        }), 400
+
+    if len(name) > MAX_ROOM_NAME_LENGTH:
+        return jsonify({
+            'status': 'error',
+            'message': f'Room name exceeds maximum length of {MAX_ROOM_NAME_LENGTH} characters'
+        }), 400
+
+    retention_days = data.get('retention_days')
+    if retention_days is not None and (not isinstance(retention_days, int) or isinstance(retention_days, bool)
+                                       or retention_days < 0):
+        return jsonify({
+            'status': 'error',
+            'message': 'Field retention_days must be a non-negative integer'
+        }), 400
+
+    room = Room.create(name.strip(), current_user.id, retention_days)
+
+    return jsonify({
+        'status': 'success',
+        'message': 'Room created successfully',
+        'data': room_summary(room)
+    }), 201
+
+@rooms.route('/<room_id>', methods=['GET'])
+@api_key_required
+@token_required
+def get_room(current_user, room_id):
+    """Get a room by ID (requires authentication)."""
+    room = Room.get_by_id(room_id)
+    if not room:
+        return room_not_found(room_id)
+
+    return jsonify({
+        'status': 'success',
+        'data': dict(room_summary(room), is_member=room.is_member(current_user.id))
+    }), 200
+
+@rooms.route('/<room_id>/join', methods=['POST'])
+@api_key_required
+@token_required
+def join_room(current_user, room_id):
+    """Join a room (requires authentication)."""
+    room = Room.join(room_id, current_user.id)
+    if not room:
+        return room_not_found(room_id)
+
+    return jsonify({
+        'status': 'success',
+        'message': f'Joined room {room.name}',
+        'data': room_summary(room)
+    }), 200
+
+@rooms.route('/<room_id>/leave', methods=['POST'])
+@api_key_required
+@token_required
+def leave_room(current_user, room_id):
+    """Leave a room (requires authentication)."""
+    room = Room.leave(room_id, current_user.id)
+    if not room:
+        return room_not_found(room_id)
+
+    return jsonify({
+        'status': 'success',
+        'message': f'Left room {room.name}',
+        'data': room_summary(room)
+    }), 200
+
+@rooms.route('/<room_id>/messages', methods=['GET'])
+@api_key_required
+@token_required
+def get_room_messages(current_user, room_id):
+    """Get a room's messages, oldest first (requires authentication and membership).
+
+    Query parameters:
+        limit: Optional number of most recent messages to return
+        fields: Comma-separated message fields to include (default: all of them)
+    """
+    room = Room.get_by_id(room_id)
+    if not room:
+        return room_not_found(room_id)
+
+    if not room.is_member(current_user.id):
+        return not_a_member(room_id)
+
+    limit = request.args.get('limit')
+    if limit is not None and (not limit.isdigit() or int(limit) < 1):
+        return jsonify({
+            'status': 'error',
+            'message': 'Query parameter limit must be a positive integer'
+        }), 400
+
+    try:
+        fields = fields_arg()
+    except ValueError as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
+
+    return messages_response(room.get_messages(int(limit) if limit else None), fields), 200
+
+@rooms.route('/<room_id>/messages', methods=['POST'])
+@api_key_required
+@token_required
+def create_room_message(current_user, room_id):
+    """Post a message to a room (requires authentication and membership).
+
+    Request body:
+    {
+        "content": "Message content"
+    }
+    """
+    room = Room.get_by_id(room_id)
+    if not room:
+        return room_not_found(room_id)
+
+    if not room.is_member(current_user.id):
+        return not_a_member(room_id)
+
+    data = request.get_json()
+
+    # Validate request data
+    if not data:
+        return jsonify({
+            'status': 'error',
+            'message': 'No input data provided'
+        }), 400
+
+    # Check required fields
+    if 'content' not in data:
+        return jsonify({
+            'status': 'error',
+            'message': 'Missing required field: content'
+        }), 400
+
+    if not isinstance(data['content'], str):
+        return jsonify({
+            'status': 'error',
+            'message': 'Field content must be a string'
+        }), 400
+
+    # Validate message length
+    if len(data['content']) > MAX_MESSAGE_LENGTH:
+        return jsonify({
+            'status': 'error',
+            'message': f'Message content exceeds maximum length of {MAX_MESSAGE_LENGTH} characters'
+        }), 400
+
+    message = room.add_message(current_user.id, data['content'])
+
+    return jsonify({
+        'status': 'success',
+        'message': 'Message created successfully',
+        'data': message
+    }), 201
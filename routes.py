@@ -1,12 +1,73 @@
-from flask import Blueprint, request, jsonify
-from models import Message, User
-from env import MAX_MESSAGE_LENGTH
+import json
+from flask import Blueprint, request, jsonify, current_app
+from models import Message, User, Attachment
+import json_storage
+from attachments import AttachmentNotFoundError
+from env import (
+    MAX_MESSAGE_LENGTH, MAX_ATTACHMENTS_PER_MESSAGE, MAX_BATCH_SIZE, SEARCH_MAX_RESULTS, PAGE_SIZE, MAX_PAGE_SIZE
+)
 from auth import token_required
 from api_key import api_key_required
+from timing import span
 
 # Create a Blueprint for the API routes
 api = Blueprint('api', __name__)
 
+def messages_response(messages, fields=None, **extra):
+    """Build a success response for a list of messages.
+
+    The body is assembled from the cached JSON fragment of each message
+    rather than serializing every message again with jsonify, unless
+    only some fields of each message are requested. Any extra keyword
+    arguments are added as fields of the response.
+    """
+    with span('serialize'):
+        if fields is None:
+            serialized = json_storage.serialize_messages(messages)
+        else:
+            serialized = json.dumps([Message.project(message, fields) for message in messages]).encode('utf-8')
+        body = b'{"status":"success","messages":' + serialized
+        for key, value in extra.items():
+            body += b',' + json.dumps(key).encode('utf-8') + b':' + json.dumps(value).encode('utf-8')
+    return current_app.response_class(body + b'}', mimetype='application/json')
+
+def int_arg(name, default, minimum=0, maximum=None):
+    """Get an integer query parameter.
+
+    Returns default if the parameter is missing.
+
+    Raises:
+        ValueError: If the parameter is not an integer between minimum and maximum.
+    """
+    value = request.args.get(name)
+    if value is None:
+        return default
+
+    if not value.isdigit() or int(value) < minimum or (maximum is not None and int(value) > maximum):
+        if maximum is None:
+            raise ValueError(f'Query parameter {name} must be an integer of at least {minimum}')
+        raise ValueError(f'Query parameter {name} must be between {minimum} and {maximum}')
+
+    return int(value)
+
+def fields_arg():
+    """Get the fields query parameter: the message fields to include in the response.
+
+    Returns None if the parameter is missing, for every field.
+
+    Raises:
+        ValueError: If the parameter is empty or names a field messages do not have.
+    """
+    value = request.args.get('fields')
+    if value is None:
+        return None
+
+    fields = tuple(dict.fromkeys(field.strip() for field in value.split(',') if field.strip()))
+    if not fields or any(field not in Message.FIELDS for field in fields):
+        raise ValueError(f"Query parameter fields must be a comma-separated list of: {', '.join(Message.FIELDS)}")
+
+    return fields
+
 @api.route('/messages', methods=['GET'])
 @api_key_required
 @token_required
@@ -17,11 +78,95 @@ def get_messages(current_user):
     1. Messages sent by the user
     2. Messages sent to the user
     3. Public messages (no recipient specified)
+
+    Query parameters:
+        limit: Maximum number of messages to return (default: all of them)
+        cursor: The next_cursor returned by the previous page
+        ids: Comma-separated message IDs to fetch instead, see fetch_messages
+        fields: Comma-separated message fields to include (default: all of them)
+
+    With a limit, each page holds the most recent messages before the
+    cursor, oldest first; next_cursor pages further back in time.
     """
-    return jsonify({
-        'status': 'success',
-        'messages': Message.get_viewable_by_user(current_user.id)
-    }), 200
+    if 'ids' in request.args:
+        return messages_by_ids_response(current_user, [i for i in request.args['ids'].split(',') if i])
+
+    try:
+        limit = int_arg('limit', None, 1, MAX_PAGE_SIZE)
+        cursor = int_arg('cursor', None)
+        fields = fields_arg()
+    except ValueError as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
+
+    messages = Message.get_viewable_by_user(current_user.id, limit, cursor)
+    if limit is None:
+        return messages_response(messages, fields), 200
+
+    # Messages without a sequence number cannot be paged past, so no cursor is returned for them
+    next_cursor = messages[0].get('seq') if len(messages) == limit else None
+    return messages_response(messages, fields, next_cursor=next_cursor), 200
+
+def messages_by_ids_response(current_user, message_ids):
+    """Build the response for a batch fetch of messages by ID.
+
+    The response holds the messages the user can view, in request order,
+    and lists the IDs that do not exist under not_found and those the
+    user cannot view under forbidden.
+    """
+    if not message_ids or len(message_ids) > MAX_PAGE_SIZE:
+        return jsonify({
+            'status': 'error',
+            'message': f'Between 1 and {MAX_PAGE_SIZE} message IDs must be given'
+        }), 400
+
+    try:
+        fields = fields_arg()
+    except ValueError as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
+
+    messages, not_found, forbidden = Message.get_by_ids_for_user(current_user.id, message_ids)
+    return messages_response(messages, fields, not_found=not_found, forbidden=forbidden), 200
+
+@api.route('/messages/fetch', methods=['POST'])
+@api_key_required
+@token_required
+def fetch_messages(current_user):
+    """Get several messages by ID (requires authentication).
+
+    Request body:
+    {
+        "ids": ["message-id", ...]
+    }
+
+    Equivalent to GET /messages?ids=..., for lists of IDs too long for a URL.
+    Each message is checked with the same permissions as GET /messages/<message_id>;
+    unknown and forbidden IDs are reported without failing the request.
+    The fields query parameter selects the message fields to include, as
+    for GET /messages.
+    """
+    data = request.get_json()
+
+    # Validate request data
+    if not data:
+        return jsonify({
+            'status': 'error',
+            'message': 'No input data provided'
+        }), 400
+
+    message_ids = data.get('ids')
+    if not isinstance(message_ids, list) or not all(isinstance(message_id, str) for message_id in message_ids):
+        return jsonify({
+            'status': 'error',
+            'message': 'Field ids must be a list of message IDs'
+        }), 400
+
+    return messages_by_ids_response(current_user, message_ids)
 
 @api.route('/messages', methods=['POST'])
 @api_key_required
@@ -32,11 +177,14 @@ def create_message(current_user):
     Request body:
     {
         "content": "Message content",
-        "recipient_id": "optional-user-id-for-private-message"
+        "recipient_id": "optional-user-id-for-private-message",
+        "attachments": ["optional-hash-of-an-uploaded-attachment"]
     }
 
     If recipient_id is provided, the message will only be visible to the sender and recipient.
     If recipient_id is not provided, the message will be public (visible to all users).
+    Attachments are referenced by the hash returned when they were uploaded,
+    and must have been uploaded by, or be visible to, the current user.
     """
     data = request.get_json()
 
@@ -73,8 +221,34 @@ def create_message(current_user):
                 'message': f'Recipient with ID {recipient_id} not found'
             }), 404
 
+    # Resolve the referenced attachments
+    attachment_hashes = data.get('attachments') or []
+    if (not isinstance(attachment_hashes, list) or len(attachment_hashes) > MAX_ATTACHMENTS_PER_MESSAGE
+            or not all(isinstance(attachment_hash, str) for attachment_hash in attachment_hashes)):
+        return jsonify({
+            'status': 'error',
+            'message': f'Field attachments must be a list of at most {MAX_ATTACHMENTS_PER_MESSAGE} attachment hashes'
+        }), 400
+
+    attachments = []
+    for attachment_hash in dict.fromkeys(attachment_hashes):
+        attachment = Attachment.get_by_hash(attachment_hash)
+        if not attachment or not attachment.is_viewable_by(current_user.id):
+            return jsonify({
+                'status': 'error',
+                'message': f'Attachment {attachment_hash} not found'
+            }), 404
+        attachments.append(attachment)
+
     # Create new message with authenticated user's ID and optional recipient_id
-    message = Message.add(current_user.id, data['content'], recipient_id)
+    try:
+        message = Message.add(current_user.id, data['content'], recipient_id, attachments)
+    except AttachmentNotFoundError as e:
+        # An attachment was removed since it was resolved
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 404
 
     return jsonify({
         'status': 'success',
@@ -82,6 +256,109 @@ def create_message(current_user):
         'data': message.to_dict()
     }), 201
 
+@api.route('/messages/batch', methods=['POST'])
+@api_key_required
+@token_required
+def create_messages_batch(current_user):
+    """Create several messages at once (requires authentication).
+
+    Request body:
+    {
+        "messages": [
+            {"content": "Message content", "recipient_id": "optional-user-id-for-private-message"},
+            ...
+        ]
+    }
+
+    Every message is validated first, with all recipients resolved in one
+    lookup, and the valid ones are stored with a single write. The
+    response has a result per message, in request order, so invalid
+    messages do not fail the whole batch.
+    """
+    data = request.get_json()
+
+    # Validate request data
+    if not data:
+        return jsonify({
+            'status': 'error',
+            'message': 'No input data provided'
+        }), 400
+
+    items = data.get('messages')
+    if not isinstance(items, list) or not items or len(items) > MAX_BATCH_SIZE:
+        return jsonify({
+            'status': 'error',
+            'message': f'Field messages must be a list of 1 to {MAX_BATCH_SIZE} messages'
+        }), 400
+
+    recipient_ids = [
+        item['recipient_id'] for item in items if isinstance(item, dict) and isinstance(item.get('recipient_id'), str)
+    ]
+    users = json_storage.get_users_by_ids(recipient_ids + [current_user.id])
+
+    results = [None] * len(items)
+    valid = []
+    for index, item in enumerate(items):
+        error = None
+        if not isinstance(item, dict) or not isinstance(item.get('content'), str):
+            error = 'Missing required field: content'
+        elif len(item['content']) > MAX_MESSAGE_LENGTH:
+            error = f'Message content exceeds maximum length of {MAX_MESSAGE_LENGTH} characters'
+        elif item.get('recipient_id') and (not isinstance(item['recipient_id'], str)
+                                           or item['recipient_id'] not in users):
+            error = f"Recipient with ID {item['recipient_id']} not found"
+
+        if error:
+            results[index] = {'index': index, 'status': 'error', 'message': error}
+        else:
+            valid.append(index)
+
+    if valid:
+        items_to_store = [(items[index]['content'], items[index].get('recipient_id') or None) for index in valid]
+        for index, message in zip(valid, Message.add_many(current_user.id, items_to_store, users)):
+            results[index] = {'index': index, 'status': 'success', 'data': message}
+
+    return jsonify({
+        'status': 'success' if valid else 'error',
+        'message': f'{len(valid)} of {len(items)} messages created',
+        'data': {
+            'created': len(valid),
+            'failed': len(items) - len(valid),
+            'results': results
+        }
+    }), 201 if valid else 400
+
+@api.route('/messages/search', methods=['GET'])
+@api_key_required
+@token_required
+def search_messages(current_user):
+    """Search the messages viewable by the current user (requires authentication).
+
+    Query parameters:
+        q: The search terms; messages must contain every term
+        limit: Maximum number of messages to return (default and maximum: SEARCH_MAX_RESULTS)
+        fields: Comma-separated message fields to include (default: all of them)
+
+    Messages are returned newest first.
+    """
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({
+            'status': 'error',
+            'message': 'Missing required query parameter: q'
+        }), 400
+
+    try:
+        limit = int_arg('limit', SEARCH_MAX_RESULTS, 1, SEARCH_MAX_RESULTS)
+        fields = fields_arg()
+    except ValueError as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
+
+    return messages_response(Message.search(current_user.id, query, limit), fields), 200
+
 @api.route('/messages/<message_id>', methods=['GET'])
 @api_key_required
 @token_required
@@ -92,7 +369,18 @@ def get_message(current_user, message_id):
     1. The sender of the message
     2. The recipient of the message
     3. The message is public (no recipient specified)
+
+    Query parameters:
+        fields: Comma-separated message fields to include (default: all of them)
     """
+    try:
+        fields = fields_arg()
+    except ValueError as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
+
     message = Message.get_by_id(message_id)
 
     if not message:
@@ -122,7 +410,7 @@ def get_message(current_user, message_id):
 
     return jsonify({
         'status': 'success',
-        'data': message.to_dict()
+        'data': message.to_dict(fields=fields)
     }), 200
 
 @api.route('/messages/<message_id>', methods=['DELETE'])
@@ -148,8 +436,175 @@ def delete_message(current_user, message_id):
 @api_key_required
 @token_required
 def get_my_messages(current_user):
-    """Get all messages by the authenticated user."""
+    """Get all messages by the authenticated user.
+
+    Query parameters:
+        fields: Comma-separated message fields to include (default: all of them)
+    """
+    try:
+        fields = fields_arg()
+    except ValueError as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
+
+    return messages_response(Message.get_by_user(current_user.id), fields), 200
+
+@api.route('/sync', methods=['GET'])
+@api_key_required
+@token_required
+def sync(current_user):
+    """Get the message changes visible to the current user since a sync cursor.
+
+    Query parameters:
+        since: The last_seq returned by a previous sync (default: 0, everything)
+        fields: Comma-separated fields of the inserted messages to include (default: all of them)
+
+    Returns the inserted messages and the IDs of deleted messages with a
+    sequence number greater than since, plus the last_seq to pass as the
+    next cursor. If the deletes since the cursor are no longer retained,
+    a 410 error is returned and the client should re-download all messages.
+    """
+    try:
+        since = int_arg('since', 0)
+        fields = fields_arg()
+    except ValueError as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
+
+    changes = Message.get_changes_since(current_user.id, since)
+    if changes is None:
+        return jsonify({
+            'status': 'error',
+            'message': 'Sync cursor has expired, re-download all messages'
+        }), 410
+
+    if fields is not None:
+        changes['messages'] = [Message.project(message, fields) for message in changes['messages']]
+
     return jsonify({
         'status': 'success',
-        'messages': Message.get_by_user(current_user.id)
+        'data': changes
     }), 200
+
+@api.route('/messages/read', methods=['POST'])
+@api_key_required
+@token_required
+def mark_messages_read(current_user):
+    """Mark messages as read up to a cursor (requires authentication).
+
+    Request body:
+    {
+        "cursor": 42,
+        "user_id": "optional-user-id-to-only-mark-that-conversation"
+    }
+
+    cursor is the seq of the last message the client has shown. Read
+    markers only move forward. Returns the updated unread counts.
+    """
+    data = request.get_json()
+
+    if not data:
+        return jsonify({
+            'status': 'error',
+            'message': 'No input data provided'
+        }), 400
+
+    cursor = data.get('cursor')
+    if not isinstance(cursor, int) or isinstance(cursor, bool) or cursor < 0:
+        return jsonify({
+            'status': 'error',
+            'message': 'Field cursor must be a non-negative integer'
+        }), 400
+
+    other_user_id = data.get('user_id')
+    if other_user_id is not None and (not isinstance(other_user_id, str) or not User.get_by_id(other_user_id)):
+        return jsonify({
+            'status': 'error',
+            'message': 'Field user_id must be the ID of an existing user'
+        }), 400
+
+    Message.mark_read(current_user.id, cursor, other_user_id)
+
+    return jsonify({
+        'status': 'success',
+        'message': 'Messages marked as read',
+        'data': Message.get_unread_counts(current_user.id)
+    }), 200
+
+@api.route('/unread', methods=['GET'])
+@api_key_required
+@token_required
+def get_unread(current_user):
+    """Get the current user's unread message counts (requires authentication).
+
+    Returns the total number of unread messages, the unread public
+    messages and the unread private messages of each conversation, by
+    the other user's ID.
+    """
+    return jsonify({
+        'status': 'success',
+        'data': Message.get_unread_counts(current_user.id)
+    }), 200
+
+@api.route('/conversations', methods=['GET'])
+@api_key_required
+@token_required
+def get_conversations(current_user):
+    """Get the current user's direct conversations, most recently active first.
+
+    Query parameters:
+        limit: Maximum number of conversations to return (default: PAGE_SIZE)
+        cursor: The next_cursor returned by the previous page
+
+    Each conversation includes a preview of its last message.
+    """
+    try:
+        limit = int_arg('limit', PAGE_SIZE, 1, MAX_PAGE_SIZE)
+        cursor = int_arg('cursor', None)
+    except ValueError as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
+
+    conversations = Message.get_conversations(current_user.id, limit, cursor)
+
+    return jsonify({
+        'status': 'success',
+        'conversations': conversations,
+        'next_cursor': conversations[-1]['last_seq'] if len(conversations) == limit else None
+    }), 200
+
+@api.route('/conversations/<user_id>', methods=['GET'])
+@api_key_required
+@token_required
+def get_conversation(current_user, user_id):
+    """Get the private messages between the current user and another user.
+
+    Query parameters:
+        limit: Maximum number of messages to return (default: PAGE_SIZE)
+        cursor: The next_cursor returned by the previous page
+        fields: Comma-separated message fields to include (default: all of them)
+
+    Each page holds the most recent messages before the cursor, oldest
+    first; next_cursor pages further back in time.
+    """
+    try:
+        limit = int_arg('limit', PAGE_SIZE, 1, MAX_PAGE_SIZE)
+        cursor = int_arg('cursor', None)
+        fields = fields_arg()
+    except ValueError as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
+
+    messages = Message.get_conversation(current_user.id, user_id, limit, cursor)
+    # Messages without a sequence number cannot be paged past, so no cursor is returned for them
+    next_cursor = messages[0].get('seq') if len(messages) == limit else None
+
+    return messages_response(messages, fields, next_cursor=next_cursor), 200
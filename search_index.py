@@ -0,0 +1,149 @@
+"""
+Full-text search index for the 0xC Chat application.
+
+Message content is tokenized into an inverted index that maps each term
+to the IDs of the messages containing it. The index is updated as
+messages are added and deleted, and is persisted next to the JSON data
+files as a snapshot plus an append-only log of changes since the
+snapshot.
+"""
+
+import os
+import re
+from typing import Dict, List, Any, Set
+from message_index import MessageIndex
+from env import DATA_DIR
+
+# File paths for the persisted index
+SEARCH_INDEX_FILE = os.path.join(DATA_DIR, "search_index.json")
+SEARCH_LOG_FILE = os.path.join(DATA_DIR, "search_index.log")
+
+_TERM_PATTERN = re.compile(r'\w+')
+
+def tokenize(text: str) -> Set[str]:
+    """Split text into the set of lowercase terms it contains."""
+    return set(_TERM_PATTERN.findall(text.lower()))
+
+
+class _SearchIndex(MessageIndex):
+    """Inverted index over message content.
+
+    Each indexed message is kept as a document of
+    [user_id, recipient_id, seq, terms], so results can be checked for
+    visibility and removed from the postings without loading the
+    message. Postings are dictionaries used as ordered sets, in the order
+    messages were indexed, so the newest matches are found first.
+    """
+
+    snapshot_file = SEARCH_INDEX_FILE
+    log_file = SEARCH_LOG_FILE
+
+    def __init__(self):
+        super().__init__()
+        self.docs: Dict[str, list] = {}
+        self.postings: Dict[str, Dict[str, None]] = {}
+
+    def _reset(self) -> None:
+        """Empty the index."""
+        self.docs = {}
+        self.postings = {}
+
+    def _add_doc(self, message_id: str, doc: list) -> bool:
+        """Add a document to the index. Returns False if it was already indexed."""
+        if message_id in self.docs:
+            return False
+        self.docs[message_id] = doc
+        for term in doc[3]:
+            self.postings.setdefault(term, {})[message_id] = None
+        return True
+
+    def _insert(self, message: Dict[str, Any]) -> bool:
+        """Index a stored message."""
+        doc = [message['user_id'], message.get('recipient_id'), message.get('seq', 0),
+               sorted(tokenize(message['content']))]
+        return self._add_doc(message['id'], doc)
+
+    def _delete(self, message_id: str) -> bool:
+        """Remove a message from the index."""
+        doc = self.docs.pop(message_id, None)
+        if doc is None:
+            return False
+        for term in doc[3]:
+            posting = self.postings.get(term)
+            if posting is not None:
+                posting.pop(message_id, None)
+                if not posting:
+                    del self.postings[term]
+        return True
+
+    def _dump(self) -> Dict[str, list]:
+        """Get the indexed documents for a snapshot."""
+        return self.docs
+
+    def _restore(self, data: Dict[str, list]) -> None:
+        """Restore the indexed documents from a snapshot, in the order they were indexed."""
+        for message_id, doc in sorted(data.items(), key=lambda item: item[1][2]):
+            self._add_doc(message_id, doc)
+
+    def _record(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        """Log the document of an inserted message, so replaying it does not need the content."""
+        return {'id': message['id'], 'doc': self.docs[message['id']]}
+
+    def _replay(self, record: Dict[str, Any]) -> None:
+        """Apply a logged insert."""
+        self._add_doc(record['id'], record['doc'])
+
+    def search(self, query: str, user_id: str, limit: int) -> List[str]:
+        """Find the IDs of messages containing every term of the query.
+
+        Only messages the user can view are returned, newest first. The
+        shortest posting list is walked from its newest entry and checked
+        against the others, so the search stops as soon as limit visible
+        matches are found.
+        """
+        terms = tokenize(query)
+        if not terms:
+            return []
+
+        with self.lock:
+            self._catch_up()
+
+            postings = [self.postings.get(term) for term in terms]
+            if any(posting is None for posting in postings):
+                return []
+            postings.sort(key=len)
+            shortest, others = postings[0], postings[1:]
+
+            results = []
+            for message_id in reversed(shortest):
+                if not all(message_id in posting for posting in others):
+                    continue
+                sender_id, recipient_id = self.docs[message_id][:2]
+                if sender_id == user_id or recipient_id is None or recipient_id == user_id:
+                    results.append(message_id)
+                    if len(results) >= limit:
+                        break
+            return results
+
+_index = _SearchIndex()
+
+def index_message(message: Dict[str, Any]) -> None:
+    """Add a newly stored message to the search index."""
+    _index.add(message)
+
+def index_messages(messages: List[Dict[str, Any]]) -> None:
+    """Add a batch of newly stored messages to the search index."""
+    _index.add_many(messages)
+
+def remove_message(message_id: str) -> None:
+    """Remove a deleted message from the search index."""
+    _index.remove(message_id)
+
+def rebuild() -> int:
+    """Rebuild the search index from the message store, returning the number of messages indexed."""
+    _index.rebuild()
+    return len(_index.docs)
+
+def search(query: str, user_id: str, limit: int) -> List[str]:
+    """Find the IDs of messages visible to a user that contain every term of the query, newest first."""
+    return _index.search(query, user_id, limit)
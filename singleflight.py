@@ -0,0 +1,88 @@
+"""
+Request coalescing for the 0xC Chat API.
+
+A SingleFlight group makes concurrent calls for the same key wait for a
+single computation and share its result, so a burst of identical reads
+costs one computation instead of one per request.
+"""
+
+import threading
+from typing import Any, Callable, Dict, Hashable
+
+# All groups by name, for reporting
+_groups: Dict[str, "SingleFlight"] = {}
+
+
+class _Call:
+    """An in-flight computation that other callers can wait on."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Group of keyed computations where concurrent duplicates are coalesced."""
+
+    def __init__(self, name: str):
+        """Create a group and register it under name for reporting."""
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+        self.calls = 0
+        self.executions = 0
+        self.coalesced = 0
+        _groups[name] = self
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        """Call fn, or wait for an identical in-flight call and share its result.
+
+        The result is shared between every caller that was coalesced, so
+        callers must not mutate it. If fn raises, every waiting caller
+        gets the same exception.
+        """
+        with self._lock:
+            self.calls += 1
+            call = self._calls.get(key)
+            if call is not None:
+                self.coalesced += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                self.executions += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+        return call.result
+
+    def stats(self) -> Dict[str, int]:
+        """Get the call counters of the group."""
+        with self._lock:
+            return {
+                'calls': self.calls,
+                'executions': self.executions,
+                'coalesced': self.coalesced,
+                'in_flight': len(self._calls)
+            }
+
+
+def get_stats() -> Dict[str, Dict[str, int]]:
+    """Get the call counters of every group by name."""
+    return {name: group.stats() for name, group in _groups.items()}
@@ -0,0 +1,307 @@
+#!/usr/bin/env python
+"""
+Soak-test runner for the 0xC Chat API.
+
+Keeps the mixed workload of the load-testing harness running for hours
+with the same simulated users, and every interval samples:
+
+- the server's resident memory (RSS) and open file descriptors
+- the size of each file and directory in DATA_DIR
+- the p50/p95/p99 latency of each endpoint over the interval
+
+The report holds every sample as a time series, and the least-squares
+growth of each series as a percentage of its mean per hour. Any resource
+or p95 latency series growing faster than its limit is flagged. Growth
+during a warm-up period, while caches fill, is left out of the fit.
+
+Process metrics are read from /proc, so they need Linux and a server on
+the same host: pass the server's --pid, or use --in-process to measure
+this process.
+
+Usage:
+    python soak.py --url http://localhost:5000 --pid 1234 --duration 14400 --interval 60 --output soak.json
+    python soak.py --in-process --users 5 --duration 600 --interval 10 --limits rss_bytes=2,data.tokens.json=0
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Any, Callable, Dict, List, Optional
+import loadtest
+from env import DATA_DIR
+
+# Default limit on the growth of each series, in percent of its mean per hour
+MAX_GROWTH = 5.0
+
+# Default time in seconds at the start of the run left out of the growth fit
+WARMUP = 60.0
+
+# Series that are sampled but never flagged, as they are not resources
+UNFLAGGED = ('throughput', 'errors')
+
+
+def process_stats(pid: int) -> Dict[str, Optional[int]]:
+    """Get the resident memory in bytes and the number of open file descriptors of a process.
+
+    Either is None if it cannot be read.
+    """
+    rss = None
+    try:
+        with open(f'/proc/{pid}/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    rss = int(line.split()[1]) * 1024
+                    break
+    except (OSError, ValueError):
+        pass
+
+    try:
+        open_fds = len(os.listdir(f'/proc/{pid}/fd'))
+    except OSError:
+        open_fds = None
+
+    return {'rss_bytes': rss, 'open_fds': open_fds}
+
+def data_dir_sizes(data_dir: str = DATA_DIR) -> Dict[str, int]:
+    """Get the size in bytes of each file in a data directory, and the total of each subdirectory."""
+    sizes = {}
+    try:
+        entries = list(os.scandir(data_dir))
+    except FileNotFoundError:
+        return sizes
+
+    for entry in entries:
+        try:
+            if entry.is_dir():
+                sizes[entry.name] = sum(
+                    os.path.getsize(os.path.join(root, name))
+                    for root, _, names in os.walk(entry.path) for name in names
+                    if os.path.exists(os.path.join(root, name))
+                )
+            else:
+                sizes[entry.name] = entry.stat().st_size
+        except FileNotFoundError:
+            # Removed while being measured, such as a temporary file
+            continue
+    return sizes
+
+def linear_slope(points: List[tuple]) -> float:
+    """Get the least-squares slope of (x, y) points, or 0.0 if there are fewer than two distinct x."""
+    n = len(points)
+    if n < 2:
+        return 0.0
+    mean_x = sum(x for x, _ in points) / n
+    mean_y = sum(y for _, y in points) / n
+    variance = sum((x - mean_x) ** 2 for x, _ in points)
+    if variance == 0:
+        return 0.0
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / variance
+
+def sample_values(sample: Dict[str, Any]) -> Dict[str, float]:
+    """Flatten a sample into the value of each series, by name."""
+    values = {
+        'rss_bytes': sample['process']['rss_bytes'],
+        'open_fds': sample['process']['open_fds'],
+        'data.total': sum(sample['data'].values()),
+        'throughput': sample['load']['throughput'],
+        'errors': sample['load']['errors']
+    }
+    for name, size in sample['data'].items():
+        values[f'data.{name}'] = size
+    for endpoint, summary in sample['endpoints'].items():
+        values[f'latency.{endpoint}.p95_ms'] = summary['p95_ms']
+    return {name: value for name, value in values.items() if value is not None}
+
+def analyze(samples: List[Dict[str, Any]], max_growth: float = MAX_GROWTH,
+            limits: Optional[Dict[str, float]] = None, warmup: float = WARMUP) -> Dict[str, Dict[str, Any]]:
+    """Fit the growth of each series of the samples and flag those growing faster than their limit.
+
+    Args:
+        samples: The samples of the run, each with its time in seconds since the start
+        max_growth: Limit on the growth of a series, in percent of its mean per hour
+        limits: Limits of particular series by name, overriding max_growth
+        warmup: Time in seconds at the start of the run left out of the fit
+
+    Returns:
+        For each series: its 'first', 'last', 'min' and 'max' values, its
+        'slope_per_hour' in its own unit, its 'growth_pct_per_hour', the
+        'limit_pct_per_hour' applied, and whether it is 'flagged'.
+    """
+    limits = limits or {}
+    points: Dict[str, List[tuple]] = {}
+    for sample in samples:
+        for name, value in sample_values(sample).items():
+            points.setdefault(name, []).append((sample['time'], value))
+
+    series = {}
+    for name, all_points in sorted(points.items()):
+        fitted = [(t / 3600, value) for t, value in all_points if t >= warmup]
+        values = [value for _, value in all_points]
+        slope = linear_slope(fitted)
+        mean = sum(value for _, value in fitted) / len(fitted) if fitted else 0.0
+        growth = slope / mean * 100 if mean else 0.0
+        limit = limits.get(name, max_growth)
+        series[name] = {
+            'first': values[0],
+            'last': values[-1],
+            'min': min(values),
+            'max': max(values),
+            'slope_per_hour': round(slope, 3),
+            'growth_pct_per_hour': round(growth, 3),
+            'limit_pct_per_hour': limit,
+            'flagged': name not in UNFLAGGED and len(fitted) >= 3 and growth > limit
+        }
+    return series
+
+def parse_limits(value: str) -> Dict[str, float]:
+    """Parse series limits such as 'rss_bytes=2,data.tokens.json=0' into percent per hour by series.
+
+    Raises:
+        ValueError: If a limit is not a number.
+    """
+    limits = {}
+    for item in value.split(','):
+        name, _, limit = item.partition('=')
+        try:
+            limits[name.strip()] = float(limit)
+        except ValueError:
+            raise ValueError(f"Limit of series '{name.strip()}' must be a number")
+    return limits
+
+def run_soak(base_url: str = 'http://localhost:5000', app=None, users: int = 10,
+             mix: Optional[Dict[str, float]] = None, duration: float = 3600.0, interval: float = 60.0,
+             rate: Optional[float] = None, think_time: float = 0.0, api_key: Optional[str] = None,
+             pid: Optional[int] = None, data_dir: str = DATA_DIR, max_growth: float = MAX_GROWTH,
+             limits: Optional[Dict[str, float]] = None, warmup: float = WARMUP, seed: Optional[int] = None,
+             on_sample: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+    """Run a soak test: the load test workload for duration seconds, sampled every interval.
+
+    Args:
+        base_url, app, users, mix, rate, think_time, api_key, seed: As for loadtest.run_load_test
+        duration: Duration of the run in seconds
+        interval: Time in seconds between samples
+        pid: Process ID of the server, to sample its memory and file descriptors
+        data_dir: The server's data directory
+        max_growth, limits, warmup: As for analyze
+        on_sample: Called with the report so far after each sample, e.g. to save it
+
+    Returns:
+        The run's configuration, its 'samples', the 'series' fitted from
+        them (see analyze), and the names of the 'flagged' series.
+    """
+    if app is not None and pid is None:
+        pid = os.getpid()
+
+    simulated = loadtest.create_users(base_url, app, users, api_key)
+    config = {
+        'target': 'in-process' if app is not None else base_url,
+        'pid': pid,
+        'data_dir': data_dir,
+        'users': users,
+        'mix': mix or loadtest.DEFAULT_MIX,
+        'arrival': 'open' if rate is not None else 'closed',
+        'rate': rate,
+        'duration': duration,
+        'interval': interval,
+        'max_growth': max_growth,
+        'limits': limits or {},
+        'warmup': warmup
+    }
+
+    samples = []
+    report = {}
+    start = time.perf_counter()
+    window = 0
+    while True:
+        remaining = duration - (time.perf_counter() - start)
+        if remaining <= 0:
+            break
+
+        result = loadtest.run_load_test(base_url, app, mix=mix, duration=min(interval, remaining), rate=rate,
+                                        think_time=think_time, api_key=api_key,
+                                        seed=None if seed is None else seed + window * users,
+                                        simulated_users=simulated)
+        window += 1
+        samples.append({
+            'time': round(time.perf_counter() - start, 3),
+            'process': process_stats(pid) if pid is not None else {'rss_bytes': None, 'open_fds': None},
+            'data': data_dir_sizes(data_dir),
+            'load': result['total'],
+            'endpoints': {
+                endpoint: {key: summary[key] for key in ('count', 'errors', 'p50_ms', 'p95_ms', 'p99_ms')}
+                for endpoint, summary in result['endpoints'].items()
+            }
+        })
+
+        series = analyze(samples, max_growth, limits, warmup)
+        report = {
+            'config': config,
+            'samples': samples,
+            'series': series,
+            'flagged': [name for name, fit in series.items() if fit['flagged']]
+        }
+        if on_sample is not None:
+            on_sample(report)
+
+    return report
+
+
+def parse_arguments():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description="Soak-test runner for the 0xC Chat API")
+    parser.add_argument("--url", default="http://localhost:5000", help="Base URL of the API")
+    parser.add_argument("--api-key", help="API key for authentication (if SECRET_KEY_ENABLED=1)")
+    parser.add_argument("--in-process", action="store_true",
+                        help="Test an in-process app through the Flask test client instead of --url")
+    parser.add_argument("--pid", type=int, help="Process ID of the server, to sample its memory and descriptors")
+    parser.add_argument("--data-dir", default=DATA_DIR, help="Data directory of the server")
+    parser.add_argument("--users", type=int, default=10, help="Number of simulated users")
+    parser.add_argument("--mix", type=loadtest.parse_mix, default=loadtest.DEFAULT_MIX,
+                        help="Weights of the operations, e.g. register=1,login=1,refresh=1,post=5,list=10")
+    parser.add_argument("--duration", type=float, default=3600.0, help="Duration of the run in seconds")
+    parser.add_argument("--interval", type=float, default=60.0, help="Time in seconds between samples")
+    parser.add_argument("--rate", type=float,
+                        help="Start operations at this many per second (open loop) instead of back to back")
+    parser.add_argument("--think-time", type=float, default=0.0,
+                        help="Seconds each user waits between operations in a closed-loop run")
+    parser.add_argument("--max-growth", type=float, default=MAX_GROWTH,
+                        help="Flag series growing faster than this percentage of their mean per hour")
+    parser.add_argument("--limits", type=parse_limits, default={},
+                        help="Growth limits of particular series, e.g. rss_bytes=2,data.tokens.json=0")
+    parser.add_argument("--warmup", type=float, default=WARMUP,
+                        help="Seconds at the start of the run left out of the growth fit")
+    parser.add_argument("--seed", type=int, help="Random seed, to repeat the same sequence of operations")
+    parser.add_argument("--output", help="Write the JSON report to this file after every sample")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_arguments()
+    if args.users < 1 or args.interval <= 0 or (args.rate is not None and args.rate <= 0):
+        print("Error: --users, --interval and --rate must be positive")
+        sys.exit(1)
+
+    app = None
+    if args.in_process:
+        from app import create_app
+        app = create_app()
+
+    def save(report):
+        if args.output:
+            with open(args.output, 'w') as f:
+                f.write(json.dumps(report, indent=2) + '\n')
+        latest = report['samples'][-1]
+        print(f"[{latest['time']:.0f}s] rss={latest['process']['rss_bytes']} fds={latest['process']['open_fds']} "
+              f"data={sum(latest['data'].values())} ops/s={latest['load']['throughput']} "
+              f"flagged={','.join(report['flagged']) or 'none'}", file=sys.stderr)
+
+    report = run_soak(base_url=args.url, app=app, users=args.users, mix=args.mix, duration=args.duration,
+                      interval=args.interval, rate=args.rate, think_time=args.think_time, api_key=args.api_key,
+                      pid=args.pid, data_dir=args.data_dir, max_growth=args.max_growth, limits=args.limits,
+                      warmup=args.warmup, seed=args.seed, on_sample=save)
+
+    if not args.output:
+        print(json.dumps(report, indent=2))
+    sys.exit(1 if report['flagged'] else 0)
@@ -1,6 +1,33 @@
+import asyncio
+import contextlib
+import functools
 import unittest
 import json
+import os
+import pstats
+import subprocess
+import sys
+import threading
+import tracemalloc
+import time
+import uuid
+from unittest import mock
 from app import create_app
+from async_client import AsyncChatAPIClient
+import benchmark
+import init_db
+import json_storage
+import loadtest
+import metrics
+import profiler
+import retention
+import soak
+import timelines
+import timing
+import auth
+from datetime import datetime, timezone
+from models import RefreshToken, Message, User, Attachment, format_timestamp
+from singleflight import SingleFlight
 
 class ChatAPITestCase(unittest.TestCase):
     """Test case for the chat API."""
@@ -67,5 +94,1032 @@ class ChatAPITestCase(unittest.TestCase):
         res = self.client().get(f'/api/messages/{message_id}')
         self.assertEqual(res.status_code, 404)
 
+class TokenSweeperTestCase(unittest.TestCase):
+    """Test case for the expired refresh token sweeper."""
+
+    def test_sweep_removes_only_expired_tokens(self):
+        """Test the sweeper deletes expired tokens and keeps active ones."""
+        expired = RefreshToken('sweeper_test_user', expires_days=-1).to_dict()
+        active = RefreshToken('sweeper_test_user', expires_days=1).to_dict()
+        json_storage.add_token(expired)
+        json_storage.add_token(active)
+
+        json_storage.sweep_expired_tokens(batch_size=1)
+
+        self.assertIsNone(json_storage.get_token_by_id(expired['id']))
+        self.assertIsNotNone(json_storage.get_token_by_id(active['id']))
+        json_storage.delete_token(active['id'])
+
+class SingleFlightTestCase(unittest.TestCase):
+    """Test case for request coalescing."""
+
+    def test_concurrent_calls_share_one_computation(self):
+        """Test concurrent calls for the same key run the function once."""
+        group = SingleFlight('test_group')
+        executions = []
+
+        def compute():
+            executions.append(1)
+            time.sleep(0.05)
+            return 'result'
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(group.do('key', compute)))
+                   for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, ['result'] * 10)
+        self.assertEqual(len(executions), 1)
+        self.assertEqual(group.stats()['coalesced'], 9)
+
+class AuthenticatedTestCase(unittest.TestCase):
+    """Base test case with helpers for registering and logging in users."""
+
+    def setUp(self):
+        """Set up test client."""
+        self.app = create_app('testing')
+        self.client = self.app.test_client
+
+    def register(self, prefix='user'):
+        """Register a user with a unique username and return the credentials."""
+        credentials = {
+            'username': f'{prefix}_{uuid.uuid4().hex[:8]}',
+            'password': 'password123'
+        }
+        self.client().post('/api/auth/register',
+                           data=json.dumps(credentials),
+                           content_type='application/json')
+        return credentials
+
+    def login(self, credentials):
+        """Log in and return the token data."""
+        res = self.client().post('/api/auth/login',
+                                 data=json.dumps(credentials),
+                                 content_type='application/json')
+        return json.loads(res.data)['data']
+
+    def create_user(self, prefix='user'):
+        """Register and log in a user, returning the user ID and auth headers."""
+        session = self.login(self.register(prefix))
+        return session['user']['id'], {'Authorization': f"Bearer {session['access_token']}"}
+
+class SessionTestCase(AuthenticatedTestCase):
+    """Test case for per-user refresh token sessions."""
+
+    def test_logout_all_revokes_every_session(self):
+        """Test logout-all invalidates all refresh tokens of the user."""
+        credentials = self.register('session')
+        first = self.login(credentials)
+        second = self.login(credentials)
+
+        res = self.client().post('/api/auth/logout-all',
+                                 headers={'Authorization': f"Bearer {second['access_token']}"})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(json.loads(res.data)['data']['revoked_sessions'], 2)
+
+        for session in (first, second):
+            res = self.client().post('/api/auth/refresh',
+                                     data=json.dumps({'refresh_token': session['refresh_token']}),
+                                     content_type='application/json')
+            self.assertEqual(res.status_code, 401)
+
+class SyncTestCase(AuthenticatedTestCase):
+    """Test case for delta sync."""
+
+    def test_sync_returns_visible_inserts_and_deletes(self):
+        """Test sync returns only changes after the cursor that the user can see."""
+        sender_id, sender_headers = self.create_user('sync')
+        recipient_id, recipient_headers = self.create_user('sync')
+        _, other_headers = self.create_user('sync')
+
+        res = self.client().get('/api/sync', headers=recipient_headers)
+        cursor = json.loads(res.data)['data']['last_seq']
+
+        res = self.client().post('/api/messages',
+                                 data=json.dumps({'content': 'Private', 'recipient_id': recipient_id}),
+                                 content_type='application/json',
+                                 headers=sender_headers)
+        message_id = json.loads(res.data)['data']['id']
+        self.client().delete(f'/api/messages/{message_id}', headers=sender_headers)
+
+        res = self.client().get(f'/api/sync?since={cursor}', headers=recipient_headers)
+        data = json.loads(res.data)['data']
+        self.assertEqual([m['id'] for m in data['messages']], [])
+        self.assertEqual([d['id'] for d in data['deleted']], [message_id])
+        self.assertGreater(data['last_seq'], cursor)
+
+        res = self.client().get(f'/api/sync?since={cursor}', headers=other_headers)
+        self.assertEqual(json.loads(res.data)['data']['deleted'], [])
+
+    def test_messages_without_seq_are_numbered(self):
+        """Test only messages stored without sequence numbers are numbered, after the others, and synced from 0."""
+        user_id, headers = self.create_user('legacy')
+        legacy = [{'id': str(uuid.uuid4()), 'user_id': user_id, 'content': f'Legacy {i}',
+                   'timestamp': f'2020-01-01T00:00:0{i}+00:00', 'recipient_id': user_id} for i in range(3)]
+        stored = json_storage.get_messages()
+        state = json_storage.get_sync_state()
+        json_storage.save_messages(legacy + stored)
+
+        json_storage.init_storage()
+        messages = json_storage.get_messages()
+        seqs = [message['seq'] for message in messages]
+        self.assertEqual(seqs, sorted(set(seqs)))
+        self.assertEqual(messages[:len(stored)], stored)
+        self.assertEqual(json_storage.get_sync_state()['pruned_seq'], state['pruned_seq'])
+        self.assertEqual(json_storage._backfill_seq(), 0)
+
+        res = self.client().get('/api/sync?since=0', headers=headers)
+        data = json.loads(res.data)['data']
+        self.assertEqual([m['id'] for m in data['messages'] if m['user_id'] == user_id],
+                         [m['id'] for m in legacy])
+        self.assertEqual(data['last_seq'], seqs[-1])
+
+class SearchTestCase(AuthenticatedTestCase):
+    """Test case for full-text message search."""
+
+    def test_search_respects_visibility(self):
+        """Test search finds matching messages the user can view and hides private ones."""
+        sender_id, sender_headers = self.create_user('search')
+        recipient_id, recipient_headers = self.create_user('search')
+        _, other_headers = self.create_user('search')
+        term = uuid.uuid4().hex
+
+        for content, recipient in ((f'Public {term}', None), (f'Private {term}', recipient_id)):
+            payload = {'content': content}
+            if recipient:
+                payload['recipient_id'] = recipient
+            self.client().post('/api/messages',
+                               data=json.dumps(payload),
+                               content_type='application/json',
+                               headers=sender_headers)
+
+        res = self.client().get(f'/api/messages/search?q={term}', headers=recipient_headers)
+        self.assertEqual(res.status_code, 200)
+        contents = [m['content'] for m in json.loads(res.data)['messages']]
+        self.assertEqual(contents, [f'Private {term}', f'Public {term}'])
+
+        res = self.client().get(f'/api/messages/search?q=private+{term}', headers=other_headers)
+        self.assertEqual(json.loads(res.data)['messages'], [])
+
+class RoomTestCase(AuthenticatedTestCase):
+    """Test case for chat rooms."""
+
+    def test_room_messages_require_membership(self):
+        """Test only members can post to and read a room."""
+        _, owner_headers = self.create_user('room')
+        _, guest_headers = self.create_user('room')
+
+        res = self.client().post('/api/rooms',
+                                 data=json.dumps({'name': 'General'}),
+                                 content_type='application/json',
+                                 headers=owner_headers)
+        self.assertEqual(res.status_code, 201)
+        room_id = json.loads(res.data)['data']['id']
+
+        message = json.dumps({'content': 'Hello room'})
+        res = self.client().post(f'/api/rooms/{room_id}/messages', data=message,
+                                 content_type='application/json', headers=guest_headers)
+        self.assertEqual(res.status_code, 403)
+
+        self.client().post(f'/api/rooms/{room_id}/join', headers=guest_headers)
+        res = self.client().post(f'/api/rooms/{room_id}/messages', data=message,
+                                 content_type='application/json', headers=guest_headers)
+        self.assertEqual(res.status_code, 201)
+
+        res = self.client().get(f'/api/rooms/{room_id}/messages', headers=owner_headers)
+        self.assertEqual([m['content'] for m in json.loads(res.data)['messages']], ['Hello room'])
+
+        self.client().post(f'/api/rooms/{room_id}/leave', headers=guest_headers)
+        res = self.client().get(f'/api/rooms/{room_id}/messages', headers=guest_headers)
+        self.assertEqual(res.status_code, 403)
+
+    def test_invalid_room_fields_are_rejected(self):
+        """Test non-string names and contents and non-integer retention periods are rejected with 400."""
+        _, headers = self.create_user('room')
+        for body in ({'name': 5}, {'name': ['General']}, {'name': '  '},
+                     {'name': 'General', 'retention_days': '30'}, {'name': 'General', 'retention_days': 1.5}):
+            res = self.client().post('/api/rooms', data=json.dumps(body),
+                                     content_type='application/json', headers=headers)
+            self.assertEqual(res.status_code, 400, body)
+            self.assertEqual(json.loads(res.data)['status'], 'error')
+
+        res = self.client().post('/api/rooms', data=json.dumps({'name': 'General'}),
+                                 content_type='application/json', headers=headers)
+        room_id = json.loads(res.data)['data']['id']
+        for body in ({'content': 5}, {'content': None}, {'content': ['Hello']}):
+            res = self.client().post(f'/api/rooms/{room_id}/messages', data=json.dumps(body),
+                                     content_type='application/json', headers=headers)
+            self.assertEqual(res.status_code, 400, body)
+            self.assertEqual(json.loads(res.data)['status'], 'error')
+
+class ConversationTestCase(AuthenticatedTestCase):
+    """Test case for direct conversations."""
+
+    def test_conversation_pages_and_preview(self):
+        """Test conversation listing shows the last message and threads page backwards."""
+        user_id, user_headers = self.create_user('conversation')
+        other_id, other_headers = self.create_user('conversation')
+
+        for i in range(3):
+            self.client().post('/api/messages',
+                               data=json.dumps({'content': f'Message {i}', 'recipient_id': other_id}),
+                               content_type='application/json',
+                               headers=user_headers)
+
+        res = self.client().get('/api/conversations', headers=other_headers)
+        conversations = json.loads(res.data)['conversations']
+        self.assertEqual(len(conversations), 1)
+        self.assertEqual(conversations[0]['user_id'], user_id)
+        self.assertEqual(conversations[0]['last_message']['content'], 'Message 2')
+
+        res = self.client().get(f'/api/conversations/{user_id}?limit=2', headers=other_headers)
+        page = json.loads(res.data)
+        self.assertEqual([m['content'] for m in page['messages']], ['Message 1', 'Message 2'])
+
+        res = self.client().get(f"/api/conversations/{user_id}?limit=2&cursor={page['next_cursor']}",
+                                headers=other_headers)
+        self.assertEqual([m['content'] for m in json.loads(res.data)['messages']], ['Message 0'])
+
+    def test_thread_reaches_messages_stored_without_seq(self):
+        """Test a thread pages back to numbered legacy messages, and pages without sequence numbers get no cursor."""
+        user_id, user_headers = self.create_user('conversation')
+        other_id, _ = self.create_user('conversation')
+        legacy = [{'id': str(uuid.uuid4()), 'user_id': other_id, 'content': f'Legacy {i}',
+                   'timestamp': f'2020-01-01T00:00:0{i}+00:00', 'recipient_id': user_id} for i in range(3)]
+        json_storage.save_messages(legacy + json_storage.get_messages())
+        json_storage.init_storage()
+
+        res = self.client().get(f'/api/conversations/{other_id}?limit=2', headers=user_headers)
+        page = json.loads(res.data)
+        self.assertEqual([m['content'] for m in page['messages']], ['Legacy 1', 'Legacy 2'])
+        res = self.client().get(f"/api/conversations/{other_id}?limit=2&cursor={page['next_cursor']}",
+                                headers=user_headers)
+        self.assertEqual([m['content'] for m in json.loads(res.data)['messages']], ['Legacy 0'])
+
+        with mock.patch('routes.Message.get_conversation', return_value=legacy[:2]):
+            res = self.client().get(f'/api/conversations/{other_id}?limit=2', headers=user_headers)
+        self.assertEqual(res.status_code, 200)
+        self.assertIsNone(json.loads(res.data)['next_cursor'])
+
+class TimelineTestCase(AuthenticatedTestCase):
+    """Test case for inbox timelines."""
+
+    def test_timelines_merge_private_and_public_messages(self):
+        """Test each user sees their private timeline merged with the public one, before and after a rebuild."""
+        sender_id, sender_headers = self.create_user('timeline')
+        recipient_id, recipient_headers = self.create_user('timeline')
+        _, other_headers = self.create_user('timeline')
+
+        self.client().post('/api/messages',
+                           data=json.dumps({'content': 'Public timeline message'}),
+                           content_type='application/json',
+                           headers=sender_headers)
+        self.client().post('/api/messages',
+                           data=json.dumps({'content': 'Private timeline message', 'recipient_id': recipient_id}),
+                           content_type='application/json',
+                           headers=sender_headers)
+
+        for rebuilt in (False, True):
+            if rebuilt:
+                timelines.rebuild()
+
+            for headers in (sender_headers, recipient_headers):
+                res = self.client().get('/api/messages?limit=2', headers=headers)
+                page = json.loads(res.data)
+                self.assertEqual([m['content'] for m in page['messages']],
+                                 ['Public timeline message', 'Private timeline message'])
+                self.assertEqual(page['next_cursor'], page['messages'][0]['seq'])
+
+            res = self.client().get('/api/messages', headers=other_headers)
+            contents = [m['content'] for m in json.loads(res.data)['messages']]
+            self.assertEqual(contents[-1], 'Public timeline message')
+            self.assertNotIn('Private timeline message', contents)
+
+    def test_pages_reach_messages_stored_without_seq(self):
+        """Test paging reaches numbered legacy messages, and pages without sequence numbers get no cursor."""
+        sender_id, _ = self.create_user('timeline')
+        recipient_id, recipient_headers = self.create_user('timeline')
+        legacy = [{'id': str(uuid.uuid4()), 'user_id': sender_id, 'content': f'Legacy {i}',
+                   'timestamp': f'2020-01-01T00:00:0{i}+00:00', 'recipient_id': recipient_id} for i in range(3)]
+        json_storage.save_messages(legacy + json_storage.get_messages())
+        json_storage.init_storage()
+
+        seen, cursor = [], None
+        while True:
+            res = self.client().get(f"/api/messages?limit=5{f'&cursor={cursor}' if cursor else ''}",
+                                    headers=recipient_headers)
+            page = json.loads(res.data)
+            seen = [m['id'] for m in page['messages']] + seen
+            cursor = page['next_cursor']
+            if cursor is None:
+                break
+        self.assertEqual([i for i in seen if i in {m['id'] for m in legacy}], [m['id'] for m in legacy])
+
+        with mock.patch('routes.Message.get_viewable_by_user', return_value=legacy[:2]):
+            res = self.client().get('/api/messages?limit=2', headers=recipient_headers)
+        self.assertEqual(res.status_code, 200)
+        self.assertIsNone(json.loads(res.data)['next_cursor'])
+
+class UnreadTestCase(AuthenticatedTestCase):
+    """Test case for unread counters and read markers."""
+
+    def send(self, headers, content, recipient_id=None):
+        """Send a message and return it."""
+        res = self.client().post('/api/messages',
+                                 data=json.dumps({'content': content, 'recipient_id': recipient_id}),
+                                 content_type='application/json',
+                                 headers=headers)
+        return json.loads(res.data)['data']
+
+    def unread(self, headers):
+        """Get the unread counts of a user."""
+        return json.loads(self.client().get('/api/unread', headers=headers).data)['data']
+
+    def test_unread_counts_follow_messages_and_markers(self):
+        """Test unread counts change with sends, deletes and read markers."""
+        sender_id, sender_headers = self.create_user('unread')
+        recipient_id, recipient_headers = self.create_user('unread')
+
+        first = self.send(sender_headers, 'First unread', recipient_id)
+        self.send(sender_headers, 'Second unread', recipient_id)
+        self.assertEqual(self.unread(recipient_headers)['conversations'], {sender_id: 2})
+        self.assertEqual(self.unread(sender_headers)['conversations'], {})
+
+        res = self.client().post('/api/messages/read',
+                                 data=json.dumps({'cursor': first['seq'], 'user_id': sender_id}),
+                                 content_type='application/json',
+                                 headers=recipient_headers)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(json.loads(res.data)['data']['conversations'], {sender_id: 1})
+
+        third = self.send(sender_headers, 'Third unread', recipient_id)
+        self.assertEqual(self.unread(recipient_headers)['conversations'], {sender_id: 2})
+        self.client().delete(f"/api/messages/{third['id']}", headers=sender_headers)
+        self.assertEqual(self.unread(recipient_headers)['conversations'], {sender_id: 1})
+
+        public = self.send(sender_headers, 'Public unread')
+        self.assertGreaterEqual(self.unread(recipient_headers)['public'], 1)
+        self.client().post('/api/messages/read',
+                           data=json.dumps({'cursor': public['seq']}),
+                           content_type='application/json',
+                           headers=recipient_headers)
+        self.assertEqual(self.unread(recipient_headers), {'total': 0, 'public': 0, 'conversations': {}})
+
+        res = self.client().post('/api/messages/read',
+                                 data=json.dumps({'cursor': 'latest'}),
+                                 content_type='application/json',
+                                 headers=recipient_headers)
+        self.assertEqual(res.status_code, 400)
+
+    def test_mark_read_rejects_invalid_user_id(self):
+        """Test read markers are only set for conversations with existing users."""
+        _, headers = self.create_user('unread')
+        for user_id in ({'id': 'x'}, ['x'], 5, 'no-such-user'):
+            res = self.client().post('/api/messages/read',
+                                     data=json.dumps({'cursor': 1, 'user_id': user_id}),
+                                     content_type='application/json',
+                                     headers=headers)
+            self.assertEqual(res.status_code, 400, user_id)
+
+class RetentionTestCase(AuthenticatedTestCase):
+    """Test case for message retention."""
+
+    def test_room_retention_archives_oldest_messages(self):
+        """Test room messages beyond the retention count are archived and removed."""
+        _, headers = self.create_user('retention')
+        res = self.client().post('/api/rooms',
+                                 data=json.dumps({'name': 'Retention room'}),
+                                 content_type='application/json',
+                                 headers=headers)
+        room_id = json.loads(res.data)['data']['id']
+        for i in range(3):
+            self.client().post(f'/api/rooms/{room_id}/messages',
+                               data=json.dumps({'content': f'Retained {i}'}),
+                               content_type='application/json',
+                               headers=headers)
+
+        with mock.patch.object(retention, 'ROOM_MESSAGE_RETENTION_COUNT', 1):
+            retention.apply_retention()
+
+        res = self.client().get(f'/api/rooms/{room_id}/messages', headers=headers)
+        self.assertEqual([m['content'] for m in json.loads(res.data)['messages']], ['Retained 2'])
+
+        archive_dir = os.path.join(retention.ARCHIVE_DIR, 'rooms', room_id)
+        archived = [m for name in sorted(os.listdir(archive_dir))
+                    for m in retention.read_segment(os.path.join(archive_dir, name))]
+        self.assertEqual([m['content'] for m in archived], ['Retained 0', 'Retained 1'])
+
+class AttachmentTestCase(AuthenticatedTestCase):
+    """Test case for attachments."""
+
+    def upload(self, headers, content):
+        """Upload an attachment and return the response."""
+        return self.client().post('/api/attachments', data=content, content_type='text/plain', headers=headers)
+
+    def test_attachments_are_deduplicated_and_served_with_ranges(self):
+        """Test identical uploads share one blob and only viewers of a referencing message can download it."""
+        _, sender_headers = self.create_user('attachment')
+        recipient_id, recipient_headers = self.create_user('attachment')
+        _, other_headers = self.create_user('attachment')
+        content = f'attachment {uuid.uuid4().hex}'.encode('utf-8')
+
+        res = self.upload(sender_headers, content)
+        self.assertEqual(res.status_code, 201)
+        attachment_hash = json.loads(res.data)['data']['hash']
+        res = self.upload(other_headers, content)
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(json.loads(res.data)['data']['hash'], attachment_hash)
+
+        res = self.client().get(f'/api/attachments/{attachment_hash}', headers=recipient_headers)
+        self.assertEqual(res.status_code, 404)
+
+        res = self.client().post('/api/messages',
+                                 data=json.dumps({'content': 'See attached', 'recipient_id': recipient_id,
+                                                  'attachments': [attachment_hash]}),
+                                 content_type='application/json',
+                                 headers=sender_headers)
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(json.loads(res.data)['data']['attachments'][0]['hash'], attachment_hash)
+
+        res = self.client().get(f'/api/attachments/{attachment_hash}', headers=recipient_headers)
+        self.assertEqual(res.data, content)
+        self.assertEqual(res.headers['X-Content-Type-Options'], 'nosniff')
+        res.close()
+        res = self.client().get(f'/api/attachments/{attachment_hash}',
+                                headers=dict(recipient_headers, Range='bytes=0-9'))
+        self.assertEqual(res.status_code, 206)
+        self.assertEqual(res.data, content[:10])
+        res.close()
+
+    def test_unsafe_types_are_downloaded_and_unreferenced_blobs_deleted(self):
+        """Test active content is sent as a download, and deleting its last message deletes the attachment."""
+        _, headers = self.create_user('attachment')
+        res = self.client().post('/api/attachments', data=f'<script>{uuid.uuid4().hex}</script>',
+                                 content_type='text/html', headers=headers)
+        attachment_hash = json.loads(res.data)['data']['hash']
+        res = self.client().post('/api/messages',
+                                 data=json.dumps({'content': 'Page', 'attachments': [attachment_hash]}),
+                                 content_type='application/json', headers=headers)
+        message_id = json.loads(res.data)['data']['id']
+
+        res = self.client().get(f'/api/attachments/{attachment_hash}', headers=headers)
+        self.assertEqual(res.mimetype, 'application/octet-stream')
+        self.assertTrue(res.headers['Content-Disposition'].startswith('attachment'))
+        res.close()
+
+        path = Attachment.get_by_hash(attachment_hash).path
+        self.client().delete(f'/api/messages/{message_id}', headers=headers)
+        self.assertIsNone(json_storage.get_attachment(attachment_hash))
+        self.assertFalse(os.path.exists(path))
+        res = self.client().get(f'/api/attachments/{attachment_hash}', headers=headers)
+        self.assertEqual(res.status_code, 404)
+
+    def test_deleting_a_message_keeps_attachments_other_users_uploaded(self):
+        """Test deleting a message keeps its attachment while another uploader still holds it."""
+        _, sender_headers = self.create_user('attachment')
+        _, other_headers = self.create_user('attachment')
+        content = uuid.uuid4().hex
+        hashes = []
+        for headers in (sender_headers, other_headers):
+            res = self.client().post('/api/attachments', data=content, content_type='text/plain', headers=headers)
+            hashes.append(json.loads(res.data)['data']['hash'])
+        self.assertEqual(hashes[0], hashes[1])
+        res = self.client().post('/api/messages',
+                                 data=json.dumps({'content': 'Shared', 'attachments': [hashes[0]]}),
+                                 content_type='application/json', headers=sender_headers)
+        message_id = json.loads(res.data)['data']['id']
+
+        self.client().delete(f'/api/messages/{message_id}', headers=sender_headers)
+        res = self.client().get(f'/api/attachments/{hashes[0]}', headers=other_headers)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.data, content.encode())
+        res.close()
+        res = self.client().post('/api/messages',
+                                 data=json.dumps({'content': 'Shared again', 'attachments': [hashes[0]]}),
+                                 content_type='application/json', headers=other_headers)
+        self.assertEqual(res.status_code, 201)
+
+    def test_attachment_removed_before_message_is_stored(self):
+        """Test a message is rejected, and not stored, if its attachment is removed after validation."""
+        _, headers = self.create_user('attachment')
+        res = self.client().post('/api/attachments', data=uuid.uuid4().hex, content_type='text/plain',
+                                 headers=headers)
+        attachment_hash = json.loads(res.data)['data']['hash']
+        attachment = Attachment.get_by_hash(attachment_hash)
+        json_storage.remove_attachment_references([attachment_hash], 'none', attachment.uploaded_by[0])
+
+        content = f'Orphan {uuid.uuid4().hex}'
+        with mock.patch.object(Attachment, 'get_by_hash', return_value=attachment):
+            res = self.client().post('/api/messages',
+                                     data=json.dumps({'content': content, 'attachments': [attachment_hash]}),
+                                     content_type='application/json', headers=headers)
+        self.assertEqual(res.status_code, 404)
+        self.assertFalse(any(message['content'] == content for message in json_storage.get_messages()))
+
+class BatchTestCase(AuthenticatedTestCase):
+    """Test case for batch message creation."""
+
+    def test_batch_stores_valid_messages_and_reports_invalid_ones(self):
+        """Test a batch stores its valid messages in order and reports each invalid one."""
+        _, sender_headers = self.create_user('batch')
+        recipient_id, recipient_headers = self.create_user('batch')
+
+        res = self.client().post('/api/messages/batch',
+                                 data=json.dumps({'messages': [
+                                     {'content': 'Batch public'},
+                                     {'content': 'Batch private', 'recipient_id': recipient_id},
+                                     {'content': 'Batch lost', 'recipient_id': 'no-such-user'},
+                                     {'recipient_id': recipient_id}
+                                 ]}),
+                                 content_type='application/json',
+                                 headers=sender_headers)
+        self.assertEqual(res.status_code, 201)
+        data = json.loads(res.data)['data']
+        self.assertEqual((data['created'], data['failed']), (2, 2))
+        self.assertEqual([r['status'] for r in data['results']], ['success', 'success', 'error', 'error'])
+        self.assertEqual(data['results'][1]['data']['seq'], data['results'][0]['data']['seq'] + 1)
+
+        res = self.client().get('/api/messages?limit=2', headers=recipient_headers)
+        self.assertEqual([m['content'] for m in json.loads(res.data)['messages']], ['Batch public', 'Batch private'])
+
+class BatchFetchTestCase(AuthenticatedTestCase):
+    """Test case for fetching messages by ID."""
+
+    def test_fetch_reports_unknown_and_forbidden_ids(self):
+        """Test a batch fetch returns viewable messages in order and reports the others."""
+        _, sender_headers = self.create_user('fetch')
+        recipient_id, _ = self.create_user('fetch')
+        _, other_headers = self.create_user('fetch')
+
+        ids = []
+        for content, recipient in (('Fetch public', None), ('Fetch private', recipient_id)):
+            res = self.client().post('/api/messages',
+                                     data=json.dumps({'content': content, 'recipient_id': recipient}),
+                                     content_type='application/json',
+                                     headers=sender_headers)
+            ids.append(json.loads(res.data)['data']['id'])
+
+        res = self.client().get(f"/api/messages?ids={ids[1]},{ids[0]},missing", headers=sender_headers)
+        data = json.loads(res.data)
+        self.assertEqual([m['content'] for m in data['messages']], ['Fetch private', 'Fetch public'])
+        self.assertEqual(data['not_found'], ['missing'])
+
+        res = self.client().post('/api/messages/fetch',
+                                 data=json.dumps({'ids': ids}),
+                                 content_type='application/json',
+                                 headers=other_headers)
+        data = json.loads(res.data)
+        self.assertEqual([m['id'] for m in data['messages']], [ids[0]])
+        self.assertEqual(data['forbidden'], [ids[1]])
+
+class FragmentCacheTestCase(AuthenticatedTestCase):
+    """Test case for serving message lists from cached JSON fragments."""
+
+    def test_lists_match_to_dict_after_delete_and_add(self):
+        """Test lists built from cached fragments match Message.to_dict as messages are deleted and added."""
+        _, headers = self.create_user('fragment')
+        ids = []
+        for i in range(3):
+            res = self.client().post('/api/messages', data=json.dumps({'content': f'Fragment {i}'}),
+                                     content_type='application/json', headers=headers)
+            ids.append(json.loads(res.data)['data']['id'])
+
+        def listed():
+            res = self.client().get('/api/messages/me', headers=headers)
+            return json.loads(res.data)['messages']
+
+        first = listed()
+        hits = json_storage._fragment_cache.hits
+        self.assertEqual(listed(), first)
+        self.assertGreaterEqual(json_storage._fragment_cache.hits, hits + 3)
+
+        self.client().delete(f'/api/messages/{ids[0]}', headers=headers)
+        res = self.client().post('/api/messages', data=json.dumps({'content': 'Fragment 3'}),
+                                 content_type='application/json', headers=headers)
+        ids = ids[1:] + [json.loads(res.data)['data']['id']]
+
+        messages = listed()
+        self.assertEqual([m['id'] for m in messages], ids)
+        for message in messages:
+            expected = Message.get_by_id(message['id']).to_dict()
+            self.assertEqual(list(message), sorted(expected))
+            self.assertEqual(message, expected)
+
+class FieldsTestCase(AuthenticatedTestCase):
+    """Test case for selecting message fields."""
+
+    def test_fields_select_message_keys(self):
+        """Test the fields parameter limits the keys of each message and rejects unknown fields."""
+        _, headers = self.create_user('fields')
+        recipient_id, _ = self.create_user('fields')
+        res = self.client().post('/api/messages',
+                                 data=json.dumps({'content': 'Fields message', 'recipient_id': recipient_id}),
+                                 content_type='application/json',
+                                 headers=headers)
+        message_id = json.loads(res.data)['data']['id']
+
+        res = self.client().get('/api/messages?fields=id,content', headers=headers)
+        self.assertEqual(res.status_code, 200)
+        messages = json.loads(res.data)['messages']
+        self.assertIn({'id': message_id, 'content': 'Fields message'}, messages)
+        self.assertTrue(all(set(m) == {'id', 'content'} for m in messages))
+
+        res = self.client().get(f'/api/messages/{message_id}?fields=recipient_username', headers=headers)
+        data = json.loads(res.data)['data']
+        self.assertEqual(list(data), ['recipient_username'])
+        self.assertTrue(data['recipient_username'].startswith('fields'))
+
+        res = self.client().get('/api/messages?fields=id,password', headers=headers)
+        self.assertEqual(res.status_code, 400)
+
+class LoadTestTestCase(unittest.TestCase):
+    """Test case for the load-testing harness."""
+
+    def test_in_process_run_reports_endpoints(self):
+        """Test a closed-loop run against the app in-process reports every operation and endpoint."""
+        report = loadtest.run_load_test(app=create_app('testing'), users=2, total_requests=20, seed=1,
+                                        mix=loadtest.parse_mix('post=1,list=1'))
+
+        self.assertEqual(report['total']['count'], 20)
+        self.assertEqual(report['total']['errors'], 0)
+        self.assertEqual(set(report['operations']), {'post', 'list'})
+        self.assertIn('POST /api/messages', report['endpoints'])
+        self.assertLessEqual(report['endpoints']['GET /api/messages']['p50_ms'],
+                             report['endpoints']['GET /api/messages']['p99_ms'])
+
+        with self.assertRaises(ValueError):
+            loadtest.parse_mix('post=1,delete=1')
+
+class SoakTestCase(unittest.TestCase):
+    """Test case for the soak-test runner."""
+
+    def test_in_process_soak_samples_every_interval(self):
+        """Test a short in-process soak reuses its users and samples resources every interval."""
+        samples = []
+        report = soak.run_soak(app=create_app('testing'), users=2, duration=0.9, interval=0.3, warmup=0,
+                               mix=loadtest.parse_mix('post=1,list=1'), seed=1,
+                               on_sample=lambda report: samples.append(len(report['samples'])))
+
+        self.assertGreaterEqual(len(report['samples']), 2)
+        self.assertEqual(samples, list(range(1, len(report['samples']) + 1)))
+        self.assertEqual(report['config']['pid'], os.getpid())
+        self.assertEqual(sum(sample['load']['errors'] for sample in report['samples']), 0)
+        self.assertIsNotNone(report['samples'][-1]['process']['rss_bytes'])
+        self.assertIn('data.total', report['series'])
+        self.assertIn('latency.POST /api/messages.p95_ms', report['series'])
+
+    def test_analyze_flags_growing_series(self):
+        """Test a series growing faster than its limit is flagged, and warm-up growth is ignored."""
+        samples = [{
+            'time': t * 600,
+            'process': {'rss_bytes': 1000 if t else 100, 'open_fds': 10 + t},
+            'data': {'tokens.json': 100},
+            'load': {'throughput': 5.0 + t, 'errors': 0},
+            'endpoints': {}
+        } for t in range(6)]
+
+        series = soak.analyze(samples, max_growth=5.0, limits={'data.tokens.json': 0}, warmup=600)
+        self.assertTrue(series['open_fds']['flagged'])
+        self.assertFalse(series['rss_bytes']['flagged'])
+        self.assertEqual(series['rss_bytes']['first'], 100)
+        self.assertFalse(series['data.tokens.json']['flagged'])
+        self.assertFalse(series['throughput']['flagged'])
+        self.assertEqual(soak.parse_limits('rss_bytes=2'), {'rss_bytes': 2.0})
+
+class _AsyncTestResponse:
+    """The parts of an aiohttp response that AsyncChatAPIClient uses, for a Flask test response."""
+
+    def __init__(self, response):
+        self.status = response.status_code
+        self.body = response.get_data(as_text=True)
+
+    async def json(self, content_type=None):
+        return json.loads(self.body)
+
+    async def text(self):
+        return self.body
+
+
+class _AsyncTestSession:
+    """Session with the interface of an aiohttp session that sends requests to an app's test client."""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+        self.requests = []
+
+    def request(self, method, url, headers=None, json=None, params=None, data=None):
+        path = url.split('http://test', 1)[1]
+        self.requests.append((method, path))
+        return self._open(method, path, headers, json, params, data)
+
+    @contextlib.asynccontextmanager
+    async def _open(self, method, path, headers, json, params, data):
+        # Yield first, so concurrent requests are all in flight before any completes
+        await asyncio.sleep(0)
+        yield _AsyncTestResponse(self.client.open(path, method=method, headers=headers, json=json,
+                                                  query_string=params, data=data))
+
+    async def close(self):
+        pass
+
+
+class AsyncClientTestCase(AuthenticatedTestCase):
+    """Test case for the asyncio client."""
+
+    def test_concurrent_requests_share_one_refresh(self):
+        """Test concurrent requests with a due access token trigger a single refresh."""
+        credentials = self.register('async')
+        session = _AsyncTestSession(self.app)
+
+        async def run():
+            client = AsyncChatAPIClient(base_url='http://test', session=session)
+            self.assertTrue(await client.login(credentials['username'], credentials['password']))
+            self.assertIsNotNone(client.refresh_at)
+
+            client.refresh_at = 1
+            results = await asyncio.gather(*(client.get_unread() for _ in range(1000)))
+            self.assertTrue(all(result is not None for result in results))
+            self.assertGreater(client.refresh_at, time.time())
+
+        asyncio.run(run())
+        self.assertEqual(session.requests.count(('POST', '/api/auth/refresh')), 1)
+
+class BenchmarkTestCase(unittest.TestCase):
+    """Test case for the benchmark suite's compare mode."""
+
+    def test_compare_flags_regressions_over_threshold(self):
+        """Test only benchmarks slower than the threshold, beyond timer noise, are regressions."""
+        baseline = {'results': {'1000': {
+            'slower': {'median_ms': 1.0},
+            'within': {'median_ms': 1.0},
+            'noise': {'median_ms': 0.001},
+            'removed': {'median_ms': 1.0}
+        }}}
+        current = {'results': {'1000': {
+            'slower': {'median_ms': 1.5},
+            'within': {'median_ms': 1.1},
+            'noise': {'median_ms': 0.005},
+            'added': {'median_ms': 1.0}
+        }}}
+
+        rows = {row['name']: row for row in benchmark.compare(baseline, current, threshold=0.2)}
+        self.assertEqual(set(rows), {'slower', 'within', 'noise'})
+        self.assertTrue(rows['slower']['regression'])
+        self.assertFalse(rows['within']['regression'])
+        self.assertFalse(rows['noise']['regression'])
+
+class ModelHydrationTestCase(unittest.TestCase):
+    """Test case for the slotted models and their bulk hydration."""
+
+    def test_from_dicts_round_trips_timestamps(self):
+        """Test bulk-hydrated models keep stored timestamps and read them as epoch microseconds."""
+        stored = [{'id': f'm{i}', 'user_id': 'u1', 'content': 'hello', 'seq': i,
+                   'timestamp': f'2024-05-01T12:00:0{i}.00012{i}+00:00'} for i in range(3)]
+        messages = Message.from_dicts(stored)
+
+        self.assertFalse(hasattr(messages[0], '__dict__'))
+        self.assertEqual([m.to_dict(users={})['timestamp'] for m in messages], [m['timestamp'] for m in stored])
+        expected = datetime(2024, 5, 1, 12, 0, 1, 121, tzinfo=timezone.utc)
+        self.assertEqual(messages[1].timestamp, int(expected.timestamp()) * 1000000 + 121)
+        self.assertEqual(messages[1].to_dict(users={})['timestamp'], stored[1]['timestamp'])
+        self.assertEqual(format_timestamp(messages[1].timestamp), expected.isoformat())
+
+        user_dict = {'id': 'u1', 'username': 'alice', 'password_hash': 'x', 'email': None,
+                     'created_at': '2024-05-01T12:00:00+00:00'}
+        self.assertEqual(User.from_dicts([user_dict])[0].to_dict(), user_dict)
+
+    def test_new_models_use_epoch_microseconds(self):
+        """Test new models hold integer timestamps and convert them to ISO strings in to_dict."""
+        message = Message('u1', 'hello')
+        self.assertIsInstance(message.timestamp, int)
+        self.assertEqual(datetime.fromisoformat(message.to_dict(users={})['timestamp']).tzinfo, timezone.utc)
+
+        active = RefreshToken.from_dicts([RefreshToken('u1', expires_days=1).to_dict()])[0]
+        expired = RefreshToken.from_dict(RefreshToken('u1', expires_days=-1).to_dict())
+        self.assertFalse(active.is_expired())
+        self.assertTrue(expired.is_expired())
+        self.assertEqual(active.expires_at - active.created_at, 86400 * 1000000)
+
+class BulkLoadTestCase(AuthenticatedTestCase):
+    """Test case for the bulk data loader."""
+
+    def test_loaded_users_and_messages_are_usable(self):
+        """Test bulk-loaded users can log in and see bulk-loaded messages through the indexes."""
+        users = list(init_db.synthetic_users(3, 'seedpass123', prefix='seed'))
+        content = f'seeded {uuid.uuid4().hex}'
+
+        def messages(by_id, by_username):
+            record = {'user_id': users[0]['id'], 'content': content, 'recipient_username': users[1]['username']}
+            return init_db.messages_from_records([(1, record)], by_id, by_username)
+
+        counts = init_db.load(users, messages)
+        self.assertEqual((counts['users'], counts['messages']), (3, 1))
+
+        session = self.login({'username': users[1]['username'], 'password': 'seedpass123'})
+        headers = {'Authorization': f"Bearer {session['access_token']}"}
+        res = self.client().get(f"/api/messages/search?q={content.split()[1]}", headers=headers)
+        self.assertEqual([m['content'] for m in json.loads(res.data)['messages']], [content])
+
+        with self.assertRaises(ValueError):
+            init_db.load([dict(users[0], id=str(uuid.uuid4()))])
+
+    def test_invalid_records_are_rejected(self):
+        """Test duplicate ids and invalid timestamps are rejected, and timestamps are stored in UTC."""
+        sender_id, _ = self.create_user('import')
+        user = {'username': f'import_{uuid.uuid4().hex[:8]}', 'password_hash': 'x'}
+        records = [(1, dict(user, created_at='2024-05-01T14:00:00+02:00'))]
+        self.assertEqual(next(init_db.users_from_records(records))['created_at'], '2024-05-01T12:00:00+00:00')
+
+        invalid = [
+            [(1, dict(user, created_at='2024-05-01T12:00:00'))],
+            [(1, dict(user, created_at='yesterday'))],
+            [(1, dict(user, id='dup')), (2, dict(user, username='other', id='dup'))],
+            [(1, dict(user, id=sender_id))],
+        ]
+        for records in invalid:
+            with self.assertRaises(ValueError):
+                list(init_db.users_from_records(records))
+
+        by_id = {sender_id: 'sender'}
+        message = {'user_id': sender_id, 'content': 'Imported'}
+        for records in ([(1, dict(message, timestamp='2024-05-01 12:00'))],
+                        [(1, dict(message, id='m')), (2, dict(message, id='m'))]):
+            with self.assertRaises(ValueError):
+                list(init_db.messages_from_records(records, by_id, {}))
+
+class ServerTimingTestCase(AuthenticatedTestCase):
+    """Test case for the Server-Timing header."""
+
+    def test_sampled_responses_report_spans(self):
+        """Test sampled responses time the auth, storage, model and serialization spans, and others are not timed."""
+        _, headers = self.create_user('timing')
+
+        sampled = functools.partial(timing.start_request, 1)
+        with mock.patch.object(timing, 'start_request', sampled):
+            res = self.client().get('/api/messages', headers=headers)
+        names = [part.split(';')[0] for part in res.headers['Server-Timing'].split(', ')]
+        for name in ('auth.jwt', 'auth.user', 'storage.get_user_by_id', 'model.Message.get_viewable_by_user',
+                     'serialize'):
+            self.assertIn(name, names)
+        self.assertEqual(names[-1], 'total')
+
+        unsampled = functools.partial(timing.start_request, 0)
+        with mock.patch.object(timing, 'start_request', unsampled):
+            res = self.client().get('/api/messages', headers=headers)
+        self.assertNotIn('Server-Timing', res.headers)
+
+class MetricsTestCase(AuthenticatedTestCase):
+    """Test case for the metrics endpoint."""
+
+    def test_metrics_add_up_every_process(self):
+        """Test /metrics reports requests, storage and gauges, summed with the snapshots of running processes."""
+        self.assertEqual(self.client().get('/metrics').status_code, 404)
+
+        # Metrics are off by default, so serve them from an app of their own
+        self.app = create_app('testing')
+        metrics.init_app(self.app)
+        self.client = self.app.test_client
+        _, headers = self.create_user('metrics')
+        self.client().get('/api/messages', headers=headers)
+
+        exited = subprocess.Popen([sys.executable, '-c', 'pass'])
+        exited.wait()
+        os.makedirs(metrics.METRICS_DIR, exist_ok=True)
+        snapshots = {}
+        for name, pid, count in (('other-worker', os.getpid(), 5), ('exited-worker', exited.pid, 7)):
+            snapshots[name] = os.path.join(metrics.METRICS_DIR, f'{name}.json')
+            with open(snapshots[name], 'w') as f:
+                json.dump({'pid': pid, 'time': time.time(), 'histograms': [], 'counters': [
+                    ['chat_requests_total', [['route', f'/{name}'], ['method', 'GET'], ['status', '200']], count]
+                ]}, f)
+        try:
+            res = self.client().get('/metrics')
+        finally:
+            os.remove(snapshots['other-worker'])
+
+        self.assertEqual(res.status_code, 200)
+        self.assertFalse(os.path.exists(snapshots['exited-worker']))
+        lines = res.data.decode().splitlines()
+        self.assertIn('chat_requests_total{route="/other-worker",method="GET",status="200"} 5', lines)
+        self.assertFalse(any('/exited-worker' in line for line in lines))
+        self.assertIn('# TYPE chat_request_duration_seconds histogram', lines)
+        for prefix in ('chat_requests_total{route="/api/messages",method="GET",status="200"}',
+                       'chat_request_duration_seconds_count{route="/api/messages",method="GET"}',
+                       'chat_storage_reads_total{file="users"}', 'chat_data_file_bytes{file="messages"}',
+                       'chat_cache_hit_ratio{cache="messages"}', 'chat_active_refresh_tokens'):
+            self.assertTrue(any(line.startswith(prefix + ' ') for line in lines), prefix)
+
+    def test_threads_do_not_pile_up_and_disabled_metrics_record_nothing(self):
+        """Test exited threads' tables are retired as new threads record, and nothing is recorded when disabled."""
+        with mock.patch.object(metrics, '_enabled', True):
+            for _ in range(20):
+                thread = threading.Thread(target=metrics.inc, args=('chat_metrics_test_total',))
+                thread.start()
+                thread.join()
+            self.assertLessEqual(sum(1 for thread, _ in metrics._tables if not thread.is_alive()), 1)
+            counters = {name: value for name, _, value in metrics.snapshot()['counters']}
+            self.assertEqual(counters['chat_metrics_test_total'], 20)
+
+        with mock.patch.object(metrics, '_enabled', False):
+            thread = threading.Thread(target=metrics.inc, args=('chat_metrics_test_total',))
+            thread.start()
+            thread.join()
+            self.assertFalse(any(registered is thread for registered, _ in metrics._tables))
+            counters = {name: value for name, _, value in metrics.snapshot()['counters']}
+            self.assertEqual(counters['chat_metrics_test_total'], 20)
+
+class ProfilerTestCase(AuthenticatedTestCase):
+    """Test case for the request profiler and its admin endpoints."""
+
+    def test_sampled_and_slow_requests_are_profiled(self):
+        """Test sampled requests are kept as cProfile profiles and slow ones as sampled stacks, for admins only."""
+        profiler.init_app(self.app, slow_ms=0, sample_rate=1.0)
+        slow_app = create_app('testing')
+        profiler.init_app(slow_app, slow_ms=20, sample_rate=0, interval_ms=1)
+
+        @slow_app.route('/slow')
+        def slow():
+            time.sleep(0.1)
+            return 'done'
+
+        credentials = self.register('profiler')
+        session = self.login(credentials)
+        headers = {'Authorization': f"Bearer {session['access_token']}"}
+        self.client().get('/api/messages', headers=headers)
+        slow_app.test_client().get('/slow')
+
+        res = self.client().get('/api/admin/profiles', headers=headers)
+        self.assertEqual(res.status_code, 403)
+
+        with mock.patch.object(auth, 'ADMIN_USERNAMES', {credentials['username']}):
+            profiles = json.loads(self.client().get('/api/admin/profiles', headers=headers).data)['data']
+            sampled = next(p for p in profiles if p['route'] == '/api/messages')
+            self.assertEqual((sampled['kind'], sampled['user_id']), ('cprofile', session['user']['id']))
+            self.assertIn('messages', sampled['storage'])
+            slowest = next(p for p in profiles if p['route'] == '/slow')
+            self.assertEqual((slowest['kind'], slowest['reason']), ('stacks', 'slow'))
+
+            res = self.client().get(f"/api/admin/profiles/{sampled['id']}/download", headers=headers)
+            self.assertEqual(res.status_code, 200)
+            path = os.path.join(profiler.PROFILE_DIR, 'download.prof')
+            with open(path, 'wb') as f:
+                f.write(res.data)
+            res.close()
+            self.assertGreater(pstats.Stats(path).total_calls, 0)
+            os.remove(path)
+
+            res = self.client().get(f"/api/admin/profiles/{slowest['id']}/download", headers=headers)
+            self.assertIn(b'slow (test_api.py:', res.data)
+            res.close()
+
+class MemoryTestCase(AuthenticatedTestCase):
+    """Test case for the memory report and tracemalloc snapshots."""
+
+    def tearDown(self):
+        tracemalloc.stop()
+
+    def test_report_and_compare_snapshots(self):
+        """Test admins get a memory report, and can take two snapshots and see what grew between them."""
+        credentials = self.register('memory')
+        headers = {'Authorization': f"Bearer {self.login(credentials)['access_token']}"}
+        self.client().post('/api/messages', data=json.dumps({'content': 'Memory message'}),
+                           content_type='application/json', headers=headers)
+
+        res = self.client().get('/api/admin/memory', headers=headers)
+        self.assertEqual(res.status_code, 403)
+
+        with mock.patch.object(auth, 'ADMIN_USERNAMES', {credentials['username']}):
+            report = json.loads(self.client().get('/api/admin/memory', headers=headers).data)['data']
+            self.assertGreater(report['collections']['store.messages']['items'], 0)
+            self.assertGreater(report['collections']['store.messages']['bytes'], 0)
+            self.assertIn('index.search_index', report['collections'])
+            self.assertIn('Message', report['models'])
+
+            res = self.client().post('/api/admin/memory/snapshots', headers=headers)
+            self.assertEqual(res.status_code, 201)
+            first = json.loads(res.data)['data']['id']
+            grown = [bytearray(1000) for _ in range(1000)]
+            second = json.loads(self.client().post('/api/admin/memory/snapshots', headers=headers).data)['data']['id']
+
+            res = self.client().get(f'/api/admin/memory/snapshots/{second}?compare={first}&limit=5', headers=headers)
+            largest = json.loads(res.data)['data']['statistics'][0]
+            self.assertGreaterEqual(largest['bytes_diff'], 1000 * 1000)
+            self.assertTrue(largest['traceback'][0].startswith(__file__))
+            del grown
+
+            res = self.client().get(f'/api/admin/memory/snapshots/{second}?group_by=module', headers=headers)
+            self.assertEqual(res.status_code, 400)
+
+            res = self.client().delete('/api/admin/memory/snapshots', headers=headers)
+            self.assertEqual(json.loads(res.data)['data']['stopped'], True)
+            self.assertFalse(tracemalloc.is_tracing())
+            ids = [snapshot['id'] for snapshot in
+                   json.loads(self.client().get('/api/admin/memory/snapshots', headers=headers).data)['data']]
+            self.assertNotIn(first, ids)
+            self.assertNotIn(second, ids)
+
 if __name__ == '__main__':
     unittest.main()
@@ -22,15 +22,30 @@ from datetime import datetime
 class ChatAPIClient:
     """Client for interacting with the 0xC Chat API."""
 
-    def __init__(self, base_url="http://localhost:5000", api_key=None):
-        """Initialize the client with the API base URL and optional API key."""
+    def __init__(self, base_url="http://localhost:5000", api_key=None, session=None, verbose=True):
+        """Initialize the client with the API base URL and optional API key.
+
+        Args:
+            base_url: The base URL of the API
+            api_key: The API key, if SECRET_KEY_ENABLED=1
+            session: The requests session to send requests with; a new one by
+                default, which keeps connections to the API alive between requests
+            verbose: Print the progress of each request
+        """
         self.base_url = base_url
         self.api_key = api_key
+        self.session = session if session is not None else requests.Session()
+        self.verbose = verbose
         self.access_token = None
         self.refresh_token = None
         self.user_info = None
         self.refresh_at = None
 
+    def _log(self, message):
+        """Print a progress message if the client is verbose."""
+        if self.verbose:
+            print(message)
+
     def _get_headers(self, include_auth=False):
         """Get headers for API requests."""
         headers = {"Content-Type": "application/json"}
@@ -51,17 +66,17 @@ class ChatAPIClient:
             data = response.json()
 
             if response.status_code >= 400:
-                print(f"Error: {data.get('message', 'Unknown error')}")
+                self._log(f"Error: {data.get('message', 'Unknown error')}")
                 return None
 
             return data
         except json.JSONDecodeError:
-            print(f"Error: Invalid JSON response - {response.text}")
+            self._log(f"Error: Invalid JSON response - {response.text}")
             return None
 
     def register(self, username, password, email=None):
         """Register a new user."""
-        print(f"\n=== Registering user: {username} ===")
+        self._log(f"\n=== Registering user: {username} ===")
 
         payload = {
             "username": username,
@@ -71,7 +86,7 @@ class ChatAPIClient:
         if email:
             payload["email"] = email
 
-        response = requests.post(
+        response = self.session.post(
             f"{self.base_url}/api/auth/register",
             headers=self._get_headers(),
             json=payload
@@ -79,21 +94,21 @@ class ChatAPIClient:
 
         data = self._handle_response(response)
         if data and data.get("status") == "success":
-            print(f"User registered successfully: {username}")
+            self._log(f"User registered successfully: {username}")
             return True
 
         return False
 
     def login(self, username, password):
         """Login and get access and refresh tokens."""
-        print(f"\n=== Logging in as: {username} ===")
+        self._log(f"\n=== Logging in as: {username} ===")
 
         payload = {
             "username": username,
             "password": password
         }
 
-        response = requests.post(
+        response = self.session.post(
             f"{self.base_url}/api/auth/login",
             headers=self._get_headers(),
             json=payload
@@ -108,8 +123,8 @@ class ChatAPIClient:
             # Get token info to know when to refresh
             self.get_token_info()
 
-            print(f"Logged in successfully as: {username}")
-            print(f"User ID: {self.user_info['id']}")
+            self._log(f"Logged in successfully as: {username}")
+            self._log(f"User ID: {self.user_info['id']}")
             return True
 
         return False
@@ -117,10 +132,10 @@ class ChatAPIClient:
     def get_token_info(self):
         """Get information about the current token."""
         if not self.access_token:
-            print("Error: Not logged in")
+            self._log("Error: Not logged in")
             return None
 
-        response = requests.get(
+        response = self.session.get(
             f"{self.base_url}/api/auth/token-info",
             headers=self._get_headers(include_auth=True)
         )
@@ -135,9 +150,9 @@ class ChatAPIClient:
             expires_at = datetime.fromtimestamp(token_info["expires_at"]).strftime('%Y-%m-%d %H:%M:%S')
             refresh_at = datetime.fromtimestamp(token_info["refresh_at"]).strftime('%Y-%m-%d %H:%M:%S')
 
-            print(f"Token issued at: {issued_at}")
-            print(f"Token expires at: {expires_at}")
-            print(f"Token should be refreshed at: {refresh_at}")
+            self._log(f"Token issued at: {issued_at}")
+            self._log(f"Token expires at: {expires_at}")
+            self._log(f"Token should be refreshed at: {refresh_at}")
 
             return token_info
 
@@ -150,7 +165,7 @@ class ChatAPIClient:
 
         current_time = int(time.time())
         if current_time >= self.refresh_at:
-            print("\n=== Refreshing token ===")
+            self._log("\n=== Refreshing token ===")
             return self.refresh_access_token()
 
         return False
@@ -158,14 +173,14 @@ class ChatAPIClient:
     def refresh_access_token(self):
         """Refresh the access token using the refresh token."""
         if not self.refresh_token:
-            print("Error: No refresh token available")
+            self._log("Error: No refresh token available")
             return False
 
         payload = {
             "refresh_token": self.refresh_token
         }
 
-        response = requests.post(
+        response = self.session.post(
             f"{self.base_url}/api/auth/refresh",
             headers=self._get_headers(),
             json=payload
@@ -174,7 +189,7 @@ class ChatAPIClient:
         data = self._handle_response(response)
         if data and data.get("status") == "success":
             self.access_token = data["data"]["access_token"]
-            print("Access token refreshed successfully")
+            self._log("Access token refreshed successfully")
 
             # Update token info
             self.get_token_info()
@@ -185,16 +200,16 @@ class ChatAPIClient:
     def logout(self):
         """Logout and invalidate the refresh token."""
         if not self.refresh_token:
-            print("Error: Not logged in")
+            self._log("Error: Not logged in")
             return False
 
-        print("\n=== Logging out ===")
+        self._log("\n=== Logging out ===")
 
         payload = {
             "refresh_token": self.refresh_token
         }
 
-        response = requests.post(
+        response = self.session.post(
             f"{self.base_url}/api/auth/logout",
             headers=self._get_headers(),
             json=payload
@@ -206,29 +221,57 @@ class ChatAPIClient:
             self.refresh_token = None
             self.user_info = None
             self.refresh_at = None
-            print("Logged out successfully")
+            self._log("Logged out successfully")
+            return True
+
+        return False
+
+    def logout_all(self):
+        """Logout from every session by invalidating all refresh tokens of the user."""
+        if not self.access_token:
+            self._log("Error: Not logged in")
+            return False
+
+        # Check if token needs refreshing
+        self.refresh_token_if_needed()
+
+        self._log("\n=== Logging out of all sessions ===")
+
+        response = self.session.post(
+            f"{self.base_url}/api/auth/logout-all",
+            headers=self._get_headers(include_auth=True)
+        )
+
+        data = self._handle_response(response)
+        if data and data.get("status") == "success":
+            self.access_token = None
+            self.refresh_token = None
+            self.user_info = None
+            self.refresh_at = None
+            self._log(f"Logged out of {data['data']['revoked_sessions']} sessions successfully")
             return True
 
         return False
 
-    def send_message(self, content, recipient_id=None):
+    def send_message(self, content, recipient_id=None, attachments=None):
         """Send a new message.
 
         Args:
             content: The content of the message
             recipient_id: Optional recipient user ID for private messages
+            attachments: Optional list of hashes of uploaded attachments
         """
         if not self.access_token:
-            print("Error: Not logged in")
+            self._log("Error: Not logged in")
             return None
 
         # Check if token needs refreshing
         self.refresh_token_if_needed()
 
         if recipient_id:
-            print(f"\n=== Sending private message to user {recipient_id} ===")
+            self._log(f"\n=== Sending private message to user {recipient_id} ===")
         else:
-            print(f"\n=== Sending public message ===")
+            self._log(f"\n=== Sending public message ===")
 
         payload = {
             "content": content
@@ -237,7 +280,10 @@ class ChatAPIClient:
         if recipient_id:
             payload["recipient_id"] = recipient_id
 
-        response = requests.post(
+        if attachments:
+            payload["attachments"] = attachments
+
+        response = self.session.post(
             f"{self.base_url}/api/messages",
             headers=self._get_headers(include_auth=True),
             json=payload
@@ -246,31 +292,179 @@ class ChatAPIClient:
         data = self._handle_response(response)
         if data and data.get("status") == "success":
             message = data["data"]
-            print(f"Message sent: {message['id']}")
+            self._log(f"Message sent: {message['id']}")
             return message
 
         return None
 
-    def get_messages(self):
-        """Get all messages."""
+    def fetch_messages(self, message_ids):
+        """Get several messages by ID with one request.
+
+        Args:
+            message_ids: The IDs of the messages to get
+
+        Returns:
+            The response data with 'messages', 'not_found' and 'forbidden', or None on error
+        """
         if not self.access_token:
-            print("Error: Not logged in")
+            self._log("Error: Not logged in")
+            return None
+
+        # Check if token needs refreshing
+        self.refresh_token_if_needed()
+
+        self._log(f"\n=== Fetching {len(message_ids)} messages by ID ===")
+
+        response = self.session.post(
+            f"{self.base_url}/api/messages/fetch",
+            headers=self._get_headers(include_auth=True),
+            json={"ids": message_ids}
+        )
+
+        data = self._handle_response(response)
+        if data and data.get("status") == "success":
+            self._log(f"Fetched {len(data['messages'])} messages")
+            return data
+
+        return None
+
+    def send_messages_batch(self, messages):
+        """Send several messages with one request.
+
+        Args:
+            messages: List of dictionaries with 'content' and optional 'recipient_id'
+
+        Returns:
+            The batch data with 'created', 'failed' and per-message 'results', or None on error
+        """
+        if not self.access_token:
+            self._log("Error: Not logged in")
+            return None
+
+        # Check if token needs refreshing
+        self.refresh_token_if_needed()
+
+        self._log(f"\n=== Sending batch of {len(messages)} messages ===")
+
+        response = self.session.post(
+            f"{self.base_url}/api/messages/batch",
+            headers=self._get_headers(include_auth=True),
+            json={"messages": messages}
+        )
+
+        data = self._handle_response(response)
+        if data and data.get("status") == "success":
+            batch = data["data"]
+            self._log(f"Created {batch['created']} messages, {batch['failed']} failed")
+            return batch
+
+        return None
+
+    def upload_attachment(self, path, content_type="application/octet-stream"):
+        """Upload a file as an attachment, streaming it from disk.
+
+        Args:
+            path: The path of the file to upload
+            content_type: The MIME type of the file
+
+        Returns:
+            The attachment with its 'hash', or None on error
+        """
+        if not self.access_token:
+            self._log("Error: Not logged in")
+            return None
+
+        # Check if token needs refreshing
+        self.refresh_token_if_needed()
+
+        self._log(f"\n=== Uploading attachment: {path} ===")
+
+        headers = self._get_headers(include_auth=True)
+        headers["Content-Type"] = content_type
+
+        with open(path, "rb") as f:
+            response = self.session.post(
+                f"{self.base_url}/api/attachments",
+                headers=headers,
+                data=f
+            )
+
+        data = self._handle_response(response)
+        if data and data.get("status") == "success":
+            attachment = data["data"]
+            self._log(f"Attachment uploaded: {attachment['hash']}")
+            return attachment
+
+        return None
+
+    def download_attachment(self, attachment_hash, path):
+        """Download an attachment to a file, streaming it to disk.
+
+        Args:
+            attachment_hash: The hash of the attachment
+            path: The path to write the attachment to
+
+        Returns:
+            The number of bytes written, or None on error
+        """
+        if not self.access_token:
+            self._log("Error: Not logged in")
+            return None
+
+        # Check if token needs refreshing
+        self.refresh_token_if_needed()
+
+        self._log(f"\n=== Downloading attachment: {attachment_hash} ===")
+
+        with self.session.get(
+            f"{self.base_url}/api/attachments/{attachment_hash}",
+            headers=self._get_headers(include_auth=True),
+            stream=True
+        ) as response:
+            if response.status_code >= 400:
+                self._handle_response(response)
+                return None
+
+            size = 0
+            with open(path, "wb") as f:
+                for chunk in response.iter_content(chunk_size=64 * 1024):
+                    f.write(chunk)
+                    size += len(chunk)
+
+        self._log(f"Downloaded {size} bytes to {path}")
+        return size
+
+    def get_messages(self, fields=None, limit=None):
+        """Get all messages, or only the most recent ones.
+
+        Args:
+            fields: Optional list of the message fields to include
+            limit: Optional maximum number of messages to get
+        """
+        if not self.access_token:
+            self._log("Error: Not logged in")
             return []
 
         # Check if token needs refreshing
         self.refresh_token_if_needed()
 
-        print("\n=== Getting all messages ===")
+        self._log("\n=== Getting all messages ===")
 
-        response = requests.get(
+        params = {}
+        if fields:
+            params['fields'] = ','.join(fields)
+        if limit is not None:
+            params['limit'] = limit
+        response = self.session.get(
             f"{self.base_url}/api/messages",
+            params=params,
             headers=self._get_headers(include_auth=True)
         )
 
         data = self._handle_response(response)
         if data and data.get("status") == "success":
             messages = data["messages"]
-            print(f"Retrieved {len(messages)} messages")
+            self._log(f"Retrieved {len(messages)} messages")
             return messages
 
         return []
@@ -278,15 +472,15 @@ class ChatAPIClient:
     def get_my_messages(self):
         """Get messages by the authenticated user."""
         if not self.access_token:
-            print("Error: Not logged in")
+            self._log("Error: Not logged in")
             return []
 
         # Check if token needs refreshing
         self.refresh_token_if_needed()
 
-        print("\n=== Getting my messages ===")
+        self._log("\n=== Getting my messages ===")
 
-        response = requests.get(
+        response = self.session.get(
             f"{self.base_url}/api/messages/me",
             headers=self._get_headers(include_auth=True)
         )
@@ -294,7 +488,104 @@ class ChatAPIClient:
         data = self._handle_response(response)
         if data and data.get("status") == "success":
             messages = data["messages"]
-            print(f"Retrieved {len(messages)} of your messages")
+            self._log(f"Retrieved {len(messages)} of your messages")
+            return messages
+
+        return []
+
+    def mark_read(self, cursor, user_id=None):
+        """Mark messages as read up to a cursor.
+
+        Args:
+            cursor: The seq of the last message read
+            user_id: Only mark the conversation with this user as read
+
+        Returns:
+            The updated unread counts, or None on error
+        """
+        if not self.access_token:
+            self._log("Error: Not logged in")
+            return None
+
+        # Check if token needs refreshing
+        self.refresh_token_if_needed()
+
+        self._log(f"\n=== Marking messages read up to {cursor} ===")
+
+        payload = {"cursor": cursor}
+        if user_id:
+            payload["user_id"] = user_id
+
+        response = self.session.post(
+            f"{self.base_url}/api/messages/read",
+            headers=self._get_headers(include_auth=True),
+            json=payload
+        )
+
+        data = self._handle_response(response)
+        if data and data.get("status") == "success":
+            return data["data"]
+
+        return None
+
+    def get_unread(self):
+        """Get the unread message counts of the current user.
+
+        Returns:
+            The counts with 'total', 'public' and 'conversations', or None on error
+        """
+        if not self.access_token:
+            self._log("Error: Not logged in")
+            return None
+
+        # Check if token needs refreshing
+        self.refresh_token_if_needed()
+
+        self._log("\n=== Getting unread counts ===")
+
+        response = self.session.get(
+            f"{self.base_url}/api/unread",
+            headers=self._get_headers(include_auth=True)
+        )
+
+        data = self._handle_response(response)
+        if data and data.get("status") == "success":
+            counts = data["data"]
+            self._log(f"{counts['total']} unread messages")
+            return counts
+
+        return None
+
+    def search_messages(self, query, limit=None):
+        """Search the messages viewable by the authenticated user.
+
+        Args:
+            query: The search terms; messages must contain every term
+            limit: Optional maximum number of messages to return
+        """
+        if not self.access_token:
+            self._log("Error: Not logged in")
+            return []
+
+        # Check if token needs refreshing
+        self.refresh_token_if_needed()
+
+        self._log(f"\n=== Searching messages for: {query} ===")
+
+        params = {"q": query}
+        if limit:
+            params["limit"] = limit
+
+        response = self.session.get(
+            f"{self.base_url}/api/messages/search",
+            headers=self._get_headers(include_auth=True),
+            params=params
+        )
+
+        data = self._handle_response(response)
+        if data and data.get("status") == "success":
+            messages = data["messages"]
+            self._log(f"Found {len(messages)} matching messages")
             return messages
 
         return []
@@ -302,15 +593,15 @@ class ChatAPIClient:
     def get_message(self, message_id):
         """Get a specific message by ID."""
         if not self.access_token:
-            print("Error: Not logged in")
+            self._log("Error: Not logged in")
             return None
 
         # Check if token needs refreshing
         self.refresh_token_if_needed()
 
-        print(f"\n=== Getting message: {message_id} ===")
+        self._log(f"\n=== Getting message: {message_id} ===")
 
-        response = requests.get(
+        response = self.session.get(
             f"{self.base_url}/api/messages/{message_id}",
             headers=self._get_headers(include_auth=True)
         )
@@ -318,7 +609,7 @@ class ChatAPIClient:
         data = self._handle_response(response)
         if data and data.get("status") == "success":
             message = data["data"]
-            print(f"Retrieved message: {message['id']}")
+            self._log(f"Retrieved message: {message['id']}")
             return message
 
         return None
@@ -326,26 +617,238 @@ class ChatAPIClient:
     def delete_message(self, message_id):
         """Delete a message by ID."""
         if not self.access_token:
-            print("Error: Not logged in")
+            self._log("Error: Not logged in")
             return False
 
         # Check if token needs refreshing
         self.refresh_token_if_needed()
 
-        print(f"\n=== Deleting message: {message_id} ===")
+        self._log(f"\n=== Deleting message: {message_id} ===")
 
-        response = requests.delete(
+        response = self.session.delete(
             f"{self.base_url}/api/messages/{message_id}",
             headers=self._get_headers(include_auth=True)
         )
 
         data = self._handle_response(response)
         if data and data.get("status") == "success":
-            print(f"Message deleted: {message_id}")
+            self._log(f"Message deleted: {message_id}")
             return True
 
         return False
 
+    def sync_messages(self, since=0):
+        """Get the messages created and deleted since a sync cursor.
+
+        Args:
+            since: The last_seq returned by the previous sync (0 for everything)
+
+        Returns:
+            The sync data with 'messages', 'deleted' and 'last_seq', or None on error
+        """
+        if not self.access_token:
+            self._log("Error: Not logged in")
+            return None
+
+        # Check if token needs refreshing
+        self.refresh_token_if_needed()
+
+        self._log(f"\n=== Syncing messages since {since} ===")
+
+        response = self.session.get(
+            f"{self.base_url}/api/sync",
+            headers=self._get_headers(include_auth=True),
+            params={"since": since}
+        )
+
+        data = self._handle_response(response)
+        if data and data.get("status") == "success":
+            changes = data["data"]
+            self._log(f"Synced {len(changes['messages'])} new and {len(changes['deleted'])} deleted messages")
+            return changes
+
+        return None
+
+    def get_conversations(self, limit=None, cursor=None):
+        """Get the authenticated user's direct conversations, most recently active first.
+
+        Returns:
+            A tuple of the conversations and the cursor of the next page (None on the last page)
+        """
+        if not self.access_token:
+            self._log("Error: Not logged in")
+            return [], None
+
+        # Check if token needs refreshing
+        self.refresh_token_if_needed()
+
+        self._log("\n=== Getting conversations ===")
+
+        params = {}
+        if limit:
+            params["limit"] = limit
+        if cursor is not None:
+            params["cursor"] = cursor
+
+        response = self.session.get(
+            f"{self.base_url}/api/conversations",
+            headers=self._get_headers(include_auth=True),
+            params=params
+        )
+
+        data = self._handle_response(response)
+        if data and data.get("status") == "success":
+            conversations = data["conversations"]
+            self._log(f"Retrieved {len(conversations)} conversations")
+            return conversations, data["next_cursor"]
+
+        return [], None
+
+    def get_conversation(self, user_id, limit=None, cursor=None):
+        """Get the private messages exchanged with another user.
+
+        Returns:
+            A tuple of the messages (oldest first) and the cursor of the previous page (None at the start)
+        """
+        if not self.access_token:
+            self._log("Error: Not logged in")
+            return [], None
+
+        # Check if token needs refreshing
+        self.refresh_token_if_needed()
+
+        self._log(f"\n=== Getting conversation with user {user_id} ===")
+
+        params = {}
+        if limit:
+            params["limit"] = limit
+        if cursor is not None:
+            params["cursor"] = cursor
+
+        response = self.session.get(
+            f"{self.base_url}/api/conversations/{user_id}",
+            headers=self._get_headers(include_auth=True),
+            params=params
+        )
+
+        data = self._handle_response(response)
+        if data and data.get("status") == "success":
+            messages = data["messages"]
+            self._log(f"Retrieved {len(messages)} messages")
+            return messages, data["next_cursor"]
+
+        return [], None
+
+    def create_room(self, name, retention_days=None):
+        """Create a new chat room and join it, optionally with its own message retention in days."""
+        if not self.access_token:
+            self._log("Error: Not logged in")
+            return None
+
+        # Check if token needs refreshing
+        self.refresh_token_if_needed()
+
+        self._log(f"\n=== Creating room: {name} ===")
+
+        payload = {"name": name}
+        if retention_days is not None:
+            payload["retention_days"] = retention_days
+
+        response = self.session.post(
+            f"{self.base_url}/api/rooms",
+            headers=self._get_headers(include_auth=True),
+            json=payload
+        )
+
+        data = self._handle_response(response)
+        if data and data.get("status") == "success":
+            room = data["data"]
+            self._log(f"Room created: {room['id']}")
+            return room
+
+        return None
+
+    def join_room(self, room_id):
+        """Join a chat room."""
+        return self._room_membership(room_id, "join")
+
+    def leave_room(self, room_id):
+        """Leave a chat room."""
+        return self._room_membership(room_id, "leave")
+
+    def _room_membership(self, room_id, action):
+        """Join or leave a chat room."""
+        if not self.access_token:
+            self._log("Error: Not logged in")
+            return False
+
+        # Check if token needs refreshing
+        self.refresh_token_if_needed()
+
+        self._log(f"\n=== {action.capitalize()} room: {room_id} ===")
+
+        response = self.session.post(
+            f"{self.base_url}/api/rooms/{room_id}/{action}",
+            headers=self._get_headers(include_auth=True)
+        )
+
+        data = self._handle_response(response)
+        if data and data.get("status") == "success":
+            self._log(data["message"])
+            return True
+
+        return False
+
+    def send_room_message(self, room_id, content):
+        """Post a message to a chat room."""
+        if not self.access_token:
+            self._log("Error: Not logged in")
+            return None
+
+        # Check if token needs refreshing
+        self.refresh_token_if_needed()
+
+        self._log(f"\n=== Sending message to room {room_id} ===")
+
+        response = self.session.post(
+            f"{self.base_url}/api/rooms/{room_id}/messages",
+            headers=self._get_headers(include_auth=True),
+            json={"content": content}
+        )
+
+        data = self._handle_response(response)
+        if data and data.get("status") == "success":
+            message = data["data"]
+            self._log(f"Message sent: {message['id']}")
+            return message
+
+        return None
+
+    def get_room_messages(self, room_id, limit=None):
+        """Get the messages of a chat room."""
+        if not self.access_token:
+            self._log("Error: Not logged in")
+            return []
+
+        # Check if token needs refreshing
+        self.refresh_token_if_needed()
+
+        self._log(f"\n=== Getting messages of room {room_id} ===")
+
+        response = self.session.get(
+            f"{self.base_url}/api/rooms/{room_id}/messages",
+            headers=self._get_headers(include_auth=True),
+            params={"limit": limit} if limit else None
+        )
+
+        data = self._handle_response(response)
+        if data and data.get("status") == "success":
+            messages = data["messages"]
+            self._log(f"Retrieved {len(messages)} room messages")
+            return messages
+
+        return []
+
     def print_message(self, message):
         """Print a message in a formatted way."""
         if not message:
@@ -0,0 +1,178 @@
+"""
+Inbox timelines for the 0xC Chat application.
+
+Messages are fanned out on write: a private message is appended to the
+timelines of its sender and its recipient, and a public message to a
+single timeline shared by every user. A user's view of the messages is
+the merge of their own timeline with the public one, so reading it is a
+slice of precomputed lists instead of a scan of the message store.
+
+The timelines are persisted next to the JSON data files as a snapshot
+plus an append-only log of changes since the snapshot. Run this module
+with --rebuild to regenerate them from the message store:
+
+    python timelines.py --rebuild
+"""
+
+import argparse
+import bisect
+import os
+from typing import Dict, List, Any, Optional
+from message_index import MessageIndex
+from env import DATA_DIR
+
+# File paths for the persisted timelines
+TIMELINES_FILE = os.path.join(DATA_DIR, "timelines.json")
+TIMELINES_LOG_FILE = os.path.join(DATA_DIR, "timelines.log")
+
+def _new_timeline() -> Dict[str, list]:
+    """Create an empty timeline of parallel sequence number and ID lists."""
+    return {'seqs': [], 'ids': []}
+
+def _merge_tail(first: Dict[str, list], second: Dict[str, list], cursor: Optional[int],
+                limit: Optional[int]) -> List[str]:
+    """Merge the end of two timelines, oldest first.
+
+    Only entries with a sequence number below cursor are merged, and only
+    the last limit of them. The timelines are walked backwards from the
+    cursor, so the cost is proportional to limit rather than to their length.
+    """
+    if cursor is None:
+        i, j = len(first['seqs']), len(second['seqs'])
+    else:
+        i, j = bisect.bisect_left(first['seqs'], cursor), bisect.bisect_left(second['seqs'], cursor)
+    if limit is None:
+        limit = i + j
+
+    merged = []
+    while len(merged) < limit and (i or j):
+        if j == 0 or (i and first['seqs'][i - 1] >= second['seqs'][j - 1]):
+            i -= 1
+            merged.append(first['ids'][i])
+        else:
+            j -= 1
+            merged.append(second['ids'][j])
+    merged.reverse()
+    return merged
+
+
+class _TimelineIndex(MessageIndex):
+    """Per-user timelines of private messages and a shared timeline of public messages.
+
+    entries maps each message ID to [seq, user_id, recipient_id], which is
+    all that is needed to place the message on its timelines or remove
+    it, and is what the snapshot holds.
+    """
+
+    snapshot_file = TIMELINES_FILE
+    log_file = TIMELINES_LOG_FILE
+
+    def __init__(self):
+        super().__init__()
+        self._reset()
+
+    def _reset(self) -> None:
+        """Empty the index."""
+        self.public: Dict[str, list] = _new_timeline()
+        self.users: Dict[str, Dict[str, list]] = {}
+        self.entries: Dict[str, list] = {}
+
+    def _timelines(self, entry: list) -> List[Dict[str, list]]:
+        """Get the timelines a message belongs to, creating them if needed."""
+        _, user_id, recipient_id = entry
+        if recipient_id is None:
+            return [self.public]
+        timelines = [self.users.setdefault(user_id, _new_timeline())]
+        if recipient_id != user_id:
+            timelines.append(self.users.setdefault(recipient_id, _new_timeline()))
+        return timelines
+
+    def _add_entry(self, message_id: str, entry: list) -> bool:
+        """Append a message to its timelines. Returns False if it was already there."""
+        if message_id in self.entries:
+            return False
+        self.entries[message_id] = entry
+        seq = entry[0]
+        for timeline in self._timelines(entry):
+            # Messages almost always arrive in sequence order, so this is an append
+            position = bisect.bisect_right(timeline['seqs'], seq)
+            timeline['seqs'].insert(position, seq)
+            timeline['ids'].insert(position, message_id)
+        return True
+
+    def _insert(self, message: Dict[str, Any]) -> bool:
+        """Fan a stored message out to its timelines."""
+        entry = [message.get('seq') or 0, message['user_id'], message.get('recipient_id')]
+        return self._add_entry(message['id'], entry)
+
+    def _delete(self, message_id: str) -> bool:
+        """Remove a message from its timelines."""
+        entry = self.entries.pop(message_id, None)
+        if entry is None:
+            return False
+        seq = entry[0]
+        for timeline in self._timelines(entry):
+            position = bisect.bisect_left(timeline['seqs'], seq)
+            while timeline['ids'][position] != message_id:
+                position += 1
+            del timeline['seqs'][position]
+            del timeline['ids'][position]
+        return True
+
+    def _dump(self) -> Dict[str, list]:
+        """Get the timeline entries for a snapshot."""
+        return self.entries
+
+    def _restore(self, data: Dict[str, list]) -> None:
+        """Rebuild the timelines from the entries of a snapshot."""
+        for message_id, entry in sorted(data.items(), key=lambda item: item[1][0]):
+            self._add_entry(message_id, entry)
+
+    def get_viewable(self, user_id: str, limit: Optional[int] = None,
+                     cursor: Optional[int] = None) -> List[str]:
+        """Get the IDs of the messages a user can view, oldest first.
+
+        Args:
+            user_id: The user whose view to get
+            limit: Maximum number of messages to return (the most recent ones before the cursor)
+            cursor: Only return messages older than this sequence number
+        """
+        with self.lock:
+            self._catch_up()
+            private = self.users.get(user_id) or _new_timeline()
+            return _merge_tail(private, self.public, cursor, limit)
+
+_index = _TimelineIndex()
+
+def add_message(message: Dict[str, Any]) -> None:
+    """Fan a newly stored message out to its timelines."""
+    _index.add(message)
+
+def add_messages(messages: List[Dict[str, Any]]) -> None:
+    """Fan a batch of newly stored messages out to their timelines."""
+    _index.add_many(messages)
+
+def remove_message(message_id: str) -> None:
+    """Remove a deleted message from its timelines."""
+    _index.remove(message_id)
+
+def rebuild() -> int:
+    """Rebuild the timelines from the message store, returning the number of messages placed."""
+    _index.rebuild()
+    return len(_index.entries)
+
+def get_viewable(user_id: str, limit: Optional[int] = None, cursor: Optional[int] = None) -> List[str]:
+    """Get the IDs of the messages a user can view before a cursor, oldest first."""
+    return _index.get_viewable(user_id, limit, cursor)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Manage the inbox timelines of the 0xC Chat application')
+    parser.add_argument('--rebuild', action='store_true', help='regenerate the timelines from the message store')
+    args = parser.parse_args()
+
+    if args.rebuild:
+        count = rebuild()
+        print(f"Rebuilt timelines from {count} messages")
+    else:
+        parser.print_help()
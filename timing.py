@@ -0,0 +1,163 @@
+"""
+Per-request timing instrumentation for the 0xC Chat API.
+
+Spans time the phases of a request: the API key and token checks, each
+json_storage call, the model methods and JSON serialization. The time
+spent in each span is summed per request and returned to the client in a
+Server-Timing header, e.g.:
+
+    Server-Timing: auth.jwt;dur=0.08, storage.get_user_by_id;dur=0.41,
+                   model.Message.get_viewable_by_user;dur=1.92, serialize;dur=0.6;desc="2 calls", total;dur=3.5
+
+Spans nest, so a span's time includes the spans it contains. Only a
+SERVER_TIMING_SAMPLE_RATE share of requests is timed; outside a timed
+request a span costs a single context variable lookup.
+"""
+
+import contextvars
+import functools
+import inspect
+import random
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, List, Optional
+from flask.json.provider import DefaultJSONProvider
+from env import SERVER_TIMING_SAMPLE_RATE
+
+
+class _RequestTimings:
+    """The time spent in each span of a request, in seconds, and how many times it was entered."""
+
+    __slots__ = ('start', 'spans')
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.spans: Dict[str, List[float]] = {}
+
+    def add(self, name: str, seconds: float) -> None:
+        """Add the time of one call of a span to the request's total for that span."""
+        entry = self.spans.get(name)
+        if entry is None:
+            self.spans[name] = [seconds, 1]
+        else:
+            entry[0] += seconds
+            entry[1] += 1
+
+_current: contextvars.ContextVar[Optional[_RequestTimings]] = contextvars.ContextVar('request_timings', default=None)
+
+def start_request(sample_rate: float = SERVER_TIMING_SAMPLE_RATE) -> bool:
+    """Start timing the current request if it is sampled. Returns whether it is."""
+    if sample_rate <= 0 or (sample_rate < 1 and random.random() >= sample_rate):
+        _current.set(None)
+        return False
+    _current.set(_RequestTimings())
+    return True
+
+def end_request() -> Optional[Dict[str, Any]]:
+    """Stop timing the current request.
+
+    Returns:
+        The 'total' duration of the request and the duration and count of
+        each of its 'spans', in seconds, or None if it was not timed.
+    """
+    timings = _current.get()
+    if timings is None:
+        return None
+    _current.set(None)
+    return {
+        'total': time.perf_counter() - timings.start,
+        'spans': {name: tuple(entry) for name, entry in timings.spans.items()}
+    }
+
+def server_timing_header(result: Dict[str, Any]) -> str:
+    """Format the result of end_request as a Server-Timing header value, durations in milliseconds."""
+    parts = []
+    for name, (seconds, count) in result['spans'].items():
+        part = f'{name};dur={seconds * 1000:.2f}'
+        if count > 1:
+            part += f';desc="{count} calls"'
+        parts.append(part)
+    parts.append(f"total;dur={result['total'] * 1000:.2f}")
+    return ', '.join(parts)
+
+@contextmanager
+def span(name: str):
+    """Time a block of code as a span of the current request."""
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, time.perf_counter() - start)
+
+def timed(name: str) -> Callable:
+    """Decorator timing each call of a function as a span of the current request."""
+    def decorator(f):
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            timings = _current.get()
+            if timings is None:
+                return f(*args, **kwargs)
+
+            start = time.perf_counter()
+            try:
+                return f(*args, **kwargs)
+            finally:
+                timings.add(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+def instrument_functions(namespace: Dict[str, Any], prefix: str, exclude: Iterable[str] = ()) -> None:
+    """Time every public function defined in a module as a span named prefix.<function>.
+
+    Call it at the end of the module with globals(), so calls between the
+    module's own functions are timed too.
+    """
+    excluded = set(exclude)
+    for name, value in list(namespace.items()):
+        if (inspect.isfunction(value) and value.__module__ == namespace['__name__']
+                and not name.startswith('_') and name not in excluded):
+            namespace[name] = timed(f'{prefix}.{name}')(value)
+
+def instrument_class(cls: type, prefix: str, exclude: Iterable[str] = ()) -> None:
+    """Time every public classmethod and staticmethod of a class as a span named prefix.<method>.
+
+    Instance methods are left untimed, as are the methods in exclude,
+    which should name those called once per object of a listing.
+    """
+    excluded = set(exclude)
+    for name, value in list(vars(cls).items()):
+        if name.startswith('_') or name in excluded:
+            continue
+        if isinstance(value, classmethod):
+            setattr(cls, name, classmethod(timed(f'{prefix}.{name}')(value.__func__)))
+        elif isinstance(value, staticmethod):
+            setattr(cls, name, staticmethod(timed(f'{prefix}.{name}')(value.__func__)))
+
+
+class TimedJSONProvider(DefaultJSONProvider):
+    """JSON provider timing the serialization of jsonify responses."""
+
+    def response(self, *args, **kwargs):
+        with span('serialize'):
+            return super().response(*args, **kwargs)
+
+
+def init_app(app) -> None:
+    """Time the app's requests and add a Server-Timing header to each sampled response."""
+    app.json = TimedJSONProvider(app)
+
+    @app.before_request
+    def start_timing():
+        start_request()
+
+    @app.after_request
+    def add_server_timing(response):
+        result = end_request()
+        if result is not None:
+            response.headers['Server-Timing'] = server_timing_header(result)
+        return response
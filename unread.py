@@ -0,0 +1,204 @@
+"""
+Unread message counters for the 0xC Chat application.
+
+Each user has a read marker: a sequence number up to which every message
+has been read, plus optional markers further ahead for single
+conversations. The private messages each user has not read yet are kept
+per conversation and updated as messages are added and deleted or
+markers move, so unread counts are read off counters instead of being
+counted over the message history.
+
+Public messages are unread by every user but their sender, so rather
+than fanning them out to every user they are kept on one shared list;
+a user's unread public count is the number of public messages after
+their marker, found by binary search, less their own.
+"""
+
+import bisect
+from typing import Dict, List, Any, Optional
+import json_storage
+from message_index import MessageIndex
+
+_EMPTY_MARKER = {'all': 0, 'conversations': {}}
+
+
+class _UnreadIndex(MessageIndex):
+    """Unread counters derived from the message store and the read markers.
+
+    entries maps each message ID to [seq, user_id, recipient_id].
+    public_seqs and public_ids list every public message in sequence
+    order, and own_public maps each user to their own public messages
+    after their marker. unread maps each user to the unread private
+    messages (ID to seq) of each conversation, with their total in totals.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.markers: Dict[str, Dict[str, Any]] = {}
+        self.markers_version = None
+        self._reset()
+
+    def _reset(self) -> None:
+        """Empty the index."""
+        self.entries: Dict[str, list] = {}
+        self.public_seqs: List[int] = []
+        self.public_ids: List[str] = []
+        self.own_public: Dict[str, Dict[str, int]] = {}
+        self.unread: Dict[str, Dict[str, Dict[str, int]]] = {}
+        self.totals: Dict[str, int] = {}
+
+    def _marker(self, user_id: str, other_user_id: Optional[str] = None) -> int:
+        """Get the sequence number up to which a user has read all messages, or one conversation."""
+        marker = self.markers.get(user_id, _EMPTY_MARKER)
+        if other_user_id is None:
+            return marker['all']
+        return max(marker['all'], marker['conversations'].get(other_user_id, 0))
+
+    def _insert(self, message: Dict[str, Any]) -> bool:
+        """Count a stored message as unread by the users who have not read past it."""
+        message_id = message['id']
+        if message_id in self.entries:
+            return False
+
+        seq, sender_id, recipient_id = message.get('seq') or 0, message['user_id'], message.get('recipient_id')
+        self.entries[message_id] = [seq, sender_id, recipient_id]
+
+        if recipient_id is None:
+            position = bisect.bisect_right(self.public_seqs, seq)
+            self.public_seqs.insert(position, seq)
+            self.public_ids.insert(position, message_id)
+            if seq > self._marker(sender_id):
+                self.own_public.setdefault(sender_id, {})[message_id] = seq
+        elif recipient_id != sender_id and seq > self._marker(recipient_id, sender_id):
+            self.unread.setdefault(recipient_id, {}).setdefault(sender_id, {})[message_id] = seq
+            self.totals[recipient_id] = self.totals.get(recipient_id, 0) + 1
+        return True
+
+    def _delete(self, message_id: str) -> bool:
+        """Stop counting a deleted message."""
+        entry = self.entries.pop(message_id, None)
+        if entry is None:
+            return False
+
+        seq, sender_id, recipient_id = entry
+        if recipient_id is None:
+            position = bisect.bisect_left(self.public_seqs, seq)
+            while self.public_ids[position] != message_id:
+                position += 1
+            del self.public_seqs[position]
+            del self.public_ids[position]
+            own = self.own_public.get(sender_id)
+            if own is not None and own.pop(message_id, None) is not None and not own:
+                del self.own_public[sender_id]
+        else:
+            conversations = self.unread.get(recipient_id, {})
+            unread = conversations.get(sender_id)
+            if unread is not None and unread.pop(message_id, None) is not None:
+                self.totals[recipient_id] -= 1
+                self._drop_if_empty(recipient_id, sender_id)
+        return True
+
+    def _drop_if_empty(self, user_id: str, other_user_id: str) -> None:
+        """Remove a conversation without unread messages from a user's counters."""
+        conversations = self.unread[user_id]
+        if not conversations[other_user_id]:
+            del conversations[other_user_id]
+        if not conversations:
+            del self.unread[user_id]
+            del self.totals[user_id]
+
+    def _apply_marker(self, user_id: str) -> None:
+        """Stop counting the messages a user has read according to their current marker."""
+        own = self.own_public.get(user_id)
+        if own is not None:
+            marker = self._marker(user_id)
+            own = {message_id: seq for message_id, seq in own.items() if seq > marker}
+            if own:
+                self.own_public[user_id] = own
+            else:
+                del self.own_public[user_id]
+
+        for other_user_id, unread in list(self.unread.get(user_id, {}).items()):
+            marker = self._marker(user_id, other_user_id)
+            remaining = {message_id: seq for message_id, seq in unread.items() if seq > marker}
+            self.totals[user_id] -= len(unread) - len(remaining)
+            self.unread[user_id][other_user_id] = remaining
+            self._drop_if_empty(user_id, other_user_id)
+
+    def _refresh_markers(self) -> None:
+        """Pick up read markers moved since they were last loaded, including by other processes."""
+        version = json_storage.get_read_markers_version()
+        if version is not None and version == self.markers_version:
+            return
+
+        markers = json_storage.get_read_markers()
+        previous, self.markers, self.markers_version = self.markers, markers, version
+        for user_id, marker in markers.items():
+            if previous.get(user_id) != marker:
+                self._apply_marker(user_id)
+
+    def _rebuild_from(self, last_seq: int, messages: List[Dict[str, Any]]) -> None:
+        """Load the current read markers, then rebuild the counters from the messages."""
+        self._refresh_markers()
+        super()._rebuild_from(last_seq, messages)
+
+    def _catch_up(self) -> None:
+        """Load moved read markers, then apply the changes made to the message store."""
+        self._refresh_markers()
+        super()._catch_up()
+
+    def get_counts(self, user_id: str) -> Dict[str, Any]:
+        """Get a user's unread message counts.
+
+        Returns:
+            A dictionary with the 'total' number of unread messages, the
+            unread 'public' messages and the unread private messages of
+            each conversation by the other user's ID in 'conversations'.
+        """
+        with self.lock:
+            self._catch_up()
+            public = (len(self.public_seqs) - bisect.bisect_right(self.public_seqs, self._marker(user_id))
+                      - len(self.own_public.get(user_id, ())))
+            conversations = {
+                other_user_id: len(unread) for other_user_id, unread in self.unread.get(user_id, {}).items()
+            }
+            return {
+                'total': public + self.totals.get(user_id, 0),
+                'public': public,
+                'conversations': conversations
+            }
+
+    def mark_read(self, user_id: str, seq: int, other_user_id: Optional[str] = None) -> None:
+        """Move a user's read marker forward and stop counting the messages it covers."""
+        with self.lock:
+            self._catch_up()
+            json_storage.set_read_marker(user_id, seq, other_user_id)
+            self.markers = json_storage.get_read_markers()
+            self.markers_version = json_storage.get_read_markers_version()
+            self._apply_marker(user_id)
+
+_index = _UnreadIndex()
+
+def add_message(message: Dict[str, Any]) -> None:
+    """Count a newly stored message as unread."""
+    _index.add(message)
+
+def add_messages(messages: List[Dict[str, Any]]) -> None:
+    """Count a batch of newly stored messages as unread."""
+    _index.add_many(messages)
+
+def remove_message(message_id: str) -> None:
+    """Stop counting a deleted message."""
+    _index.remove(message_id)
+
+def rebuild() -> None:
+    """Rebuild the unread counters from the message store and read markers."""
+    _index.rebuild()
+
+def get_counts(user_id: str) -> Dict[str, Any]:
+    """Get a user's unread message counts, overall, for public messages and per conversation."""
+    return _index.get_counts(user_id)
+
+def mark_read(user_id: str, seq: int, other_user_id: Optional[str] = None) -> None:
+    """Mark a user's messages, or one conversation, as read up to a sequence number."""
+    _index.mark_read(user_id, seq, other_user_id)